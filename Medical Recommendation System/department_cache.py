@@ -0,0 +1,160 @@
+# department_cache.py — persistent disease -> department cache for diagnosis_server.get_department_by_evidence
+import os, csv, time, sqlite3, logging, threading
+from collections import OrderedDict
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+# 内存 LRU 的条目上限；SQLite 文件不设上限（一个疾病一行，几万个也只有几 MB）
+DEPARTMENT_CACHE_SIZE = int(os.getenv("DEPARTMENT_CACHE_SIZE", "2048"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS departments(
+    model      TEXT NOT NULL,
+    disease    TEXT NOT NULL,   -- _disease_key 后的疾病名
+    department TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (model, disease)
+);
+"""
+
+def _disease_key(name: Optional[str]) -> str:
+    """lower + trim + 折叠空格，同 doctor_index._norm；"Migraine " 与 "migraine" 是同一个键"""
+    return " ".join((name or "").split()).casefold()
+
+def _read_preload(path: str) -> dict[str, str]:
+    """已知映射：两列 disease,department 的 CSV（有表头），与模型无关，优先于模型的回答"""
+    out: dict[str, str] = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for r in csv.DictReader(f):
+            key, dept = _disease_key(r.get("disease")), (r.get("department") or "").strip()
+            if key and dept:
+                out[key] = dept
+    return out
+
+class DepartmentCache:
+    """
+    疾病 -> 科室：预置表 → 内存 LRU → SQLite 文件 → 都没有才问模型（由调用方问，问到后 put + save）。
+    键为 (模型, _disease_key(疾病))，换模型不会用到旧模型的答案；预置表不分模型。
+    get / put 只碰内存，在事件循环里直接调；load / save 读写磁盘，调用方放到线程池里跑。
+    path 为空时只有内存一层（进程退出即丢）。
+    """
+
+    def __init__(self, path: str = "", size: int = DEPARTMENT_CACHE_SIZE, preload: str = ""):
+        self.path = path
+        self.size = max(1, size)
+        self._lru: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"preload_hits": 0, "hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0,
+                       "writes": 0, "disk_errors": 0}
+        self._preload: dict[str, str] = {}
+        if preload:
+            try:
+                self._preload = _read_preload(preload)
+                log.info("Department preload: %d mappings from %s", len(self._preload), preload)
+            except OSError as e:
+                log.warning("Department preload %s unreadable (%s); ignored", preload, e)
+        self._con: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                # 只在 DEPARTMENT_IO 的单个线程里读写，但建连接的是导入模块的线程
+                self._con = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._con.executescript(_SCHEMA)
+            except sqlite3.Error as e:
+                log.warning("Department cache %s unusable (%s); memory only", path, e)
+                self._con = None
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def get(self, model: str, key: str) -> Optional[str]:
+        """预置表或内存命中返回科室，否则 None（接着 load）"""
+        with self._lock:
+            hit = self._preload.get(key)
+            if hit is not None:
+                self._stats["preload_hits"] += 1
+                return hit
+            hit = self._lru.get((model, key))
+            if hit is not None:
+                self._lru.move_to_end((model, key))
+                self._stats["hits"] += 1
+            return hit
+
+    def put(self, model: str, key: str, department: str) -> None:
+        with self._lock:
+            self._lru[(model, key)] = department
+            self._lru.move_to_end((model, key))
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def load(self, model: str, key: str) -> Optional[str]:
+        """查磁盘（阻塞）；命中放进 LRU，没命中记一次 miss（调用方随后去问模型）"""
+        hit = None
+        if self._con is not None:
+            try:
+                row = self._con.execute("SELECT department FROM departments WHERE model = ? AND disease = ?",
+                                        (model, key)).fetchone()
+                hit = row[0] if row else None
+            except sqlite3.Error as e:
+                log.warning("Department cache read failed: %s", e)
+                self._stats["disk_errors"] += 1
+        if hit is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        self.put(model, key, hit)
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        return hit
+
+    def load_many(self, model: str, keys: list[str]) -> dict[str, str]:
+        """批量版 load：一次线程池往返查完一批"""
+        return {key: dept for key in keys if (dept := self.load(model, key)) is not None}
+
+    def save(self, model: str, key: str, department: str) -> None:
+        """写磁盘（阻塞）；失败只记日志，内存里的条目照常可用"""
+        if self._con is None:
+            return
+        try:
+            self._con.execute("INSERT OR REPLACE INTO departments(model, disease, department, created_at)"
+                              " VALUES (?, ?, ?, ?)", (model, key, department, time.time()))
+            self._stats["writes"] += 1
+        except sqlite3.Error as e:
+            log.warning("Department cache write failed: %s", e)
+            self._stats["disk_errors"] += 1
+
+    def save_many(self, model: str, departments: dict[str, str]) -> None:
+        """批量版 save：{键: 科室}，一个事务写完"""
+        if self._con is None or not departments:
+            return
+        now = time.time()
+        try:
+            with self._con:
+                self._con.execute("BEGIN")
+                self._con.executemany("INSERT OR REPLACE INTO departments(model, disease, department, created_at)"
+                                      " VALUES (?, ?, ?, ?)", [(model, k, d, now) for k, d in departments.items()])
+            self._stats["writes"] += len(departments)
+        except sqlite3.Error as e:
+            log.warning("Department cache write failed: %s", e)
+            self._stats["disk_errors"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        served = s["preload_hits"] + s["hits"] + s["disk_hits"]
+        total = served + s["misses"]
+        disk = None
+        if self._con is not None:
+            try:
+                disk = self._con.execute("SELECT COUNT(*) FROM departments").fetchone()[0]
+            except sqlite3.Error:
+                pass
+        return {"path": self.path or None, "entries": len(self), "max_entries": self.size,
+                "disk_entries": disk, "preloaded": len(self._preload), **s,
+                "hit_ratio": round(served / total, 4) if total else None}
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
@@ -0,0 +1,197 @@
+# doctor_pool.py — memory-backend replicas in worker processes, so lookups don't hold the server's GIL
+import queue, logging, threading, multiprocessing
+from typing import Iterable, Optional
+
+from doctor_index import DoctorIndex
+from doctor_geo import CityGazetteer
+from doctor_view import TopNView
+from doctor_hospitals import HospitalTable
+
+log = logging.getLogger(__name__)
+
+# 副本上允许调用的方法（工具用到的查询与状态）
+_METHODS = {"query", "explain", "top_hospitals", "query_batch", "page", "status"}
+
+def assemble(index, csv_path: str):
+    """服务端索引的附件，服务进程与副本用同一套：中心点表、top-N 视图、医院聚合"""
+    # 离线城市中心点表（CSV 同目录 city_centroids.csv，DOCTOR_GEO_GAZETTEER 可改路径）：
+    # 存在时城市内无结果先按距离往外找（nearby），不存在则行为不变
+    index.attach_gazetteer(CityGazetteer.load(csv_path))
+    # 预计算的 top-N 视图（CSV 同目录 <csv>.topn.json，DOCTOR_DB_VIEW 可改路径，由 doctor_view.py 生成）：
+    # 精确命中 (专科, city, state) 的查询直接查表；视图与数据版本不符时不用，之后的增量只作废它改到的地点上的键
+    index.attach_view(TopNView.load(csv_path))
+    # 按 (医院, 地点, 专科) 预聚合医生数与评分，find_top_hospitals 不再逐行分组；增量随 with_delta 更新
+    index.attach_hospital_stats(HospitalTable.build(index))
+    return index
+
+def _replica_main(conn, csv_path: str, deltas: list) -> None:
+    """工作进程：建副本、按顺序重放增量后回 ("ok", 版本)，再循环处理 (方法名, 参数)"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        index = assemble(DoctorIndex.load(csv_path), csv_path)
+        for ops in deltas:
+            index.apply_delta(ops)
+        conn.send(("ok", index.version))
+    except Exception as e:
+        conn.send(("err", f"{type(e).__name__}: {e}"))
+        return
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        method, args = msg
+        try:
+            if method == "delta":
+                index.apply_delta(args[0])
+                out = index.version
+            elif method == "view_stats":
+                out = index.view.stats() if index.view else None
+            elif method in _METHODS:
+                out = getattr(index, method)(*args)
+            else:
+                raise ValueError(f"unknown replica method: {method}")
+            conn.send(("ok", out))
+        except ValueError as e:
+            # 参数错误（如失效的 cursor）原样交给调用方
+            conn.send(("value", str(e)))
+        except Exception as e:
+            log.exception("Replica call %s failed", method)
+            conn.send(("err", f"{type(e).__name__}: {e}"))
+
+class ReplicaPool:
+    """
+    DoctorIndex 的查询是纯 Python：放在线程池里也全程持有 GIL，调用之间不并行，事件循环也要排队等 GIL。
+    这里开 procs 个工作进程（spawn），每个按 assemble 建一份完整副本（mmap 同一份快照），
+    再按顺序重放服务进程应用过的增量批次，版本与服务进程的索引逐字相同。
+    call() 把一次查询发给空闲的副本，调用线程在管道上等结果时释放 GIL；apply() 把增量广播给全部副本。
+    acquire / release / close 同 ShardedDoctorIndex：换下后等登记过的调用都结束才停进程。
+    """
+
+    def __init__(self, csv_path: str, procs: int, deltas: Iterable[list] = ()):
+        self.source = csv_path
+        self.deltas = [list(ops) for ops in deltas]
+        ctx = multiprocessing.get_context("spawn")
+        self._conns, self._procs = [], []
+        for i in range(max(1, int(procs))):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_replica_main, name=f"doctor-replica-{i}", daemon=True,
+                               args=(child, csv_path, self.deltas))
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        self._idle: queue.Queue = queue.Queue()
+        # 占住全部副本（广播、关闭）的调用串行：两个同时逐个去占，各占一半就互相等死
+        self._all = threading.Lock()
+        self._users, self._users_lock = {"calls": 0, "closing": False}, threading.Lock()
+        try:
+            versions = {self._recv(i) for i in range(len(self._conns))}
+        except Exception:
+            self._shutdown(idle=False)
+            raise
+        self.version = versions.pop()
+        if versions:
+            self._shutdown(idle=False)
+            raise RuntimeError("doctor replicas disagree on the data version")
+        for i in range(len(self._conns)):
+            self._idle.put(i)
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def _recv(self, i: int, reply: Optional[tuple] = None):
+        kind, val = self._conns[i].recv() if reply is None else reply
+        if kind == "value":
+            raise ValueError(val)
+        if kind != "ok":
+            raise RuntimeError(f"doctor replica failed: {val}")
+        return val
+
+    def call(self, method: str, *args):
+        """在一个空闲副本上执行 index.method(*args)；都在忙时排队等第一个空出来的"""
+        i = self._idle.get()
+        try:
+            self._conns[i].send((method, args))
+            return self._recv(i)
+        finally:
+            self._idle.put(i)
+
+    def _each(self, method: str, *args) -> list:
+        """占住全部副本（等进行中的调用结束）再逐个发同一个调用，结果按副本编号顺序返回"""
+        with self._all:
+            held = [self._idle.get() for _ in self._conns]
+        try:
+            for i in held:
+                self._conns[i].send((method, args))
+            # 先把每个副本的回包都收下，某个出错时其它管道里也不会留着没读的回包
+            replies = {i: self._conns[i].recv() for i in held}
+            return [self._recv(i, replies[i]) for i in range(len(self._conns))]
+        finally:
+            for i in held:
+                self._idle.put(i)
+
+    def apply(self, ops: list) -> str:
+        """把一批增量（服务进程应用的同一份记录）应用到全部副本，返回副本的新版本"""
+        versions = set(self._each("delta", list(ops)))
+        self.deltas.append(list(ops))
+        self.version = versions.pop()
+        if versions:
+            raise RuntimeError("doctor replicas disagree on the data version")
+        return self.version
+
+    def view_stats(self) -> Optional[dict]:
+        """各副本的 top-N 视图命中数加总（视图本身相同）"""
+        stats = [s for s in self._each("view_stats") if s]
+        if not stats:
+            return None
+        hits, misses = sum(s["hits"] for s in stats), sum(s["misses"] for s in stats)
+        return {**stats[0], "hits": hits, "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None}
+
+    def status(self) -> dict:
+        return {"replicas": len(self._conns), "replica_pids": [p.pid for p in self._procs],
+                "replica_deltas": len(self.deltas)}
+
+    def acquire(self) -> None:
+        """登记一个进行中的调用（服务端在取索引引用的同一把锁下登记），结束时 release"""
+        with self._users_lock:
+            if self._users["closing"]:
+                raise RuntimeError("doctor replicas are closed")
+            self._users["calls"] += 1
+
+    def release(self) -> None:
+        with self._users_lock:
+            self._users["calls"] -= 1
+            last = self._users["closing"] and not self._users["calls"]
+        if last:
+            threading.Thread(target=self._shutdown, name="doctor-replicas-close", daemon=True).start()
+
+    def close(self) -> None:
+        """停掉工作进程；还有登记过的调用时推迟到最后一个 release 之后"""
+        with self._users_lock:
+            if self._users["closing"]:
+                return
+            self._users["closing"] = True
+            busy = self._users["calls"]
+        if not busy:
+            self._shutdown()
+
+    def _shutdown(self, idle: bool = True) -> None:
+        # 先占住全部副本：没登记的直接调用正在进行时也等它收完
+        with self._all:
+            held = [self._idle.get() for _ in self._conns] if idle else []
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (OSError, ValueError):
+                pass
+            conn.close()
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for i in held:
+            self._idle.put(i)
@@ -0,0 +1,578 @@
+# doctor_sqlite.py — SQLite/FTS5 storage backend for find_doctor_server (DOCTOR_DB_BACKEND=sqlite)
+import os, copy, json, time, sqlite3, hashlib, logging, threading
+from typing import Iterable, List, Optional, Union
+
+from doctor_index import (DoctorRecord, _DoctorQueries, _SpecialityResolver, _credentials, _delta_path, _norm,
+                          _read_delta, _read_rows)
+
+log = logging.getLogger(__name__)
+
+# 3：meta 记下 base_rows 与累计的增量改动（delta_places / delta_new_specs），见 _view_now
+# 4：doctor_text 索引归一化后的 hospital_n（与随后的 instr(hospital_n, ?) 比的是同一个串）
+SCHEMA_VERSION = "4"
+
+_SCHEMA = """
+CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE specialities(id INTEGER PRIMARY KEY, norm TEXT UNIQUE NOT NULL);
+CREATE TABLE doctors(
+    id            INTEGER PRIMARY KEY,   -- CSV 行序
+    rank          REAL NOT NULL,         -- 全局名次：average_score 降序，其次医院名、医生名（同 DoctorIndex）
+    name          TEXT NOT NULL,
+    speciality    TEXT NOT NULL,
+    average_score REAL NOT NULL,
+    hospital_name TEXT NOT NULL,
+    city          TEXT NOT NULL,
+    state         TEXT NOT NULL,
+    name_n        TEXT NOT NULL,
+    hospital_n    TEXT NOT NULL,
+    city_n        TEXT NOT NULL,
+    state_n       TEXT NOT NULL,
+    spec_id       INTEGER NOT NULL REFERENCES specialities(id)
+);
+"""
+
+# 复合索引与 DoctorIndex 的分区一一对应。排序键（average_score 降序，其次医院名、
+# 医生名）在建库时算成 rank 列放在索引末尾，ORDER BY rank LIMIT k 直接按索引顺序取前 k 行。
+_INDEXES = """
+CREATE INDEX ix_doctors_state_city ON doctors(state_n, city_n, spec_id, rank);
+CREATE INDEX ix_doctors_city ON doctors(city_n, spec_id, rank);
+CREATE INDEX ix_doctors_state ON doctors(state_n, spec_id, rank);
+CREATE INDEX ix_doctors_spec ON doctors(spec_id, rank);
+CREATE INDEX ix_doctors_rank ON doctors(rank);
+-- 增量更新用：按排序键找插入位置、按 name + hospital 找要替换 / 删除的行
+CREATE INDEX ix_doctors_key ON doctors(average_score, hospital_n, name_n, rank);
+CREATE INDEX ix_doctors_ident ON doctors(hospital_n, name_n);
+"""
+
+# 专科 / 医院全文（trigram = 任意子串）；专科解析已改用常驻的 _SpecialityResolver，speciality_fts 留作即席查询。
+# 医院列索引 _norm 后的 hospital_n：医院过滤的 MATCH 预筛与 instr(hospital_n, ?) 对同一个串，预筛不会漏掉
+# 原值里多个空格等写法不同的行
+_FTS = """
+CREATE VIRTUAL TABLE speciality_fts USING fts5(norm, content='specialities', content_rowid='id', tokenize='trigram');
+INSERT INTO speciality_fts(rowid, norm) SELECT id, norm FROM specialities;
+CREATE VIRTUAL TABLE doctor_text USING fts5(speciality, hospital_n, content='doctors', content_rowid='id', tokenize='trigram');
+INSERT INTO doctor_text(rowid, speciality, hospital_n) SELECT id, speciality, hospital_n FROM doctors;
+"""
+
+_ORDER = "ORDER BY rank"
+# 单条 UNION ALL 的子查询数上限（SQLite 默认 SQLITE_MAX_COMPOUND_SELECT = 500）
+_COMPOUND_CHUNK = 200
+_COLUMNS = "name, hospital_name, speciality, average_score, city, state"
+
+def _sqlite_path(csv_path: str) -> str:
+    return os.getenv("DOCTOR_DB_SQLITE") or csv_path + ".sqlite"
+
+def _delta_sig(path: str) -> Optional[str]:
+    """增量文件内容的 sha1：各进程对同一份文件算出同一个值，记在 meta 里表示库里已含这份增量"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def build_sqlite(csv_path: str, db_path: str, delta_path: Optional[str] = None) -> int:
+    """
+    从 CSV 建库：先写临时文件再原子替换，多个进程同时重建也互不干扰。
+    给了 delta_path 且文件存在时，增量在换上之前就应用进临时库，meta 记下它的 sha1，
+    之后各进程启动时看到同一份增量就不再写库
+    """
+    tmp = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    con = sqlite3.connect(tmp)
+    try:
+        con.executescript(_SCHEMA)
+        spec_ids: dict[str, int] = {}
+        batch = []
+        for r in _read_rows(csv_path):
+            sn = r.speciality_n
+            sid = spec_ids.get(sn)
+            if sid is None:
+                sid = spec_ids[sn] = len(spec_ids) + 1
+                con.execute("INSERT INTO specialities(id, norm) VALUES (?, ?)", (sid, sn))
+            batch.append([
+                len(batch) + 1, 0,
+                r.name, r.speciality, r.average_score, r.hospital_name, r.city, r.state,
+                r.name_n, r.hospital_n, r.city_n, r.state_n, sid,
+            ])
+        # 稳定排序，键相同时保持 CSV 行序
+        for rank, row in enumerate(sorted(batch, key=lambda b: (-b[4], b[9], b[8]))):
+            row[1] = rank
+        con.executemany(
+            "INSERT INTO doctors(id, rank, name, speciality, average_score, hospital_name, city, state,"
+            " name_n, hospital_n, city_n, state_n, spec_id) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            batch,
+        )
+        con.executescript(_INDEXES)
+        try:
+            con.executescript(_FTS)
+            fts = "1"
+        except sqlite3.OperationalError as e:
+            # 老版本 SQLite 没有 trigram 分词器：医院过滤退回 instr 扫描
+            log.warning("FTS5 trigram unavailable (%s); hospital filter falls back to instr()", e)
+            fts = "0"
+        con.executemany("INSERT INTO meta(key, value) VALUES (?, ?)", [
+            ("schema", SCHEMA_VERSION),
+            ("source", csv_path),
+            ("source_mtime", repr(os.path.getmtime(csv_path)) if os.path.exists(csv_path) else "0"),
+            ("rows", str(len(batch))),
+            ("base_rows", str(len(batch))),
+            ("fts", fts),
+        ])
+        con.commit()
+        sig = _delta_sig(delta_path) if delta_path else None
+        if sig is not None:
+            with con:
+                stats = _apply_ops(con, _read_delta(delta_path), fts == "1")[0]
+                con.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('delta', ?)", (sig,))
+            log.info("Doctor delta %s folded into %s: %s", delta_path, db_path, stats)
+        con.execute("ANALYZE")
+        rows = con.execute("SELECT COUNT(*) FROM doctors").fetchone()[0]
+    finally:
+        con.close()
+    os.replace(tmp, db_path)
+    return rows
+
+def _apply_ops(con: sqlite3.Connection, ops: Iterable[tuple[str, DoctorRecord]], fts: bool) -> tuple[dict, list, list]:
+    """
+    在 con 的当前写事务里应用一批增量，meta 的 rows / delta_seq 随之更新，
+    并累计记下自建库以来增量改到的地点（delta_places）与是否带来过新专科（delta_new_specs），供 top-N 视图作废用。
+    返回 (统计, 删掉的行, 新增的行)，行为 (医院, city, state, 专科, average_score)，供 HospitalTable.updated
+    """
+    spec_ids = {n: i for i, n in con.execute("SELECT id, norm FROM specialities")}
+    n_specs = len(spec_ids)
+    stats, touched = {"upserted": 0, "deleted": 0, "missing": 0}, set()
+    removed, added = [], []
+    for kind, r in ops:
+        key = (r.name_n, r.hospital_n)
+        if kind == "delete" or key not in touched:
+            hits = _delete(con, r, fts)
+            removed += [(h[2], h[3], h[4], h[1], h[5]) for h in hits]
+            if kind == "delete":
+                stats["deleted"] += len(hits)
+                stats["missing"] += not hits
+        touched.add(key)
+        if kind == "upsert":
+            _insert(con, r, spec_ids, fts)
+            added.append((r.hospital_name, r.city, r.state, r.speciality, r.average_score))
+            stats["upserted"] += 1
+    meta = dict(con.execute("SELECT key, value FROM meta"))
+    rows = con.execute("SELECT COUNT(*) FROM doctors").fetchone()[0]
+    places = {tuple(p) for p in json.loads(meta.get("delta_places", "[]"))}
+    places |= {(_norm(r[1]), _norm(r[2])) for r in (*removed, *added)}
+    new_specs = meta.get("delta_new_specs") == "1" or len(spec_ids) != n_specs
+    con.executemany("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", [
+        ("rows", str(rows)), ("delta_seq", str(int(meta.get("delta_seq", 0)) + 1)),
+        ("delta_places", json.dumps(sorted(places))), ("delta_new_specs", "1" if new_specs else "0")])
+    return stats, removed, added
+
+def _delete(con: sqlite3.Connection, r: DoctorRecord, fts: bool) -> list[tuple]:
+    """删掉该医生在该医院的全部行，返回 [(id, speciality, hospital_name, city, state, average_score), ...]"""
+    hits = con.execute("SELECT id, speciality, hospital_name, city, state, average_score FROM doctors"
+                       " WHERE hospital_n = ? AND name_n = ?", (r.hospital_n, r.name_n)).fetchall()
+    if hits:
+        if fts:
+            con.executemany("INSERT INTO doctor_text(doctor_text, rowid, speciality, hospital_n)"
+                            " VALUES ('delete', ?, ?, ?)", [(h[0], h[1], r.hospital_n) for h in hits])
+        con.executemany("DELETE FROM doctors WHERE id = ?", [(h[0],) for h in hits])
+    return hits
+
+def _insert(con: sqlite3.Connection, r: DoctorRecord, spec_ids: dict[str, int], fts: bool) -> None:
+    sid = spec_ids.get(r.speciality_n)
+    if sid is None:
+        sid = spec_ids[r.speciality_n] = len(spec_ids) + 1
+        con.execute("INSERT INTO specialities(id, norm) VALUES (?, ?)", (sid, r.speciality_n))
+        if fts:
+            con.execute("INSERT INTO speciality_fts(rowid, norm) VALUES (?, ?)", (sid, r.speciality_n))
+    # 后继：排序键大于新行的第一行（同分数内按医院、医生名；否则取下一个更低分数的第一行），
+    # 两步都走 ix_doctors_key；前驱是后继之前的最后一个 rank
+    score, after = r.average_score, (r.hospital_n, r.name_n)
+    nxt = "SELECT rank FROM doctors WHERE average_score = ?{} ORDER BY hospital_n, name_n, rank LIMIT 1"
+    hit = con.execute(nxt.format(" AND (hospital_n, name_n) > (?, ?)"), (score, *after)).fetchone()
+    if hit is None:
+        lower = con.execute("SELECT MAX(average_score) FROM doctors WHERE average_score < ?", (score,)).fetchone()[0]
+        hit = con.execute(nxt.format(""), (lower,)).fetchone() if lower is not None else None
+    if hit is None:
+        last = con.execute("SELECT MAX(rank) FROM doctors").fetchone()[0]
+        rank = 0.0 if last is None else last + 1
+    else:
+        prev = con.execute("SELECT MAX(rank) FROM doctors WHERE rank < ?", hit).fetchone()[0]
+        rank = (hit[0] + (hit[0] - 1 if prev is None else prev)) / 2
+    cur = con.execute(
+        "INSERT INTO doctors(rank, name, speciality, average_score, hospital_name, city, state,"
+        " name_n, hospital_n, city_n, state_n, spec_id) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+        (rank, r.name, r.speciality, score, r.hospital_name, r.city, r.state,
+         r.name_n, r.hospital_n, r.city_n, r.state_n, sid))
+    if fts:
+        con.execute("INSERT INTO doctor_text(rowid, speciality, hospital_n) VALUES (?, ?, ?)",
+                    (cur.lastrowid, r.speciality, r.hospital_n))
+
+class SqliteDoctorIndex(_DoctorQueries):
+    """
+    与 DoctorIndex 接口一致（query / status / len），数据放在本地 SQLite 文件里：
+    不受内存大小限制，多个 MCP 子进程可以只读共享同一个库。
+    排序与放宽规则和 CSV 路径完全相同。
+    """
+
+    def __init__(self, db_path: str, source: str = "", load_ms: float = 0.0):
+        self.db_path = db_path
+        self.source = source
+        self.load_ms = load_ms
+        self.loaded_at = time.time()
+        self._local = threading.local()
+        meta = dict(self._con().execute("SELECT key, value FROM meta"))
+        if meta.get("schema") != SCHEMA_VERSION:
+            raise ValueError(f"unsupported doctor DB schema: {meta.get('schema')}")
+        self._rows = int(meta.get("rows", 0))
+        self._delta_seq = int(meta.get("delta_seq", 0))
+        self._fts = meta.get("fts") == "1"
+        self.source_mtime = float(meta.get("source_mtime", "0"))
+        # ANALYZE 写下的各索引前缀的平均每键行数，explain 用来估计命中行数
+        try:
+            self._stat1 = {idx: [int(x) for x in stat.split()[:5] if x.isdigit()]
+                           for idx, stat in self._con().execute("SELECT idx, stat FROM sqlite_stat1") if idx}
+        except sqlite3.Error:
+            self._stat1 = {}
+        # 专科只有几百个：解析器（含 TF-IDF 向量与 LRU）常驻内存，下标 i 对应 id = i + 1
+        self._spec_resolver = _SpecialityResolver(
+            [r[0] for r in self._con().execute("SELECT norm FROM specialities ORDER BY id")])
+
+    def attach_view(self, view) -> None:
+        """视图按 CSV 本身预计算；库里已折进增量时先按 meta 作废增量改到的键（_view_now）再挂"""
+        if view is not None and view.version != self.version:
+            view = self._view_now(view)
+        super().attach_view(view)
+
+    def _view_now(self, view, meta: Optional[dict] = None):
+        """
+        把同一份 CSV 上预计算的视图换到库的当前版本：去掉 meta 里累计的增量地点上的键。
+        用库里的累计记录而不是本进程看到的那一批，别的进程写的增量同样处理，各进程的视图一致；
+        视图不是这份 CSV 的，或增量带来过新专科（department 解析可能变）时返回 None
+        """
+        if meta is None:
+            meta = dict(self._con().execute("SELECT key, value FROM meta"))
+        if view.base != f"{self.source_mtime:.3f}:{meta.get('base_rows')}" or meta.get("delta_new_specs") == "1":
+            return None
+        return view.patched({tuple(p) for p in json.loads(meta.get("delta_places", "[]"))}, self.version)
+
+    @classmethod
+    def load(cls, csv_path: str) -> "SqliteDoctorIndex":
+        """库不存在、版本不符或源 CSV 更新时重建，否则直接打开"""
+        t0 = time.perf_counter()
+        db = _sqlite_path(csv_path)
+        if not cls._fresh(db, csv_path):
+            n = build_sqlite(csv_path, db, _delta_path(csv_path))
+            log.info("Doctor SQLite DB built: %d rows from %s -> %s", n, csv_path, db)
+        index = cls(db, source=csv_path, load_ms=(time.perf_counter() - t0) * 1000)
+        log.info("Doctor SQLite DB ready: %d rows in %s (%.1f ms)", len(index), db, index.load_ms)
+        return index
+
+    @staticmethod
+    def _fresh(db: str, csv_path: str) -> bool:
+        if not os.path.exists(db):
+            return False
+        try:
+            con = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+            try:
+                meta = dict(con.execute("SELECT key, value FROM meta"))
+            finally:
+                con.close()
+        except sqlite3.Error:
+            return False
+        if meta.get("schema") != SCHEMA_VERSION:
+            return False
+        if os.path.exists(csv_path):
+            return os.path.getmtime(csv_path) == float(meta.get("source_mtime", "0"))
+        return True
+
+    def _con(self) -> sqlite3.Connection:
+        # 每个线程一个只读连接
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            con.create_function("doctor_credentials", 1,
+                                lambda n: " ".join(sorted(_credentials(n))), deterministic=True)
+        return con
+
+    def __len__(self) -> int:
+        return self._rows
+
+    @property
+    def version(self) -> str:
+        base = f"{self.source_mtime:.3f}:{self._rows}"
+        return f"{base}+{self._delta_seq}" if self._delta_seq else base
+
+    def _is_state(self, state_l: str) -> bool:
+        return self._con().execute(
+            "SELECT 1 FROM doctors WHERE state_n = ? LIMIT 1", (state_l,)).fetchone() is not None
+
+    def _resolve(self, w: str) -> frozenset[int]:
+        """
+        department -> 专科编号，规则同 DoctorIndex._resolve（词首对齐的子串 ∪ 相似度）。
+        专科表只有几百行，直接用常驻的解析器，不再逐次查 speciality_fts。
+        """
+        return frozenset(c + 1 for c in self._spec_resolver.resolve(w))
+
+    def _spec_codes(self, want_specs: set[str]) -> Optional[set[int]]:
+        if not want_specs:
+            return None
+        codes: set[int] = set()
+        for w in want_specs:
+            codes |= self._resolve(w)
+        return codes
+
+    def _select(self, where: list[str], args: list, codes: Optional[set[int]], k: int,
+                plan: Optional[dict] = None) -> list[tuple]:
+        """
+        某个放宽层级的前 k 行。限定专科时每个专科一个子查询（spec_id = ? 精确命中
+        复合索引、按 rank 有序、各取前 k），UNION ALL 后再取前 k，相当于多路归并。
+        不写成 spec_id IN (...)：SQLite 3.40 上 IN + ORDER BY ... LIMIT 走这类索引时会漏行。
+        访问路径由 SQLite 自己的规划器按 ANALYZE 统计选；plan 不为 None 时记下它的 EXPLAIN QUERY PLAN。
+        """
+        cond = " AND ".join(where + ["spec_id = ?"] if codes is not None else where)
+        sub = f"SELECT rank, {_COLUMNS}, hospital_n, name_n, city_n, state_n FROM doctors{' WHERE ' + cond if cond else ''} {_ORDER} LIMIT ?"
+        con = self._con()
+        if codes is None:
+            if plan is not None:
+                self._query_plan(plan, sub, args + [k], 1)
+            return con.execute(sub, args + [k]).fetchall()
+        rows: list[tuple] = []
+        codes = sorted(codes)
+        for i in range(0, len(codes), _COMPOUND_CHUNK):
+            chunk = codes[i:i + _COMPOUND_CHUNK]
+            sql = " UNION ALL ".join(f"SELECT * FROM ({sub})" for _ in chunk) + f" {_ORDER} LIMIT ?"
+            params = [p for c in chunk for p in (*args, c, k)] + [k]
+            if plan is not None and not i:
+                self._query_plan(plan, sql, params, len(codes))
+            rows.extend(con.execute(sql, params).fetchall())
+        rows.sort(key=lambda r: r[0])
+        return rows[:k]
+
+    def _query_plan(self, plan: dict, sql: str, params: list, lists: int) -> None:
+        # 只留对真实表 / 索引的访问（每个 UNION 分支一条相同的 SEARCH，去重后通常只剩一两行）
+        detail = sorted({r[3] for r in self._con().execute("EXPLAIN QUERY PLAN " + sql, params)
+                         if r[3].startswith(("SEARCH", "SCAN", "USE TEMP")) and "(subquery" not in r[3]})
+        plan.update(driver="sqlite", lists=lists, detail=detail)
+
+    def _estimate(self, city_l: str, state_l: str, codes: Optional[set[int]]) -> Optional[int]:
+        """
+        按 sqlite_stat1 估计命中行数：取与等值条件对应的复合索引前缀的平均每键行数，
+        限定专科时再按专科个数相乘（与 SQLite 规划器用的是同一份统计）
+        """
+        idx, depth = {(True, True): ("ix_doctors_state_city", 2), (True, False): ("ix_doctors_city", 1),
+                      (False, True): ("ix_doctors_state", 1), (False, False): ("ix_doctors_spec", 0)}[
+                          (bool(city_l), bool(state_l))]
+        stat = self._stat1.get(idx) or []
+        if codes is not None:
+            depth += 1
+        if len(stat) <= depth:
+            return None
+        return stat[depth] * (len(codes) if codes is not None else 1)
+
+    def _count_rows(self, where: list[str], args: list, codes: Optional[set[int]]) -> int:
+        cond, args = list(where), list(args)
+        if codes is not None:
+            cond.append(f"spec_id IN ({','.join('?' * len(codes))})")
+            args += sorted(codes)
+        sql = "SELECT COUNT(*) FROM doctors" + (" WHERE " + " AND ".join(cond) if cond else "")
+        return self._con().execute(sql, args).fetchone()[0]
+
+    def _page(self, specs, city_l: str, state_l: str, flt: dict, after: Optional[dict],
+              k: int, offset: int, want_total: bool, plan: Optional[dict] = None):
+        """page() 的 SQLite 实现：精确位置条件 + 过滤条件，从 cursor 的名次之后按索引续读"""
+        codes = self._spec_codes({_norm(s) for s in specs})
+        if codes is not None and not codes:
+            return [], 0
+        where, args = [], []
+        if city_l:
+            where.append("city_n = ?"); args.append(city_l)
+        if state_l:
+            where.append("state_n = ?"); args.append(state_l)
+        if flt["min_score"] is not None:
+            where.append("average_score >= ?"); args.append(flt["min_score"])
+        if flt["credential"]:
+            where.append("instr(' ' || doctor_credentials(name) || ' ', ?) > 0"); args.append(f" {flt['credential']} ")
+        if flt["hospital"]:
+            h = flt["hospital"]
+            if self._fts and len(h) >= 3:
+                where.append("id IN (SELECT rowid FROM doctor_text WHERE hospital_n MATCH ?)")
+                args.append('"' + h.replace('"', '""') + '"')
+            where.append("instr(hospital_n, ?) > 0"); args.append(h)
+
+        total = self._count_rows(where, args, codes) if want_total else None
+
+        # 续读：同一数据版本直接按名次定位（走索引范围），否则按排序键定位
+        if after is not None:
+            if after.get("v") == self.version:
+                where.append("rank > ?"); args.append(after["r"])
+            else:
+                where.append("(-average_score, hospital_n, name_n) > (?, ?, ?)"); args += list(after["k"])
+
+        rows = self._select(where, args, codes, offset + k, plan)[offset:]
+        if plan is not None:
+            # 估计只看位置 / 专科的等值条件，评分 / 学位 / 医院过滤不在 sqlite_stat1 里
+            plan.update(est_rows=self._estimate(city_l, state_l, codes),
+                        actual_rows=total if total is not None else self._count_rows(where, args, codes))
+        return [
+            (r[0], (-r[4], r[7], r[8]),
+             {"name": r[1], "hospital_name": r[2], "speciality": r[3], "average_score": r[4],
+              "city": r[5], "state": r[6]})
+            for r in rows
+        ], total
+
+    def status(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "source": self.source,
+            "db": self.db_path,
+            "rows": len(self),
+            "load_ms": round(self.load_ms, 1),
+            "loaded_at": self.loaded_at,
+            "spec_cache": self._spec_resolver.resolve.cache_info()._asdict(),
+            "delta_seq": self._delta_seq,
+        }
+
+    def _ranked(self, specialities: List[str], city: Optional[str], state: Optional[str], k: int,
+                plan: Optional[dict] = None):
+        """同 DoctorIndex：city+state → city → state → 全国，返回最高的非空层级"""
+        codes = self._spec_codes({_norm(s) for s in (specialities or [])})
+        if codes is not None and not codes:
+            if plan is not None:
+                plan.update(driver="sqlite", est_rows=0, actual_rows=0)
+            return "nationwide", []
+        city_l, state_l = _norm(city), _norm(state)
+
+        tiers = []
+        if city_l and state_l:
+            tiers.append(("city_state", ["city_n = ?", "state_n = ?"], [city_l, state_l]))
+            if self.geo is not None:
+                tiers.append(("nearby", None, None))
+        if city_l:
+            tiers.append(("city", ["city_n = ?"], [city_l]))
+        if state_l:
+            tiers.append(("state", ["state_n = ?"], [state_l]))
+        tiers.append(("nationwide", [], []))
+
+        dist = None
+        for tier, where, args in tiers:
+            if tier == "nearby":
+                rows, dist = self._select_nearby(city_l, state_l, codes, k)
+            else:
+                rows = self._select(where, args, codes, k, plan)
+            if rows:
+                break
+        if plan is not None:
+            if tier == "nearby":
+                plan.update(driver="sqlite", places=len(dist), rows=len(rows))
+            else:
+                est_city = city_l if "city_n = ?" in where else ""
+                est_state = state_l if "state_n = ?" in where else ""
+                plan.update(est_rows=self._estimate(est_city, est_state, codes),
+                            actual_rows=self._count_rows(where, args, codes))
+        out = []
+        for r in rows:
+            row = {"name": r[1], "hospital_name": r[2], "speciality": r[3], "average_score": r[4],
+                   "city": r[5], "state": r[6]}
+            if tier == "nearby":
+                row["distance_miles"] = round(dist[(r[9], r[10])], 1)
+            out.append((r[0], row))
+        return tier, out
+
+    def _place_keys(self) -> set[tuple[str, str]]:
+        return set(self._con().execute("SELECT DISTINCT city_n, state_n FROM doctors").fetchall())
+
+    def _hospital_groups(self) -> Iterable[tuple]:
+        """同 DoctorIndex._hospital_groups，一条 GROUP BY 在库里聚合（average_score 为 0 视为没有评分）"""
+        return self._con().execute(
+            "SELECT hospital_name, city, state, speciality, COUNT(*), SUM(average_score > 0),"
+            " TOTAL(CASE WHEN average_score > 0 THEN average_score END)"
+            " FROM doctors GROUP BY hospital_name, city, state, speciality").fetchall()
+
+    def _select_nearby(self, city_l: str, state_l: str, codes: Optional[set[int]], k: int):
+        """nearby 层：按距离纳入周边城市直到满 k 位，再在这些城市里取评分前 k"""
+        spec = f" AND spec_id IN ({','.join('?' * len(codes))})" if codes is not None else ""
+        con = self._con()
+
+        def count(key):
+            return con.execute(f"SELECT COUNT(*) FROM doctors WHERE city_n = ? AND state_n = ?{spec}",
+                               [*key, *sorted(codes or ())]).fetchone()[0]
+
+        dist = {key: d for d, key in self._nearby(city_l, state_l, k, count)}
+        rows = [r for key in dist for r in self._select(["city_n = ?", "state_n = ?"], list(key), codes, k)]
+        rows.sort(key=lambda r: r[0])
+        return rows[:k], dist
+
+    # -------- incremental delta --------
+    def apply_delta(self, source: Union[str, Iterable[tuple[str, DoctorRecord]]]) -> dict:
+        """原地应用增量（同 DoctorIndex.apply_delta）：只用在尚未发布的索引上，正在服务的索引用 with_delta 换新对象"""
+        new, stats = self.with_delta(source)
+        self.__dict__.update(new.__dict__)
+        return stats
+
+    def with_delta(self, source: Union[str, Iterable[tuple[str, DoctorRecord]]]) -> tuple["SqliteDoctorIndex", dict]:
+        """
+        增量更新，返回 (新索引, 统计)，语义同 DoctorIndex.with_delta（name + hospital_name 为键，
+        某个键在一批里第一次出现时先删掉它现有的全部行）；新行的 rank 取排序键前后两行 rank 的中点，不重排已有行。
+        库文件由所有 MCP 进程共用，增量只写一次：先拿写锁（BEGIN IMMEDIATE）再比对 meta 里记的增量 sha1，
+        别的进程（或建库时）已经应用过同一份文件就不再写，只按库里的 meta 同步本进程的行数 / 版本 / 专科表 / 医院聚合，
+        各进程的 version 因此一致。source 为记录序列时（没有文件可比对）总是应用。
+        这些进程内状态在副本上换好（_synced），本对象不动，调用方一次赋值换上；库里什么都没变时返回本对象。
+        """
+        t0 = time.perf_counter()
+        sig = _delta_sig(source) if isinstance(source, str) else None
+        applied = None
+        con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                done = con.execute("SELECT value FROM meta WHERE key = 'delta'").fetchone()
+                if sig is None or done is None or done[0] != sig:
+                    ops = _read_delta(source) if isinstance(source, str) else source
+                    applied = _apply_ops(con, ops, self._fts)
+                    if sig is not None:
+                        con.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('delta', ?)", (sig,))
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        finally:
+            con.close()
+        stats = applied[0] if applied else {"upserted": 0, "deleted": 0, "missing": 0, "already_applied": True}
+        new = self._synced(applied)
+        stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        log.info("Doctor delta %d %s: %s", new._delta_seq, "applied" if applied else "already in the DB", stats)
+        return new, stats
+
+    def _synced(self, applied: Optional[tuple]) -> "SqliteDoctorIndex":
+        """
+        按库里的 meta 得到本进程状态的新副本（连接与 sqlite_stat1 共用）；本进程刚应用的按增减更新医院聚合，
+        别的进程应用的整表重算；top-N 视图按 meta 里的累计改动换到新版本。与本对象一致时返回本对象
+        """
+        meta = dict(self._con().execute("SELECT key, value FROM meta"))
+        rows, seq = int(meta.get("rows", 0)), int(meta.get("delta_seq", 0))
+        if applied is None and (rows, seq) == (self._rows, self._delta_seq):
+            return self
+        new = copy.copy(self)
+        norms = [r[0] for r in self._con().execute("SELECT norm FROM specialities ORDER BY id")]
+        if norms != self._spec_resolver.norms:
+            new._spec_resolver = _SpecialityResolver(norms)
+        new._rows, new._delta_seq = rows, seq
+        if self.hospital_stats is not None:
+            new.hospital_stats = (self.hospital_stats.updated(*applied[1:]) if applied
+                                  else type(self.hospital_stats).build(new))
+        if self.view is not None:
+            new.view = new._view_now(self.view, meta)
+        if self.geo is not None:
+            self.geo.index_places(new._place_keys())
+        return new
+
+if __name__ == "__main__":
+    # 预建库：python doctor_sqlite.py [CSV] [-o DB]
+    import argparse
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ap = argparse.ArgumentParser(description="Import the doctor CSV into the SQLite backend.")
+    ap.add_argument("csv", nargs="?", default=os.getenv("DOCTOR_DB_CSV", "medical_information.csv"))
+    ap.add_argument("-o", "--out", help="database path (default: $DOCTOR_DB_SQLITE or <csv>.sqlite)")
+    args = ap.parse_args()
+    db = args.out or _sqlite_path(args.csv)
+    log.info("Doctor SQLite DB built: %d rows -> %s", build_sqlite(args.csv, db, _delta_path(args.csv)), db)
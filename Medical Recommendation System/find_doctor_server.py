@@ -1,80 +1,254 @@
 # find_doctor_server.py — MCP server: CSV doctor finder by speciality + city/state (Top-5)
-import os, csv, logging
-from typing import List, Optional
+import os, sys, time, asyncio, logging, functools, threading, contextlib, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
 from mcp.server.fastmcp import FastMCP
 
+from doctor_index import DoctorIndex, _delta_path, _read_delta
+from doctor_sqlite import SqliteDoctorIndex
+from doctor_shards import ShardedDoctorIndex
+from doctor_pool import ReplicaPool, assemble
+from doctor_view import _view_path
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 log = logging.getLogger(__name__)
 
 mcp = FastMCP("Doctor Assistant")
 
 # 你的 CSV 路径（不设置则默认同目录下 medical_information.csv）
+# 启动时优先 mmap 同名 .snap 快照（DOCTOR_DB_SNAPSHOT 可改路径），CSV 更新后自动重建
 CSV_FILE_PATH = os.getenv("DOCTOR_DB_CSV", "medical_information.csv")
+# 存储后端：memory（默认，常驻内存索引）、sqlite（本地 SQLite 文件，DOCTOR_DB_SQLITE 可改路径）
+# 或 sharded（按州切到 DOCTOR_DB_SHARDS 个工作进程，默认每核一个，适合千万行级数据）
+DB_BACKEND = os.getenv("DOCTOR_DB_BACKEND", "memory").strip().lower()
+# CSV 变更检测周期（秒）；0 关闭热加载
+WATCH_SECONDS = float(os.getenv("DOCTOR_DB_WATCH_SECONDS", "5"))
+# 增量文件（默认 CSV 同名 .delta.csv，DOCTOR_DB_DELTA 可改路径）：与 CSV 同列外加可选的 op 列，
+# 变更时就地应用到常驻索引，不整份重建；CSV 本身变了才重建（重建后再应用一次增量）
+DELTA_FILE_PATH = _delta_path(CSV_FILE_PATH)
+# 工具调用里的阻塞工作（首次加载、查询、分页、状态统计）放到有界线程池里跑，事件循环只负责收发；
+# SQLite 查询、sharded 后端等待分片与 memory 后端等待副本时都会释放 GIL，慢调用不会卡住其它调用
+TOOL_WORKERS = max(1, int(os.getenv("DOCTOR_DB_WORKERS", "4")))
+_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="doctor-db")
+# memory 后端的查询是纯 Python，线程池里也全程持有 GIL：DOCTOR_DB_PROCS 个工作进程各持一份副本（doctor_pool），
+# 工具调用发给空闲的副本，线程在管道上等结果时释放 GIL。默认每核一个、不超过 TOOL_WORKERS；0 表示在本进程里查
+POOL_PROCS = max(0, int(os.getenv("DOCTOR_DB_PROCS") or min(TOOL_WORKERS, os.cpu_count() or 1)))
+
+# -------- resident index --------
+# 启动时加载一次，之后所有工具调用共享；_READY 置位表示索引已可用
+# CSV 变更后由后台线程整份重建，建好后一次赋值换掉 _INDEX：
+# 工具调用开头取一次引用（_use），进行中的调用继续用旧索引，不会读到建了一半的新索引
+_BACKENDS = {"memory": (DoctorIndex, "doctor_index.py"), "sqlite": (SqliteDoctorIndex, "doctor_sqlite.py"),
+             "sharded": (ShardedDoctorIndex, "doctor_shards.py")}
+AnyIndex = Union[DoctorIndex, SqliteDoctorIndex, ShardedDoctorIndex]
+_INDEX: Optional[AnyIndex] = None
+_POOL: Optional[ReplicaPool] = None  # memory 后端的副本，与 _INDEX 同版本，在 _INDEX_LOCK 下一起换
+_INDEX_LOCK = threading.Lock()
+_READY = threading.Event()
+_RELOAD = {"reloads": 0, "last_reload_ms": None, "last_reload_at": None, "last_error": None}
+_DELTA = {"deltas": 0, "last_delta": None, "last_delta_at": None, "last_delta_error": None}
+
+def _build_index() -> tuple[AnyIndex, Optional[ReplicaPool]]:
+    """建索引（及 memory 后端的副本）并应用增量，返回 (索引, 副本 或 None)"""
+    backend = _BACKENDS.get(DB_BACKEND, _BACKENDS["memory"])[0]
+    index = assemble(backend.load(CSV_FILE_PATH), CSV_FILE_PATH)
+    pool = None
+    if backend is DoctorIndex and POOL_PROCS:
+        try:
+            pool = ReplicaPool(CSV_FILE_PATH, POOL_PROCS)
+            if pool.version != index.version:
+                raise RuntimeError(f"replicas loaded {pool.version}, index is {index.version}")
+        except Exception:
+            log.exception("Doctor replicas unavailable; serving lookups in process")
+            if pool is not None:
+                pool.close()
+            pool = None
+    new, new_pool = _apply_delta(index, pool)
+    if pool is not None and new_pool is None:
+        pool.close()
+    return new, new_pool
+
+def _apply_delta(index: AnyIndex, pool: Optional[ReplicaPool] = None) -> tuple[AnyIndex, Optional[ReplicaPool]]:
+    """
+    增量文件存在就应用，返回应用后的 (索引, 副本)；失败时记下错误，返回原索引（保持应用前的状态）。
+    各后端都在副本上换好新状态（with_delta），原索引对象不改，正在用它的查询照常读完；
+    SQLite 库各进程共用，库里已含同一份增量时只同步行数与版本、不再写库。
+    有 memory 副本时先把记录读出来，本进程与各副本应用同一批；副本没跟上（版本不符或出错）时返回 None，
+    由调用方在换下后关掉，之后在本进程里查
+    """
+    if not os.path.exists(DELTA_FILE_PATH):
+        return index, pool
+    try:
+        source = list(_read_delta(DELTA_FILE_PATH)) if pool is not None else DELTA_FILE_PATH
+        index, stats = index.with_delta(source)
+    except Exception as e:
+        log.exception("Doctor delta %s failed", DELTA_FILE_PATH)
+        _DELTA["last_delta_error"] = f"{type(e).__name__}: {e}"
+        return index, pool
+    _DELTA.update(deltas=_DELTA["deltas"] + 1, last_delta=stats, last_delta_at=time.time(), last_delta_error=None)
+    if pool is not None:
+        try:
+            if pool.apply(source) != index.version:
+                raise RuntimeError(f"replicas at {pool.version}, index is {index.version}")
+        except Exception:
+            log.exception("Doctor replicas out of sync; serving lookups in process")
+            return index, None
+    return index, pool
+
+def _refresh_delta() -> None:
+    """增量文件变了：应用到当前索引，得到新对象时换上（同 _reload，一次赋值，工具调用各自持有取到的引用）"""
+    global _INDEX, _POOL
+    index = _get_index()
+    pool = _POOL
+    new, new_pool = _apply_delta(index, pool)
+    if new is not index or new_pool is not pool:
+        with _INDEX_LOCK:
+            # 热加载线程是唯一的写者（_reload 与增量串行），换上前 _INDEX 仍是 index
+            _INDEX, _POOL = new, new_pool
+    if pool is not None and new_pool is None:
+        pool.close()
+
+def _get_index() -> AnyIndex:
+    global _INDEX, _POOL
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                index, _POOL = _build_index()
+                _INDEX = index
+                _READY.set()
+    return _INDEX
+
+def _file_signature(path: str) -> Optional[tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _csv_signature() -> tuple[Optional[tuple[int, int]], Optional[tuple[int, int]]]:
+    """(CSV 签名, 增量文件签名)"""
+    return _file_signature(CSV_FILE_PATH), _file_signature(DELTA_FILE_PATH)
+
+def _prebuild() -> None:
+    """
+    CSV 解析 / 建库放到子进程里做（doctor_index.py / doctor_sqlite.py 的编译 CLI），
+    不和正在服务的线程抢 GIL；本进程随后只需 mmap 快照或打开新库。
+    子进程失败时 load() 会在本线程里自己重建。
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    module = _BACKENDS.get(DB_BACKEND, _BACKENDS["memory"])[1]
+    proc = subprocess.run([sys.executable, os.path.join(here, module), CSV_FILE_PATH], capture_output=True, text=True)
+    if proc.returncode:
+        log.warning("Background build failed (%s), rebuilding in process", proc.stderr.strip()[-300:])
+    # 部署了 top-N 视图就顺带按新 CSV 重算，否则换上的新索引会一直查不到视图
+    if os.path.exists(_view_path(CSV_FILE_PATH)):
+        proc = subprocess.run([sys.executable, os.path.join(here, "doctor_view.py"), CSV_FILE_PATH],
+                              capture_output=True, text=True)
+        if proc.returncode:
+            log.warning("Top-N view rebuild failed (%s); serving from the live index", proc.stderr.strip()[-300:])
+
+def _reload() -> None:
+    """重建索引并换上；失败或读到空表时保留旧索引"""
+    global _INDEX, _POOL
+    t0 = time.perf_counter()
+    pool = None
+    try:
+        _prebuild()
+        index, pool = _build_index()
+        if not len(index):
+            raise ValueError(f"{CSV_FILE_PATH} has no rows")
+    except Exception as e:
+        log.exception("Doctor DB reload failed; keeping the current index")
+        _RELOAD["last_error"] = f"{type(e).__name__}: {e}"
+        if pool is not None:
+            pool.close()
+        return
+    with _INDEX_LOCK:
+        old, old_pool = _INDEX, _POOL
+        _INDEX, _POOL = index, pool
+        _READY.set()
+    # sharded 后端与 memory 副本的旧工作进程在进行中的调用结束后退出：换下之后不会再有调用登记到它们上面，
+    # close 等已登记的调用都 release 了才真正停进程
+    for res in (old, old_pool):
+        if res is not None and hasattr(res, "close"):
+            res.close()
+    _RELOAD.update(reloads=_RELOAD["reloads"] + 1, last_reload_ms=round((time.perf_counter() - t0) * 1000, 1),
+                   last_reload_at=time.time(), last_error=None)
+    log.info("Doctor DB reloaded: %d rows, version %s (%.1f ms)", len(index), index.version, _RELOAD["last_reload_ms"])
+
+def _watch(seen: tuple, stop: threading.Event) -> None:
+    """
+    轮询 CSV 与增量文件的 (mtime, size)；连续两次看到同一组新签名（文件已写完）才动手：
+    CSV 变了整份重建（_build_index 里会再应用增量），只有增量文件变了就地应用
+    """
+    pending = None
+    while not stop.wait(WATCH_SECONDS):
+        sig = _csv_signature()
+        if sig[0] is None or sig == seen:
+            pending = None
+            continue
+        if sig != pending:
+            pending = sig
+            continue
+        if sig[0] != seen[0]:
+            _reload()
+        elif sig[1] is not None:
+            _refresh_delta()
+        seen, pending = sig, None
+
+def start_watcher(seen: Optional[tuple] = None) -> Optional[threading.Event]:
+    """启动热加载线程（守护线程），返回用于停止它的 Event；WATCH_SECONDS <= 0 时不启动"""
+    if WATCH_SECONDS <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_watch, args=(seen if seen is not None else _csv_signature(), stop),
+                     name="doctor-db-watcher", daemon=True).start()
+    return stop
+
+async def _run(fn, *args):
+    """在 _EXECUTOR 里执行阻塞函数并等待结果"""
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, functools.partial(fn, *args))
+
+@contextlib.contextmanager
+def _using():
+    """
+    取当前的 (索引, 副本)。取引用和登记（acquire：memory 副本与 sharded 后端才有）在 _INDEX_LOCK 下一起做，
+    与换索引互斥：调用要么登记在换下的对象上（它 close 时等这次 release），要么拿到新的
+    """
+    _get_index()
+    with _INDEX_LOCK:
+        index, pool = _INDEX, _POOL
+        held = pool if pool is not None else index if hasattr(index, "acquire") else None
+        if held is not None:
+            held.acquire()
+    try:
+        yield index, pool
+    finally:
+        if held is not None:
+            held.release()
 
-# -------- helpers --------
-def _norm(s: Optional[str]) -> str:
-    """lower + trim + 折叠空格"""
-    s = (s or "").strip()
-    s = " ".join(s.split())
-    return s.casefold()
+def _use(method: str, *args):
+    """在当前索引上执行 index.method(*args)；memory 后端有副本时发给空闲的副本，不占本进程的 GIL"""
+    with _using() as (index, pool):
+        return pool.call(method, *args) if pool is not None else getattr(index, method)(*args)
 
-def _as_float(v) -> float:
+def _status() -> dict:
+    if not _READY.is_set():
+        return {"ready": False, "source": CSV_FILE_PATH}
+    with _using() as (index, pool):
+        if pool is not None:
+            status, view = {**pool.call("status"), **pool.status()}, pool.view_stats()
+        else:
+            status, view = index.status(), index.view.stats() if index.view else None
+        return {"ready": True, **status, "version": index.version,
+                "gazetteer_places": len(index.geo) if index.geo else 0, "view": view,
+                "hospital_groups": len(index.hospital_stats) if index.hospital_stats else 0, **_RELOAD, **_DELTA}
+
+def _find_doctors(*args) -> dict:
     try:
-        return float(str(v).strip())
-    except Exception:
-        return 0.0
-
-def _read_rows(path: str) -> list[dict]:
-    """
-    严格按照截图列名读取：
-    name, speciality, average_score, hospital_name, city, state
-    若个别文件仍是别名（如 average_sc / hospital），做一次轻量兜底。
-    """
-    if not os.path.exists(path):
-        log.warning("CSV not found: %s", path)
-        return []
-
-    rows: list[dict] = []
-    with open(path, "r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        hdr = [h.strip().lower() for h in (reader.fieldnames or [])]
-
-        # 轻量别名兜底（仅这两项最常见）
-        has_avg = "average_score" in hdr or "average_sc" in hdr
-        has_hosp = "hospital_name" in hdr or "hospital" in hdr
-
-        for r in reader:
-            # 精确字段
-            name           = (r.get("name") or "").strip()
-            speciality     = (r.get("speciality") or "").strip()
-            # 评分允许 average_sc 兜底
-            average_score  = r.get("average_score")
-            if average_score is None:
-                average_score = r.get("average_sc", "")
-            # 医院允许 hospital 兜底
-            hospital_name  = (r.get("hospital_name") or r.get("hospital") or "").strip()
-            city           = (r.get("city") or "").strip()
-            state          = (r.get("state") or "").strip()
-
-            rows.append({
-                "name": name,
-                "speciality": speciality,
-                "average_score": _as_float(average_score),
-                "hospital_name": hospital_name,
-                "city": city,
-                "state": state,
-            })
-
-    if not rows:
-        log.warning("CSV read 0 rows from: %s", path)
-    return rows
-
-def _spec_match(spec: str, wanted: set[str]) -> bool:
-    """专科匹配：子串 + 等值（Orthopedic Sports Medicine ≈ Sports Medicine）"""
-    s = _norm(spec)
-    if not wanted:
-        return True
-    return any(w and (w in s or s in w) for w in wanted)
+        return _use("page", *args)
+    except ValueError as e:
+        return {"error": str(e)}
 
 # -------- MCP tool --------
 @mcp.tool()
@@ -82,58 +256,78 @@ async def find_top_doctors(
     specialities: List[str],
     city: Optional[str] = None,
     state: Optional[str] = None,
-    limit: int = 5
-) -> List[dict]:
+    limit: int = 5,
+    explain: bool = False,
+) -> Union[List[dict], dict]:
     """
     从 CSV（medical_information.csv）按 speciality + city/state 过滤，
     按 average_score 降序返回前 N（默认 5）。
+    无结果时放宽到 nearby（按距离往外找，行带 distance_miles）/ city / state / 全国，
+    match_tier 字段标明实际使用的层级（city_state / nearby / city / state / nationwide）。
+    explain=True 时改为返回 {"match_tier", "doctors", "plan"}：plan 为选中的驱动分区与估计 / 实际行数。
     期望列：name, speciality, average_score, hospital_name, city, state
     """
-    rows = _read_rows(CSV_FILE_PATH)
-    if not rows:
-        return []
-
-    want_specs = {_norm(s) for s in (specialities or [])}
-    city_l, state_l = _norm(city), _norm(state)
-
-    def ok_row(r):
-        if city_l and _norm(r["city"]) != city_l:
-            return False
-        if state_l and _norm(r["state"]) != state_l:
-            return False
-        if not _spec_match(r["speciality"], want_specs):
-            return False
-        return True
-
-    # 1) city+state
-    filtered = [r for r in rows if ok_row(r)]
-
-    # 2) 放宽（仅当无结果）
-    if not filtered and city_l:
-        filtered = [r for r in rows
-                    if _norm(r["city"]) == city_l and _spec_match(r["speciality"], want_specs)]
-    if not filtered and state_l:
-        filtered = [r for r in rows
-                    if _norm(r["state"]) == state_l and _spec_match(r["speciality"], want_specs)]
-    if not filtered:
-        filtered = [r for r in rows if _spec_match(r["speciality"], want_specs)]
-
-    # 排序 & 截断
-    filtered.sort(key=lambda r: (-r["average_score"], _norm(r["hospital_name"]), _norm(r["name"])))
-    top = filtered[: max(1, int(limit or 5))]
-
-    # 仅输出关心字段
-    return [
-        {
-            "name": r["name"],
-            "hospital_name": r["hospital_name"],
-            "speciality": r["speciality"],
-            "average_score": r["average_score"],
-            "city": r["city"],
-            "state": r["state"],
-        }
-        for r in top
-    ]
+    if explain:
+        return await _run(_use, "explain", specialities, city, state, limit)
+    return await _run(_use, "query", specialities, city, state, limit)
+
+@mcp.tool()
+async def find_top_hospitals(
+    specialities: List[str],
+    city: Optional[str] = None,
+    state: Optional[str] = None,
+    limit: int = 5,
+) -> List[dict]:
+    """
+    按 speciality + city/state 给医院排名（用预聚合的 (医院, 地点, 专科) 统计，不逐行分组）。
+    每行：hospital_name / city / state、specialists（匹配的医生数）、rated_specialists（有评分的医生数，
+    average_score 为 0 视为未评分）、mean_score、smoothed_score（向专科均分做贝叶斯平滑，排序依据）、specialities。
+    放宽层级与 find_top_doctors 相同，match_tier 标明实际层级；nearby 层另带 distance_miles。
+    """
+    return await _run(_use, "top_hospitals", specialities, city, state, limit)
+
+@mcp.tool()
+async def find_top_doctors_batch(queries: List[dict], limit: int = 5) -> dict:
+    """
+    一次调用评估多条 find_top_doctors 查询（例如每个疑似疾病的科室一条、或多个候选地点）。
+    queries: [{"specialities": [...], "city": "...", "state": "...", "limit": 5}, ...]
+    返回 {"results": [每条查询的 match_tier + doctors], "merged": 合并去重后的前 N（本地层级优先）}。
+    """
+    return await _run(_use, "query_batch", queries, limit)
+
+@mcp.tool()
+async def find_doctors(
+    specialty: str,
+    location: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+    filter_state: Optional[str] = None,
+    cursor: Optional[str] = None,
+    min_score: Optional[float] = None,
+    credential: Optional[str] = None,
+    hospital: Optional[str] = None,
+    explain: bool = False,
+) -> dict:
+    """
+    分页浏览某科室的全部医生（按 average_score 降序，不做层级放宽）。
+    location: "City, ST" / 州缩写 / 城市名；filter_state 额外限定州。
+    过滤：min_score、credential（如 "MD"、"DO"）、hospital（医院名子串）。
+    返回 {"total", "count", "doctors", "next_cursor"}；把 next_cursor 传回即可取下一页。
+    explain=True 时另带 plan（选中的驱动分区、估计 / 实际命中行数）。
+    """
+    return await _run(_find_doctors, specialty, location, limit, offset, cursor,
+                      filter_state, min_score, credential, hospital, explain)
+
+@mcp.tool()
+async def doctor_db_status() -> dict:
+    """医生索引状态：ready、行数、数据源、加载耗时，数据版本，top-N 视图命中率，最近一次热加载 / 增量的耗时与错误。"""
+    return await _run(_status)
 
 if __name__ == "__main__":
+    # 先建好索引再接受 stdio 连接，第一次工具调用不再承担 CSV 解析；
+    # 签名在加载前取，加载期间 CSV 又变了也能被后台线程发现
+    sig = _csv_signature()
+    _get_index()
+    log.info("Doctor index ready")
+    start_watcher(sig)
     mcp.run()
@@ -12,6 +12,8 @@ from aurite.config.config_models import AgentConfig, LLMConfig, ClientConfig
 CHUNK, FORMAT, CHANNELS, RATE = 1024, pyaudio.paInt16, 1, 16000
 LANG_MAP = {"English": "en", "Chinese": "zh"}
 SEX_OPTIONS = ["male", "female"]  # UI 下拉
+# 诊断走快路径：进程内直接调 diagnosis_server.diagnose_full（无 LLM 编排）；设为 0 改回由代理逐步调用工具
+DIAGNOSIS_FAST_PATH = os.getenv("DIAGNOSIS_FAST_PATH", "1") != "0"
 
 # ------------------------------
 # STT via speechtext_server
@@ -85,7 +87,7 @@ async def diagnose_with_departments(symptoms_text: str, age: int, sex: str):
     Orchestrates via diagnosis_server (MCP):
       1) parse_text_to_evidence(text, age, sex)
       2) run_diagnosis(evidence, age, sex)
-      3) For Top-3 conditions, call get_department_by_evidence(name)
+      3) For the Top-3 conditions, call get_departments_for_conditions([names]) once
     Returns STRICT JSON list sorted by probability desc:
       [{"name": str, "probability": float, "department": str}, ...]
     """
@@ -106,7 +108,8 @@ async def diagnose_with_departments(symptoms_text: str, age: int, sex: str):
             "你是诊断编排代理，必须按以下顺序调用 MCP 工具："
             "1) parse_text_to_evidence(text, age, sex)；"
             "2) run_diagnosis(evidence, age, sex)；"
-            "3) 取概率 Top-3 的疾病，分别调用 get_department_by_evidence(disease_name) 返回 ENGLISH department。"
+            "3) 取概率 Top-3 的疾病，把它们的名字一次性传给 get_departments_for_conditions(disease_names)，"
+            "返回 {疾病名: ENGLISH department}（不要逐个调用 get_department_by_evidence）。"
             "最终只返回严格 JSON 数组（按概率降序），每项含 name、probability（百分比数字）、department。不得输出其它文字。"
         )
         await aur.register_agent(AgentConfig(
@@ -130,13 +133,34 @@ async def diagnose_with_departments(symptoms_text: str, age: int, sex: str):
     finally:
         await aur.shutdown()
 
+async def diagnose_direct(symptoms_text: str, age: int, sex: str, top_n: int = 3):
+    """
+    Fast path: diagnosis_server.diagnose_full in-process — the same chain and output as
+    diagnose_with_departments, without the agent's LLM turns or an MCP subprocess.
+    """
+    import diagnosis_server
+    try:
+        return await diagnosis_server.diagnose_full(symptoms_text, int(age), sex, top_n)
+    finally:
+        # 每次 asyncio.run 都是新的事件循环，连接池会话随本次循环关掉
+        await diagnosis_server.close_http()
+
+async def diagnose(symptoms_text: str, age: int, sex: str):
+    """DIAGNOSIS_FAST_PATH 时走 diagnose_direct（导入失败则退回代理），否则 diagnose_with_departments"""
+    if DIAGNOSIS_FAST_PATH:
+        try:
+            return await diagnose_direct(symptoms_text, age, sex)
+        except ImportError:
+            pass
+    return await diagnose_with_departments(symptoms_text, age, sex)
+
 # ------------------------------
 # Doctor Top-5 via find_doctor_server (CSV)
 # ------------------------------
 async def find_doctors_via_agent(departments: list[str], city: str, state: str, limit: int = 5):
     """
     Calls find_doctor_server.py -> find_top_doctors(specialities, city, state, limit)
-    Returns list of doctor dicts with name, hospital_name, speciality, average_score, city, state, street_address.
+    Returns list of doctor dicts with name, hospital_name, speciality, average_score, city, state, match_tier.
     """
     aur = Aurite()
     await aur.initialize()
@@ -179,6 +203,48 @@ async def find_doctors_via_agent(departments: list[str], city: str, state: str,
     finally:
         await aur.shutdown()
 
+async def find_doctors_batch_via_agent(queries: list[dict], limit: int = 5) -> dict:
+    """
+    Calls find_doctor_server.py -> find_top_doctors_batch(queries, limit) in ONE tool round trip.
+    queries: [{"specialities": [...], "city": str|None, "state": str|None}, ...]
+    Returns {"results": [...per query...], "merged": [...de-duplicated top-N...]}.
+    """
+    aur = Aurite()
+    await aur.initialize()
+    try:
+        await aur.register_llm_config(LLMConfig(
+            llm_id="openai_gpt4_turbo", provider="openai", model_name="gpt-4-turbo"
+        ))
+        await aur.register_client(ClientConfig(
+            name="doctor_server",
+            server_path="find_doctor_server.py",
+            protocol="stdio",
+            capabilities=["tools"],
+        ))
+        sys_prompt = (
+            "You MUST call the MCP tool `find_top_doctors_batch` exactly once with the provided "
+            "`queries` and `limit`. "
+            "Return ONLY the raw JSON object you receive. No prose or markdown."
+        )
+        await aur.register_agent(AgentConfig(
+            name="Doctor Batch Agent",
+            system_prompt=sys_prompt,
+            mcp_servers=["doctor_server"],
+            llm_config_id="openai_gpt4_turbo",
+        ))
+        msg = json.dumps({"queries": queries, "limit": int(limit or 5)}, ensure_ascii=False)
+        res = await aur.run_agent(agent_name="Doctor Batch Agent", user_message=msg)
+        raw = res.primary_text.strip()
+        try:
+            data = json.loads(raw)
+            if isinstance(data, dict):
+                return data
+        except Exception:
+            pass
+        return {"results": [], "merged": []}
+    finally:
+        await aur.shutdown()
+
 # ------------------------------
 # Parse City/State from Detected Location (EN/CN heuristics)
 # ------------------------------
@@ -517,7 +583,7 @@ class App(tk.Tk):
         def worker():
             # 1) 诊断 + 科室
             try:
-                conditions = asyncio.run(diagnose_with_departments(symptoms_text=symptoms, age=age, sex=sex))
+                conditions = asyncio.run(diagnose(symptoms_text=symptoms, age=age, sex=sex))
             except Exception as e:
                 conditions = []
                 self._append_text(self.rc_text, f"[Diagnosis error] {e}", True)
@@ -525,10 +591,15 @@ class App(tk.Tk):
             # 2) 解析 city/state
             city, state = parse_city_state(location)
 
-            # 3) 取科室（Top-3）并查 CSV（Top-5）
+            # 3) 取科室（Top-3），每个科室一条查询，一次批量查 CSV（合并 Top-5）
             departments = [c.get("department", "") for c in conditions if c.get("department")]
+            queries = [{"specialities": [d], "city": city or None, "state": state or None}
+                       for d in dict.fromkeys(departments)]
             try:
-                top_docs = asyncio.run(find_doctors_via_agent(departments, city, state, limit=5))
+                if queries:
+                    top_docs = asyncio.run(find_doctors_batch_via_agent(queries, limit=5)).get("merged", [])
+                else:
+                    top_docs = asyncio.run(find_doctors_via_agent([], city, state, limit=5))
             except Exception as e:
                 top_docs = []
                 self._append_text(self.rc_text, f"[Doctor match error] {e}", True)
@@ -550,14 +621,19 @@ class App(tk.Tk):
                 lines.append("• Suspected conditions: (none)")
 
             if top_docs:
-                lines.append("• Top doctors in your city/state:")
+                tier = top_docs[0].get("match_tier", "city_state")
+                if tier in ("city_state", "city"):
+                    lines.append("• Top doctors in your city/state:")
+                else:
+                    lines.append(f"• Top doctors (no match in your city, widened to: {tier}):")
                 for r in top_docs:
                     nm = r.get("name","?")
                     hosp = r.get("hospital_name","?")
                     sp = r.get("speciality","?")
                     sc = r.get("average_score", 0)
                     cc = r.get("city",""); ss = r.get("state","")
-                    lines.append(f"   - {nm} | {sp} | {hosp} | {cc}, {ss} | ★{float(sc):.2f}")
+                    far = f" ({r['distance_miles']} mi)" if "distance_miles" in r else ""
+                    lines.append(f"   - {nm} | {sp} | {hosp} | {cc}, {ss}{far} | ★{float(sc):.2f}")
             else:
                 lines.append("• Top doctors in your city/state: (none)")
 
@@ -1,28 +1,89 @@
 # diagnosis_server.py  — MCP server for Infermedica + GPT dept mapping
 import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 import aiohttp
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
 
-load_dotenv()
+from department_cache import DepartmentCache, _disease_key
+from symptom_catalog import SymptomCatalog
 
-mcp = FastMCP("Diagnosis Assistant")
+load_dotenv()
 
 INFER_APP_ID  = os.getenv("INFERMEDICA_APP_ID", "")
 INFER_APP_KEY = os.getenv("INFERMEDICA_APP_KEY", "")
-BASE_URL = "https://api.infermedica.com/v3"
+BASE_URL = os.getenv("INFERMEDICA_BASE_URL", "https://api.infermedica.com/v3")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+DEPARTMENT_MODEL = os.getenv("DEPARTMENT_MODEL", "gpt-4o-mini")
 
-async def _request(method: str, endpoint: str, payload=None):
-    headers = {
+# 疾病 -> 科室基本不变：预置表 + 内存 LRU + SQLite 文件（DEPARTMENT_CACHE_DB，设为空只用内存），
+# 重复出现的疾病不再等一次模型往返；磁盘读写放到单线程池里，不占事件循环
+_DEPT_CACHE = DepartmentCache(os.getenv("DEPARTMENT_CACHE_DB", "department_cache.sqlite"),
+                              preload=os.getenv("DEPARTMENT_CACHE_PRELOAD", ""))
+_DEPT_IO = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dept-cache")
+_DEPT_INFLIGHT: dict[tuple[str, str], asyncio.Future] = {}
+
+# 症状目录整份缓存：内存 + JSON 文件（SYMPTOM_CATALOG_PATH，设为空只用内存），新起的进程读文件即热；
+# 过期后条件请求重新验证，磁盘写同样走 _DEPT_IO
+_SYMPTOMS = SymptomCatalog(os.getenv("SYMPTOM_CATALOG_PATH", "symptom_catalog.json"), source=BASE_URL)
+_SYMPTOMS.load()
+_SYMPTOMS_REFRESH: Optional[asyncio.Future] = None
+
+# 进程内共用一个 aiohttp 会话（连接池）：到 Infermedica / OpenAI 的 TCP + TLS 连接保持复用，
+# 一次问诊的多次调用不再每次重新握手。首次用到时创建，服务退出时在 lifespan 里关闭
+HTTP_TIMEOUT = float(os.getenv("DIAGNOSIS_HTTP_TIMEOUT", "30"))                  # 单次请求总超时（秒）
+HTTP_CONNECT_TIMEOUT = float(os.getenv("DIAGNOSIS_HTTP_CONNECT_TIMEOUT", "10"))  # 取连接 + 建连超时
+HTTP_LIMIT = int(os.getenv("DIAGNOSIS_HTTP_LIMIT", "100"))                       # 连接总数上限
+HTTP_LIMIT_PER_HOST = int(os.getenv("DIAGNOSIS_HTTP_LIMIT_PER_HOST", "10"))      # 每个主机的连接上限
+HTTP_KEEPALIVE = float(os.getenv("DIAGNOSIS_HTTP_KEEPALIVE", "60"))              # 空闲连接保留（秒）
+HTTP_DNS_TTL = int(os.getenv("DIAGNOSIS_HTTP_DNS_TTL", "300"))                   # DNS 结果缓存（秒）
+
+_SESSION: Optional[aiohttp.ClientSession] = None
+_SESSION_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+def _http() -> aiohttp.ClientSession:
+    """共用会话；会话绑定创建它的事件循环，换了循环（如测试里多次 asyncio.run）就新建一个"""
+    global _SESSION, _SESSION_LOOP
+    loop = asyncio.get_running_loop()
+    if _SESSION is None or _SESSION.closed or _SESSION_LOOP is not loop:
+        connector = aiohttp.TCPConnector(limit=HTTP_LIMIT, limit_per_host=HTTP_LIMIT_PER_HOST,
+                                         keepalive_timeout=HTTP_KEEPALIVE, ttl_dns_cache=HTTP_DNS_TTL)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        _SESSION, _SESSION_LOOP = aiohttp.ClientSession(connector=connector, timeout=timeout), loop
+    return _SESSION
+
+async def close_http() -> None:
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
+@asynccontextmanager
+async def _lifespan(server):
+    try:
+        yield {}
+    finally:
+        await close_http()
+
+mcp = FastMCP("Diagnosis Assistant", lifespan=_lifespan)
+
+def _headers() -> dict:
+    return {
         "App-Id": INFER_APP_ID,
         "App-Key": INFER_APP_KEY,
         "Content-Type": "application/json",
         "Accept-Language": "en",
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.request(method, f"{BASE_URL}{endpoint}", headers=headers, json=payload) as resp:
+
+async def _request(method: str, endpoint: str, payload=None):
+    try:
+        async with _http().request(method, f"{BASE_URL}{endpoint}", headers=_headers(), json=payload) as resp:
             if resp.status != 200:
                 try:
                     detail = await resp.text()
@@ -30,13 +91,60 @@ async def _request(method: str, endpoint: str, payload=None):
                     detail = ""
                 return {"error": f"Request failed: {resp.status} {detail}"}
             return await resp.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return {"error": f"Request failed: {type(e).__name__} {e}"}
+
+async def _refresh_symptoms() -> None:
+    """回源拉目录：带上次的 ETag / Last-Modified，304 只续期；失败保留旧目录。拉到新目录再写盘"""
+    headers = _headers()
+    if _SYMPTOMS.etag:
+        headers["If-None-Match"] = _SYMPTOMS.etag
+    if _SYMPTOMS.last_modified:
+        headers["If-Modified-Since"] = _SYMPTOMS.last_modified
+    try:
+        async with _http().get(f"{BASE_URL}/symptoms", headers=headers) as resp:
+            if resp.status == 304:
+                _SYMPTOMS.renew(resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+            elif resp.status == 200:
+                _SYMPTOMS.replace(await resp.json(), resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+            else:
+                _SYMPTOMS.fail()
+                return
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+        _SYMPTOMS.fail()
+        return
+    await asyncio.get_running_loop().run_in_executor(_DEPT_IO, _SYMPTOMS.save)
+
+async def _symptom_catalog() -> SymptomCatalog:
+    """未过期直接用；过期了同一时刻只回源一次，其余调用等同一个刷新"""
+    global _SYMPTOMS_REFRESH
+    if _SYMPTOMS.fresh():
+        return _SYMPTOMS
+    task = _SYMPTOMS_REFRESH
+    if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+        task = _SYMPTOMS_REFRESH = asyncio.ensure_future(_refresh_symptoms())
+    await asyncio.shield(task)
+    return _SYMPTOMS
 
 @mcp.tool()
 async def get_symptoms() -> list:
-    data = await _request("GET", "/symptoms")
-    if isinstance(data, dict) and data.get("error"):
-        return []
-    return [{"id": s["id"], "name": s["name"]} for s in data]
+    """Full Infermedica symptom catalog [{"id", "name"}] (cached; revalidated once a day)."""
+    return (await _symptom_catalog()).items
+
+@mcp.tool()
+async def get_symptom(symptom_id: str) -> dict:
+    """One symptom by Infermedica id, e.g. 's_21' -> {"id", "name"}; {} if unknown."""
+    return (await _symptom_catalog()).get(symptom_id) or {}
+
+@mcp.tool()
+async def search_symptoms(prefix: str, limit: int = 20) -> list:
+    """Symptoms whose name starts with prefix (case-insensitive), sorted by name, at most limit."""
+    return (await _symptom_catalog()).prefix(prefix, max(1, min(int(limit or 20), 200)))
+
+@mcp.tool()
+async def symptom_catalog_status() -> dict:
+    """症状目录缓存：条目数、已缓存多久、校验方式、命中 / 回源 / 304 / 失败次数"""
+    return _SYMPTOMS.stats()
 
 @mcp.tool()
 async def parse_text_to_evidence(text: str, age: int = 30, sex: str = "male") -> list:
@@ -56,20 +164,15 @@ async def run_diagnosis(evidence: list, age: int = 30, sex: str = "male") -> lis
     conditions = data.get("conditions", [])
     return [{"name": c["name"], "probability": round(c["probability"] * 100, 2)} for c in conditions]
 
-@mcp.tool()
-async def get_department_by_evidence(disease_name: str) -> str:
-    """
-    Return the best-fitting HOSPITAL DEPARTMENT in ENGLISH for the disease.
-    Output ONE concise department name only, e.g. 'Neurology', 'Urology',
-    'Nephrology', 'Cardiology', 'Orthopedics', 'Otolaryngology (ENT)'.
-    """
+async def _ask_department(disease_name: str) -> str:
+    """问模型（一次 OpenAI 往返）；失败返回 "Unknown" """
     if not OPENAI_API_KEY:
         return "Unknown"
 
-    url = "https://api.openai.com/v1/chat/completions"
+    url = f"{OPENAI_BASE_URL}/chat/completions"
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
     payload = {
-        "model": "gpt-4o-mini",
+        "model": DEPARTMENT_MODEL,
         "temperature": 0,
         "max_tokens": 20,
         "messages": [
@@ -84,15 +187,159 @@ async def get_department_by_evidence(disease_name: str) -> str:
         ]
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as resp:
+    try:
+        async with _http().post(url, headers=headers, json=payload) as resp:
             if resp.status != 200:
                 return "Unknown"
             result = await resp.json()
-            try:
-                return result["choices"][0]["message"]["content"].strip()
-            except Exception:
-                return "Unknown"
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return "Unknown"
+    try:
+        return result["choices"][0]["message"]["content"].strip()
+    except Exception:
+        return "Unknown"
+
+async def _ask_departments(names: list[str]) -> dict[str, str]:
+    """
+    一次 OpenAI 请求映射一批疾病（JSON 输出）：返回 {_disease_key: 科室}，
+    只含解析出来的、非空的项；请求失败或输出不是 JSON 时为空，由调用方逐个补问
+    """
+    if not OPENAI_API_KEY or not names:
+        return {}
+
+    url = f"{OPENAI_BASE_URL}/chat/completions"
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    payload = {
+        "model": DEPARTMENT_MODEL,
+        "temperature": 0,
+        "max_tokens": 30 * len(names) + 20,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are a medical expert. For each disease, give the SINGLE best-fitting concise ENGLISH "
+                           "hospital department name. Reply with a JSON object only: "
+                           '{"departments": {"<disease exactly as given>": "<department>", ...}}'
+            },
+            {
+                "role": "user",
+                "content": "Which hospital department should the patient visit for each of these diseases? "
+                           + json.dumps(names, ensure_ascii=False)
+            }
+        ]
+    }
+
+    try:
+        async with _http().post(url, headers=headers, json=payload) as resp:
+            if resp.status != 200:
+                return {}
+            result = await resp.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return {}
+    try:
+        data = json.loads(result["choices"][0]["message"]["content"])
+        data = data.get("departments", data)
+        return {_disease_key(k): v.strip() for k, v in data.items()
+                if isinstance(v, str) and v.strip() and v.strip() != "Unknown"}
+    except Exception:
+        return {}
+
+async def _fetch_department(disease_name: str, key: str) -> str:
+    """磁盘 → 模型；问到的答案写回内存与磁盘（"Unknown" 不缓存，下次再问）"""
+    loop = asyncio.get_running_loop()
+    dept = await loop.run_in_executor(_DEPT_IO, _DEPT_CACHE.load, DEPARTMENT_MODEL, key)
+    if dept is not None:
+        return dept
+    dept = await _ask_department(disease_name)
+    if dept and dept != "Unknown":
+        _DEPT_CACHE.put(DEPARTMENT_MODEL, key, dept)
+        await loop.run_in_executor(_DEPT_IO, _DEPT_CACHE.save, DEPARTMENT_MODEL, key, dept)
+    return dept
+
+async def _department(disease_name: str) -> str:
+    """预置表 / 内存命中直接返回；同一疾病同时有多个调用在等时只查一次磁盘、只问一次模型"""
+    key = _disease_key(disease_name)
+    if not key:
+        return "Unknown"
+    dept = _DEPT_CACHE.get(DEPARTMENT_MODEL, key)
+    if dept is not None:
+        return dept
+    task = _DEPT_INFLIGHT.get((DEPARTMENT_MODEL, key))
+    if task is None:
+        task = _DEPT_INFLIGHT[(DEPARTMENT_MODEL, key)] = asyncio.ensure_future(_fetch_department(disease_name, key))
+        task.add_done_callback(lambda _: _DEPT_INFLIGHT.pop((DEPARTMENT_MODEL, key), None))
+    # shield：一个调用方被取消不连累其它在等同一疾病的调用
+    return await asyncio.shield(task)
+
+@mcp.tool()
+async def get_department_by_evidence(disease_name: str) -> str:
+    """
+    Return the best-fitting HOSPITAL DEPARTMENT in ENGLISH for the disease.
+    Output ONE concise department name only, e.g. 'Neurology', 'Urology',
+    'Nephrology', 'Cardiology', 'Orthopedics', 'Otolaryngology (ENT)'.
+    Answers are cached per (disease, model): preload file, in-memory LRU, then the on-disk store.
+    """
+    return await _department(disease_name)
+
+async def _departments(disease_names: list[str]) -> dict[str, str]:
+    """缓存命中就地回答，其余一次批量问模型，批量没覆盖到的并发逐个问；{原名: 科室}"""
+    names = [n for n in dict.fromkeys(disease_names or []) if _disease_key(n)]
+    keys = {n: _disease_key(n) for n in names}
+    found: dict[str, str] = {}
+    for key in dict.fromkeys(keys.values()):
+        dept = _DEPT_CACHE.get(DEPARTMENT_MODEL, key)
+        if dept is not None:
+            found[key] = dept
+    missing = [k for k in dict.fromkeys(keys.values()) if k not in found]
+    if missing:
+        loop = asyncio.get_running_loop()
+        found.update(await loop.run_in_executor(_DEPT_IO, _DEPT_CACHE.load_many, DEPARTMENT_MODEL, missing))
+        # 每个键取它第一次出现时的原始写法问模型
+        ask: dict[str, str] = {}
+        for n, k in keys.items():
+            if k not in found:
+                ask.setdefault(k, n)
+        fresh = {k: d for k, d in (await _ask_departments(list(ask.values()))).items() if k in ask}
+        # 批量回答没覆盖到的（输出解析失败 / 漏了某项）并发逐个问
+        rest = [k for k in ask if k not in fresh]
+        for key, dept in zip(rest, await asyncio.gather(*(_ask_department(ask[k]) for k in rest))):
+            if dept and dept != "Unknown":
+                fresh[key] = dept
+        for key, dept in fresh.items():
+            _DEPT_CACHE.put(DEPARTMENT_MODEL, key, dept)
+        found.update(fresh)
+        await loop.run_in_executor(_DEPT_IO, _DEPT_CACHE.save_many, DEPARTMENT_MODEL, fresh)
+    return {n: found.get(keys[n], "Unknown") for n in names}
+
+@mcp.tool()
+async def get_departments_for_conditions(disease_names: List[str]) -> Dict[str, str]:
+    """
+    Map several diseases to hospital departments in ONE call; returns {disease name as given: department}.
+    Cache hits are answered locally; all misses go to the model in a single structured request.
+    Names the batch answer does not cover fall back to concurrent single lookups ('Unknown' if those fail too).
+    """
+    return await _departments(disease_names)
+
+@mcp.tool()
+async def diagnose_full(text: str, age: int = 30, sex: str = "male", top_n: int = 3) -> list:
+    """
+    Whole diagnosis chain in ONE call: parse_text_to_evidence -> run_diagnosis -> departments for the
+    Top-N conditions. Returns a list sorted by probability desc:
+      [{"name": str, "probability": float (percent), "department": str}, ...]
+    Empty list if no symptom is recognised or the diagnosis API fails.
+    """
+    evidence = await parse_text_to_evidence(text, age, sex)
+    if not evidence:
+        return []
+    conditions = sorted(await run_diagnosis(evidence, age, sex), key=lambda c: c["probability"], reverse=True)
+    top = conditions[:max(1, int(top_n or 3))]
+    departments = await _departments([c["name"] for c in top])
+    return [{**c, "department": departments.get(c["name"], "Unknown")} for c in top]
+
+@mcp.tool()
+async def department_cache_status() -> dict:
+    """疾病 -> 科室缓存：条目数、预置 / 内存 / 磁盘命中、未命中（= 模型调用）、淘汰次数与命中率"""
+    return await asyncio.get_running_loop().run_in_executor(_DEPT_IO, _DEPT_CACHE.stats)
 
 
 if __name__ == "__main__":
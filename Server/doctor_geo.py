@@ -0,0 +1,183 @@
+# doctor_geo.py — offline city-centroid gazetteer + grid index for distance-based doctor fallback
+import os, csv, math, heapq, logging
+from typing import Iterable, Iterator, Optional
+
+from doctor_index import _norm
+
+log = logging.getLogger(__name__)
+
+EARTH_MILES = 3958.8
+# 网格边长（度）：0.5° 纬度约 34.5 英里，城市点 ~几千个时每格只有个位数
+CELL_DEG = 0.5
+# 放宽半径上限（英里），超过仍凑不满 k 位医生则交给 state / 全国层级
+MAX_MILES = float(os.getenv("DOCTOR_GEO_MAX_MILES", "100"))
+
+def _gazetteer_path(csv_path: str) -> str:
+    return os.getenv("DOCTOR_GEO_GAZETTEER") or os.path.join(os.path.dirname(csv_path) or ".", "city_centroids.csv")
+
+def haversine_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+class CityGazetteer:
+    """
+    (city, state) -> 中心点经纬度，键为 _norm 后的城市 / 州。
+    点按 CELL_DEG 网格分桶；nearest() 从所在格一圈圈往外扫，
+    每扫完一圈，距离不超过"已覆盖半径"的候选就可以按距离顺序产出。
+    """
+
+    def __init__(self, points: Iterable[tuple[str, str, float, float]], source: str = ""):
+        self.source = source
+        self._loc: dict[tuple[str, str], tuple[float, float]] = {}
+        for city, state, lat, lon in points:
+            self._loc.setdefault((_norm(city), _norm(state)), (lat, lon))
+        self.index_places(self._loc)
+
+    def index_places(self, keys: Iterable[tuple[str, str]]) -> None:
+        """
+        只把这些地点放进网格（通常是有医生的城市）：locate() 仍能定位全部地名，
+        nearest() 只在有医生的城市里找，不用逐个跳过空镇子。建好后一次赋值换上，正在查的调用读的是旧网格
+        """
+        grid: dict[tuple[int, int], list[tuple[str, str]]] = {}
+        for key in keys:
+            at = self._loc.get(key)
+            if at is not None:
+                grid.setdefault(self._cell(*at), []).append(key)
+        self._grid = grid
+
+    def __len__(self) -> int:
+        return len(self._loc)
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> tuple[int, int]:
+        return int(math.floor(lat / CELL_DEG)), int(math.floor(lon / CELL_DEG))
+
+    @classmethod
+    def from_csv(cls, path: str) -> "CityGazetteer":
+        """读取 city,state,lat,lon 四列的中心点文件（由本模块的 build 子命令生成）"""
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            points = [(r["city"], r["state"], float(r["lat"]), float(r["lon"])) for r in csv.DictReader(f)]
+        return cls(points, source=path)
+
+    @classmethod
+    def load(cls, csv_path: str) -> Optional["CityGazetteer"]:
+        """doctor CSV 旁边（或 DOCTOR_GEO_GAZETTEER 指定）有中心点文件就加载，没有返回 None"""
+        path = _gazetteer_path(csv_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            geo = cls.from_csv(path)
+        except (OSError, KeyError, ValueError) as e:
+            log.warning("Gazetteer %s unusable (%s); distance fallback disabled", path, e)
+            return None
+        log.info("Gazetteer loaded: %d places from %s", len(geo), path)
+        return geo
+
+    def locate(self, city_l: str, state_l: str) -> Optional[tuple[float, float]]:
+        return self._loc.get((city_l, state_l))
+
+    def nearest(self, lat: float, lon: float, max_miles: float = MAX_MILES) -> Iterator[tuple[float, tuple[str, str]]]:
+        """按距离从近到远产出 (英里, (city, state))，直到 max_miles"""
+        ci, cj = self._cell(lat, lon)
+        # 一圈 = 纬向 CELL_DEG 度；经度方向每度的英里数随纬度缩小，按最靠极地的一侧保守估计
+        lat_step = math.radians(CELL_DEG) * EARTH_MILES
+        heap: list = []
+        ring = 0
+        while True:
+            cells = ([(ci, cj)] if ring == 0 else
+                     [(ci + di, cj + dj) for di in range(-ring, ring + 1) for dj in (-ring, ring)] +
+                     [(ci + di, cj + dj) for di in (-ring, ring) for dj in range(-ring + 1, ring)])
+            for cell in cells:
+                for key in self._grid.get(cell, ()):
+                    plat, plon = self._loc[key]
+                    heapq.heappush(heap, (haversine_miles(lat, lon, plat, plon), key))
+            edge = min(90.0, abs(lat) + ring * CELL_DEG)
+            covered = ring * lat_step * max(math.cos(math.radians(edge)), 0.05)
+            while heap and heap[0][0] <= min(covered, max_miles):
+                yield heapq.heappop(heap)
+            if covered >= max_miles or ring * CELL_DEG >= 180:
+                return
+            ring += 1
+
+# -------- gazetteer build --------
+# 人口普查 Gazetteer 文件（如 2023_Gaz_place_national.txt、..._cousub_national.txt）：
+# 制表符分隔，列含 USPS、NAME、INTPTLAT、INTPTLONG；NAME 带 "city" / "town" / "CDP" 等后缀
+_LSAD_SUFFIXES = (" city and borough", " consolidated government", " metropolitan government",
+                  " unified government", " urban county", " municipality", " village", " borough",
+                  " township", " town", " city", " cdp", " plantation", " comunidad", " zona urbana")
+
+def _place_keys(name: str) -> list[str]:
+    """普查地名 -> 可能的城市写法（去掉行政后缀、括注；Saint/St. 互换）"""
+    n = _norm(name.split("(")[0])
+    for suf in _LSAD_SUFFIXES:
+        if n.endswith(suf):
+            n = n[: -len(suf)].strip()
+            break
+    keys = [n]
+    if n.startswith("st. "):
+        keys += ["saint " + n[4:], "st " + n[4:]]
+    elif n.startswith("saint "):
+        keys += ["st. " + n[6:], "st " + n[6:]]
+    return keys
+
+def build_gazetteer(census_files: list[str], doctors_csv: Optional[str], out_path: str) -> tuple[int, int]:
+    """
+    从普查 Gazetteer 文件生成 city,state,lat,lon，写出全部地名：用户所在的镇子没有医生也要能定位，
+    nearby 层才能从那里往外找（网格只收有医生的城市，由 index_places 在加载时筛）。
+    给出 doctor CSV 时其中的城市用 CSV 原写法输出；返回 (写出的行数, 未匹配的 doctor 城市数)。
+    """
+    found: dict[tuple[str, str], tuple[float, float]] = {}
+    for path in census_files:
+        with open(path, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+            reader = csv.DictReader(f, delimiter="\t")
+            reader.fieldnames = [h.strip().upper() for h in reader.fieldnames or []]
+            for r in reader:
+                try:
+                    lat, lon = float(r["INTPTLAT"]), float(r["INTPTLONG"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                st = _norm(r.get("USPS"))
+                for c in _place_keys(r.get("NAME") or ""):
+                    # 同名时先出现的（place 文件在前）优先
+                    found.setdefault((c, st), (lat, lon))
+
+    names = {k: (k[0], k[1].upper()) for k in found}
+    missing = 0
+    if doctors_csv:
+        seen: set[tuple[str, str]] = set()
+        with open(doctors_csv, "r", encoding="utf-8-sig", newline="") as f:
+            for r in csv.DictReader(f):
+                city, state = (r.get("city") or "").strip(), (r.get("state") or "").strip()
+                key = (_norm(city), _norm(state))
+                if key in seen:
+                    continue
+                seen.add(key)
+                if key in names:
+                    names[key] = (city, state)
+                else:
+                    missing += 1
+
+    rows = [(*names[key], f"{lat:.6f}", f"{lon:.6f}") for key, (lat, lon) in found.items()]
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["city", "state", "lat", "lon"])
+        w.writerows(sorted(rows))
+    os.replace(tmp, out_path)
+    return len(rows), missing
+
+if __name__ == "__main__":
+    # python doctor_geo.py 2023_Gaz_place_national.txt [2023_Gaz_cousub_national.txt ...] [--doctors CSV] [-o OUT]
+    import argparse
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ap = argparse.ArgumentParser(description="Build the offline city-centroid gazetteer from Census Gazetteer files.")
+    ap.add_argument("census", nargs="+", help="Census Gazetteer .txt files (places first, then county subdivisions)")
+    ap.add_argument("--doctors", default=os.getenv("DOCTOR_DB_CSV", "medical_information.csv"),
+                    help="doctor CSV whose city spellings to keep (all census places are written)")
+    ap.add_argument("-o", "--out", help="output CSV (default: $DOCTOR_GEO_GAZETTEER or city_centroids.csv next to the doctor CSV)")
+    args = ap.parse_args()
+    doctors = args.doctors if os.path.exists(args.doctors) else None
+    out = args.out or _gazetteer_path(args.doctors)
+    n, missing = build_gazetteer(args.census, doctors, out)
+    log.info("Gazetteer written: %s (%d places, %d doctor cities without a centroid)", out, n, missing)
@@ -0,0 +1,239 @@
+# doctor_hospitals.py — per-(hospital, speciality) aggregates behind find_top_hospitals
+import os, heapq, logging
+from typing import Callable, Iterable, Optional
+
+from doctor_index import _norm
+
+log = logging.getLogger(__name__)
+
+# 贝叶斯平滑的先验权重：相当于先给每家医院加 C 位"专科平均分"的虚拟医生，
+# 只有一两位高分医生的医院不会排到几十位稳定高分医生的医院前面
+HOSPITAL_PRIOR_WEIGHT = float(os.getenv("DOCTOR_HOSPITAL_PRIOR", "5"))
+
+class _Norms(dict):
+    """原值 -> _norm(原值)：原值在各组里重复得很多，每个只归一化一次"""
+
+    def __missing__(self, raw: str) -> str:
+        self[raw] = n = _norm(raw)
+        return n
+
+def _vote(votes: dict, key: tuple, raw, n: int) -> None:
+    """key 下原值 raw 的行数加 n；减到 0 的原值、没有原值的键删掉"""
+    tally = votes.setdefault(key, {})
+    tally[raw] = tally.get(raw, 0) + n
+    if tally[raw] <= 0:
+        del tally[raw]
+        if not tally:
+            del votes[key]
+
+class HospitalTable:
+    """
+    (医院, city, state, 专科) -> (医生数, 有评分的医生数, 评分和)，键为 _norm 后的值。
+    显示名按原值计票：(医院, city, state) 与各组的专科各记每种写法的医生数，取最多的写法，
+    一样多时取字典序大的（"Mayo Clinic" 胜过 "MAYO CLINIC"）；与后端的扫描 / 分组顺序无关，各后端给出同一个名字。
+    加载时由后端一次聚合好（_hospital_groups：内存列一遍扫描 / SQLite GROUP BY / 各分片汇总），
+    查询只在命中的组上按医院合并、平滑、取前 k，不再逐行分组；增量按删掉 / 新增的行加减（updated）。
+
+    average_score 为 0 的行当作没有评分（CSV 里空值也读成 0，有评分的都在 1 以上）：
+    计入医生数，不进均值。平滑分 = (C × m + 评分和) / (C + 有评分人数)，
+    m 为所查专科全部有评分医生的均分，C = HOSPITAL_PRIOR_WEIGHT。
+
+    组按 (地点, 专科) / (州, 专科) / 专科 三级挂索引，不限专科的查询用专科 None 那一份。
+    """
+
+    def __init__(self, groups: dict, votes: dict):
+        # (医院, city, state, 专科) -> (医生数, 有评分人数, 评分和)
+        self._groups = groups
+        # (医院, city, state) -> {(医院原值, city 原值, state 原值): 医生数}；(医院, city, state, 专科) -> {专科原值: 医生数}
+        self._votes = votes
+        self._place: dict[tuple, list[tuple]] = {}
+        self._state: dict[tuple, list[tuple]] = {}
+        self._spec: dict[Optional[str], list[tuple]] = {}
+        self._cities: dict[str, frozenset[str]] = {}
+        self._prior: dict[Optional[str], tuple[int, float]] = {}
+        place, state, spec, prior = self._place, self._state, self._spec, {}
+        for g, v in groups.items():
+            h, c, st, sp = g
+            for s in (sp, None):
+                place.setdefault((c, st, s), []).append(g)
+                state.setdefault((st, s), []).append(g)
+                spec.setdefault(s, []).append(g)
+                p = prior.get(s)
+                if p is None:
+                    p = prior[s] = [0, 0.0]
+                p[0] += v[1]
+                p[1] += v[2]
+            if st not in self._cities.get(c, ()):
+                self._cities[c] = self._cities.get(c, frozenset()) | {st}
+        self._prior = {s: tuple(p) for s, p in prior.items()}
+
+    @classmethod
+    def build(cls, index) -> "HospitalTable":
+        """index 为任一后端，_hospital_groups() 产出 (医院, city, state, 专科, 医生数, 有评分人数, 评分和)"""
+        groups: dict[tuple, tuple] = {}
+        votes: dict[tuple, dict] = {}
+        norm = _Norms()
+        for hospital, city, state, speciality, n, rated, total in index._hospital_groups():
+            g = (norm[hospital], norm[city], norm[state], norm[speciality])
+            old = groups.get(g)
+            # 原值不同、归一化相同的组（大小写 / 空格差异）合成一组，各写法计票
+            groups[g] = (n, rated, total) if old is None else (old[0] + n, old[1] + rated, old[2] + total)
+            _vote(votes, g[:3], (hospital, city, state), n)
+            _vote(votes, g, speciality, n)
+        table = cls(groups, votes)
+        log.info("Hospital aggregates ready: %d (hospital, place, speciality) groups", len(table))
+        return table
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def _name(self, key: tuple):
+        """票数最多的写法，一样多时取字典序大的"""
+        tally = self._votes[key]
+        return max(tally, key=lambda raw: (tally[raw], raw))
+
+    def _link(self, g: tuple, sign: int, owned: Optional[set] = None) -> None:
+        """
+        组出现（sign=1）/ 消失（sign=-1）时挂上 / 摘下索引。
+        owned 不为 None 时（updated 里）索引列表与旧表共用，第一次改某个列表前先拷一份
+        """
+        h, c, st, sp = g
+        for s in (sp, None):
+            for name, idx, key in (("place", self._place, (c, st, s)), ("state", self._state, (st, s)),
+                                   ("spec", self._spec, s)):
+                if owned is not None and (name, key) not in owned:
+                    owned.add((name, key))
+                    idx[key] = list(idx.get(key, ()))
+                lst = idx.setdefault(key, [])
+                if sign > 0:
+                    lst.append(g)
+                else:
+                    lst.remove(g)
+        if sign > 0 and st not in self._cities.get(c, ()):
+            self._cities[c] = self._cities.get(c, frozenset()) | {st}
+
+    def _add_prior(self, sp: str, rated: int, total: float) -> None:
+        """专科先验（有评分人数、评分和）：该专科一份，外加不限专科（None）一份"""
+        for s in (sp, None):
+            r, t = self._prior.get(s, (0, 0.0))
+            self._prior[s] = (r + rated, t + total)
+
+    def updated(self, removed: Iterable[tuple], added: Iterable[tuple]) -> "HospitalTable":
+        """
+        按行加减后的新表（旧表不动，进行中的查询照常读旧表）：
+        removed / added 为 (医院, city, state, 专科, average_score) 行。
+        只拷贝顶层字典，改动的组与它们所在的索引列表另起新对象，代价与增量大小和索引键数相关，与总行数无关。
+        """
+        delta: dict[tuple, list] = {}
+        spellings: dict[tuple, dict] = {}
+        for sign, rows in ((-1, removed), (1, added)):
+            for hospital, city, state, speciality, score in rows:
+                g = (_norm(hospital), _norm(city), _norm(state), _norm(speciality))
+                d = delta.get(g)
+                if d is None:
+                    d = delta[g] = [0, 0, 0.0]
+                d[0] += sign
+                if score > 0:
+                    d[1] += sign
+                    d[2] += sign * score
+                for key, raw in ((g[:3], (hospital, city, state)), (g, speciality)):
+                    tally = spellings.setdefault(key, {})
+                    tally[raw] = tally.get(raw, 0) + sign
+        new = object.__new__(HospitalTable)
+        new._groups, new._cities, new._prior = dict(self._groups), dict(self._cities), dict(self._prior)
+        new._place, new._state, new._spec = dict(self._place), dict(self._state), dict(self._spec)
+        # 票数表：改到的键先拷一份再改，旧表的票数不动
+        new._votes = dict(self._votes)
+        for key, tally in spellings.items():
+            if key in new._votes:
+                new._votes[key] = dict(new._votes[key])
+            for raw, n in tally.items():
+                if n:
+                    _vote(new._votes, key, raw, n)
+        owned: set = set()
+        for g, (n, rated, total) in delta.items():
+            new._add_prior(g[3], rated, total)
+            old = new._groups.get(g)
+            if old is not None:
+                n, rated, total = old[0] + n, old[1] + rated, old[2] + total
+            if n > 0:
+                new._groups[g] = (n, rated, total)
+                if old is None:
+                    new._link(g, 1, owned)
+            elif old is not None:
+                del new._groups[g]
+                new._link(g, -1, owned)
+        return new
+
+    def _at(self, idx: dict, keys: Iterable[tuple], specs: list) -> list[tuple]:
+        return [g for key in keys for s in specs for g in idx.get((*key, s), ())]
+
+    def _count(self, place: tuple[str, str], specs: list) -> int:
+        """某地匹配的医院数（nearby 层按它凑满 k 家）"""
+        return len({g[0] for g in self._at(self._place, [place], specs)})
+
+    def top(self, specs: Optional[set[str]], city_l: str, state_l: str, k: int,
+            nearby: Optional[Callable] = None) -> tuple[str, list[dict]]:
+        """
+        specs 为归一化专科名集合（None 不限专科）。放宽层级同 find_top_doctors：
+        city+state → nearby（nearby(count) 返回 [(英里, (city, state)), ...]）→ city → state → 全国。
+        返回 (层级, 前 k 家医院)。
+        """
+        sps = [None] if specs is None else sorted(specs)
+        if not sps:
+            return "nationwide", []
+        if city_l and state_l:
+            groups = self._at(self._place, [(city_l, state_l)], sps)
+            if groups:
+                return "city_state", self._rank(groups, sps, k)
+            near = nearby(lambda key: self._count(key, sps)) if nearby is not None else []
+            if near:
+                dist = {key: d for d, key in near}
+                rows = self._rank(self._at(self._place, dist, sps), sps, k)
+                for row in rows:
+                    row["distance_miles"] = round(dist[(_norm(row["city"]), _norm(row["state"]))], 1)
+                return "nearby", rows
+        if city_l:
+            groups = self._at(self._place, [(city_l, st) for st in sorted(self._cities.get(city_l, ()))], sps)
+            if groups:
+                return "city", self._rank(groups, sps, k)
+        if state_l:
+            groups = self._at(self._state, [(state_l,)], sps)
+            if groups:
+                return "state", self._rank(groups, sps, k)
+        return "nationwide", self._rank([g for s in sps for g in self._spec.get(s, ())], sps, k)
+
+    def _rank(self, groups: list[tuple], specs: list, k: int) -> list[dict]:
+        """组按 (医院, city, state) 合并，平滑后取前 k：平滑分降序，其次医生数、医院名 / 地点"""
+        fac: dict[tuple, list] = {}
+        for g in groups:
+            n, rated, total = self._groups[g]
+            f = fac.get(g[:3])
+            if f is None:
+                f = fac[g[:3]] = [[], 0, 0, 0.0]
+            f[0].append(g)
+            f[1] += n
+            f[2] += rated
+            f[3] += total
+        r = t = 0
+        for s in specs:
+            p = self._prior.get(s)
+            if p is not None:
+                r, t = r + p[0], t + p[1]
+        m, c = (t / r if r else 0.0), HOSPITAL_PRIOR_WEIGHT
+        scored = [((c * m + f[3]) / (c + f[2]) if c + f[2] else m, f[1], key, f) for key, f in fac.items()]
+        best = heapq.nsmallest(k, scored, key=lambda x: (-x[0], -x[1], x[2]))
+        out = []
+        for score, _, key, (gs, n, rated, total) in best:
+            hospital, city, state = self._name(key)
+            out.append({
+                "hospital_name": hospital,
+                "city": city,
+                "state": state,
+                "specialists": n,
+                "rated_specialists": rated,
+                "mean_score": round(total / rated, 3) if rated else None,
+                "smoothed_score": round(score, 3),
+                "specialities": sorted({self._name(g) for g in gs}),
+            })
+        return out
@@ -0,0 +1,1425 @@
+# doctor_index.py — resident in-memory doctor table used by find_doctor_server
+import os, re, sys, csv, copy, json, math, mmap, time, heapq, base64, bisect, hashlib, functools, itertools, logging
+from array import array
+from typing import Callable, Iterable, List, NamedTuple, Optional, Union
+
+log = logging.getLogger(__name__)
+
+# -------- helpers --------
+def _norm(s: Optional[str]) -> str:
+    """lower + trim + 折叠空格"""
+    s = (s or "").strip()
+    s = " ".join(s.split())
+    return s.casefold()
+
+def _as_float(v) -> float:
+    try:
+        return float(str(v).strip())
+    except Exception:
+        return 0.0
+
+def _f32(v: Optional[float]) -> Optional[float]:
+    """评分下限按 _score 列的 float32 取整：4.7 存成 4.6999998，拿 float64 的 4.7 去比会把它漏掉"""
+    return None if v is None else array("f", [v])[0]
+
+class DoctorRecord(NamedTuple):
+    """
+    CSV 的一行：tuple 实现（无实例 __dict__），分类字段 sys.intern 过，
+    同一城市 / 州 / 医院 / 专科在所有行里共用同一个 str 对象；
+    *_n 为加载时算好的 _norm 影子键，建索引时不再逐行归一化。
+    """
+    name: str
+    speciality: str
+    average_score: float
+    hospital_name: str
+    city: str
+    state: str
+    name_n: str
+    speciality_n: str
+    hospital_n: str
+    city_n: str
+    state_n: str
+
+    def public(self) -> dict:
+        """仅输出关心字段"""
+        return {"name": self.name, "hospital_name": self.hospital_name, "speciality": self.speciality,
+                "average_score": self.average_score, "city": self.city, "state": self.state}
+
+def _read_rows(path: str, with_op: bool = False) -> Iterable[DoctorRecord]:
+    """
+    严格按照截图列名读取：
+    name, speciality, average_score, hospital_name, city, state
+    若个别文件仍是别名（如 average_sc / hospital），做一次轻量兜底。
+    逐行产出，调用方直接写进列存，不在内存里攒一份 list[dict]。
+    with_op=True 时产出 (op 列原值, 记录)，供增量文件使用。
+    """
+    if not os.path.exists(path):
+        log.warning("CSV not found: %s", path)
+        return
+
+    # 分类字段：原始值 -> (驻留后的原始值, 归一化值)，每个不同取值只处理一次
+    seen: dict[str, tuple[str, str]] = {}
+
+    def cat(v: str) -> tuple[str, str]:
+        hit = seen.get(v)
+        if hit is None:
+            hit = seen[v] = (sys.intern(v), sys.intern(_norm(v)))
+        return hit
+
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        hdr = [h.strip().lower() for h in (reader.fieldnames or [])]
+
+        # 轻量别名兜底（仅这两项最常见）
+        has_avg = "average_score" in hdr or "average_sc" in hdr
+        has_hosp = "hospital_name" in hdr or "hospital" in hdr
+
+        for r in reader:
+            # 精确字段
+            name           = (r.get("name") or "").strip()
+            speciality     = cat((r.get("speciality") or "").strip())
+            # 评分允许 average_sc 兜底
+            average_score  = r.get("average_score")
+            if average_score is None:
+                average_score = r.get("average_sc", "")
+            # 医院允许 hospital 兜底
+            hospital_name  = cat((r.get("hospital_name") or r.get("hospital") or "").strip())
+            city           = cat((r.get("city") or "").strip())
+            state          = cat((r.get("state") or "").strip())
+
+            rec = DoctorRecord(
+                name, speciality[0], _as_float(average_score), hospital_name[0], city[0], state[0],
+                _norm(name), speciality[1], hospital_name[1], city[1], state[1],
+            )
+            yield (_norm(r.get("op")), rec) if with_op else rec
+
+# 增量文件 op 列的取值（不区分大小写，缺省为 upsert）
+_DELTA_OPS = {"": "upsert", "upsert": "upsert", "append": "upsert", "add": "upsert", "insert": "upsert",
+              "update": "upsert", "delete": "delete", "remove": "delete"}
+
+def _read_delta(path: str) -> Iterable[tuple[str, DoctorRecord]]:
+    """
+    增量文件：与主 CSV 同列，外加可选的 op 列（upsert / append / delete ...），
+    以 name + hospital_name 为键。delete 行只需要 name 与 hospital_name。
+    """
+    for op, rec in _read_rows(path, with_op=True):
+        kind = _DELTA_OPS.get(op)
+        if kind is None:
+            log.warning("Delta %s: unknown op %r for %s, skipped", path, op, rec.name)
+            continue
+        yield kind, rec
+
+def _delta_path(csv_path: str) -> str:
+    """doctors.csv -> doctors.delta.csv（DOCTOR_DB_DELTA 可改路径）"""
+    return os.getenv("DOCTOR_DB_DELTA") or os.path.splitext(csv_path)[0] + ".delta.csv"
+
+def _credentials(name: str) -> set[str]:
+    """从姓名后缀解析学位："Dr. Lee Diehl, MD" -> {"MD"}；"..., MB BS" -> {"MB", "BS"}"""
+    _, sep, tail = (name or "").partition(",")
+    return set(re.findall(r"[A-Z]+", tail.upper().replace(".", ""))) if sep else set()
+
+def _grams(s: str, n: int = 3) -> set[str]:
+    """字符 n-gram（默认 trigram），用于专科倒排索引"""
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+# -------- speciality resolver --------
+# 相似度兜底：余弦不低于 SIM_THRESHOLD 才算命中；与最高分相差 SIM_TIE 以内的并列专科一起返回
+SIM_THRESHOLD = 0.4
+SIM_TIE = 0.01
+RESOLVE_CACHE_SIZE = 4096
+
+def _words(s: str) -> list[str]:
+    """& -> and，括号 / 逗号 / 斜杠 / 连字符视为分隔"""
+    return re.sub(r"[(),/\-]", " ", s.replace("&", " and ")).split()
+
+def _tfidf_grams(s: str) -> dict[str, int]:
+    """逐词加边界空格取字符 trigram 的词频"""
+    tf: dict[str, int] = {}
+    for w in _words(s):
+        for g in _grams(f" {w} "):
+            tf[g] = tf.get(g, 0) + 1
+    return tf
+
+class _SpecialityResolver:
+    """
+    department 文本 -> 专科编号（编号即 norms 里的下标）。
+    两路取并集：
+    - 子串 + 等值（w in s or s in w，Orthopedic Sports Medicine ≈ Sports Medicine），
+      要求从词首开始对齐（"ENT" 不再命中 adolescENT，"Plast" 仍命中 Plastic Surgery），
+      trigram 倒排取候选再核对；
+    - 字符 trigram TF-IDF 余弦最相近的专科（Cardiologist ≈ Cardiology，
+      Obstetrics and Gynecology ≈ Obstetrics & Gynecology）。专科向量加载时算好并按 gram
+      倒排存放，打分 = 稀疏矩阵乘查询向量，只碰和查询共享 gram 的专科。
+    结果进 LRU。
+    """
+
+    def __init__(self, norms: list[str], cache_size: int = RESOLVE_CACHE_SIZE):
+        self.norms = norms
+        self._padded = [" " + " ".join(_words(s)) for s in norms]
+        # trigram -> 专科编号；不足 3 个字符的专科无法进倒排，单独记下
+        self._gram_specs: dict[str, set[int]] = {}
+        self._short_specs: set[int] = set()
+        for c, s in enumerate(norms):
+            g = _grams(s)
+            if not g:
+                self._short_specs.add(c)
+            for x in g:
+                self._gram_specs.setdefault(x, set()).add(c)
+
+        # TF-IDF：gram -> [(专科编号, 归一化权重)]
+        tfs = [_tfidf_grams(s) for s in norms]
+        df: dict[str, int] = {}
+        for tf in tfs:
+            for g in tf:
+                df[g] = df.get(g, 0) + 1
+        n = len(norms)
+        self._idf = {g: math.log((1 + n) / (1 + d)) + 1 for g, d in df.items()}
+        self._idf_unseen = math.log(1 + n) + 1
+        self._vec: dict[str, list[tuple[int, float]]] = {}
+        for c, tf in enumerate(tfs):
+            for g, x in self._weights(tf).items():
+                self._vec.setdefault(g, []).append((c, x))
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _weights(self, tf: dict[str, int]) -> dict[str, float]:
+        """次线性 tf × idf，再 L2 归一化；专科里没出现过的 gram 也计入查询的模长"""
+        v = {g: (1 + math.log(x)) * self._idf.get(g, self._idf_unseen) for g, x in tf.items()}
+        norm = math.sqrt(sum(x * x for x in v.values())) or 1.0
+        return {g: x / norm for g, x in v.items()}
+
+    def aligned(self, cand: Iterable[int], w: str) -> frozenset[int]:
+        """候选里与 w 互为子串、且从词首对齐的专科"""
+        pw = " " + " ".join(_words(w))
+        if not pw.strip():
+            return frozenset()
+        return frozenset(c for c in cand if pw in self._padded[c] or self._padded[c] in pw)
+
+    def substring(self, w: str) -> frozenset[int]:
+        """
+        两个方向的子串命中都至少共享一个 trigram，所以候选 = w 的 trigram posting 并集
+        + 短专科，再逐个核对即可。
+        """
+        if not w:
+            return frozenset()
+        g = _grams(w)
+        if not g:
+            cand = range(len(self.norms))
+        else:
+            cand = set(self._short_specs)
+            for x in g:
+                cand |= self._gram_specs.get(x, set())
+        return self.aligned(cand, w)
+
+    def scores(self, w: str) -> dict[int, float]:
+        """w 与各专科的余弦相似度（只含有共享 gram 的专科）"""
+        acc: dict[int, float] = {}
+        for g, x in self._weights(_tfidf_grams(w)).items():
+            for c, y in self._vec.get(g, ()):
+                acc[c] = acc.get(c, 0.0) + x * y
+        return acc
+
+    def similar(self, w: str) -> frozenset[int]:
+        acc = self.scores(w)
+        best = max(acc.values(), default=0.0)
+        if best < SIM_THRESHOLD:
+            return frozenset()
+        return frozenset(c for c, x in acc.items() if x >= best - SIM_TIE)
+
+    def _resolve(self, w: str) -> frozenset[int]:
+        return self.substring(w) | self.similar(w) if w else frozenset()
+
+# -------- columnar storage --------
+class _Categories:
+    """
+    字典编码的分类列：原始字符串 -> 编码（输出时原样还原），
+    每个编码再映射到 _norm 后的编号（过滤 / 分区用），两者共用一份字典。
+    """
+
+    def __init__(self):
+        self.values: list[str] = []
+        self.norms: list[str] = []
+        self.norm_of = array("I")
+        self._codes: dict[str, int] = {}
+        self._norm_ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, raw: str) -> int:
+        c = self._codes.get(raw)
+        if c is None:
+            c = self._codes[raw] = len(self.values)
+            self.values.append(raw)
+            n = _norm(raw)
+            nid = self._norm_ids.get(n)
+            if nid is None:
+                nid = self._norm_ids[n] = len(self.norms)
+                self.norms.append(n)
+            self.norm_of.append(nid)
+        return c
+
+    def norm_id(self, norm: str) -> Optional[int]:
+        return self._norm_ids.get(norm)
+
+    def copy(self) -> "_Categories":
+        new = _Categories.__new__(_Categories)
+        new.values, new.norms, new.norm_of = list(self.values), list(self.norms), array("I", self.norm_of)
+        new._codes, new._norm_ids = dict(self._codes), dict(self._norm_ids)
+        return new
+
+class _StrColumn:
+    """
+    UTF-8 拼接 + 偏移数组的字符串列，按需解码，不整体展开：
+    每行 4 字节偏移 + 正文，省掉每个 str 对象约 50 字节的头；快照 mmap 后直接复用
+    """
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._off = offsets
+        self._n = len(offsets) - 1
+        self._extra: list[str] = []  # 增量追加的行，不动 blob
+
+    @classmethod
+    def build(cls, strings: Iterable[str]) -> "_StrColumn":
+        blob, off = bytearray(), array("I", [0])
+        for s in strings:
+            blob += s.encode("utf-8")
+            off.append(len(blob))
+        return cls(bytes(blob), off)
+
+    def __len__(self) -> int:
+        return self._n + len(self._extra)
+
+    def __getitem__(self, i: int) -> str:
+        if i >= self._n:
+            return self._extra[i - self._n]
+        return str(self._blob[self._off[i]:self._off[i + 1]], "utf-8")
+
+    def append(self, s: str) -> None:
+        self._extra.append(s)
+
+    def truncate(self, n: int) -> None:
+        del self._extra[max(0, n - self._n):]
+
+# -------- snapshot format --------
+# magic | header_len(u32 LE) | header JSON | 8 字节对齐的各段数组
+# header 里有字符串字典、行数、源 CSV 的 mtime/size，以及每段的 (offset, typecode, count)
+SNAPSHOT_MAGIC = b"DOCSNAP\0"
+SNAPSHOT_VERSION = 2
+
+# 需要落盘的分区：属性名 -> 键的元数
+_PARTITIONS = {"_by_state": 1, "_by_city": 2, "_by_city_spec": 3, "_by_state_spec": 2, "_by_hosp": 1}
+
+# 学位选择率按至多这么多行的等距抽样估计（解析姓名后缀约 2us / 行，不全表扫）
+CRED_SAMPLE = 20000
+# 规划器代价，单位约为 100ns / 行（CPython 3.11 实测）：单份列表顺序读、多路归并（另加 log2(列表数) 项）、
+# 一项廉价的逐行检查（专科 / 位置 / 医院编号），以及学位检查（要解析姓名后缀，贵得多）
+_COST_SCAN, _COST_MERGE, _COST_MERGE_LOG, _COST_CHECK, _COST_CREDENTIAL = 1.5, 3.0, 0.4, 1.0, 20.0
+
+def _snapshot_path(csv_path: str) -> str:
+    return os.getenv("DOCTOR_DB_SNAPSHOT") or csv_path + ".snap"
+
+# -------- query front-end --------
+# 放宽层级，越靠前越精确
+# nearby：挂了城市中心点表时，从用户城市按距离一圈圈往外找（见 doctor_geo）
+TIERS = ("city_state", "nearby", "city", "state", "nationwide")
+
+class _DoctorQueries:
+    """
+    query / query_batch 的公共实现，内存索引与 SQLite 后端共用。
+    子类实现 _ranked(specialities, city, state, k, plan=None) -> (tier, [(rank, row), ...])，
+    rank 为全局名次（同一行在任何查询里 rank 都相同，可用来合并去重）；
+    plan 不为 None 时把执行计划（驱动分区、估计 / 实际行数）填进去，见 explain。
+    """
+
+    geo = None  # doctor_geo.CityGazetteer，可选
+    view = None  # doctor_view.TopNView，可选
+    hospital_stats = None  # doctor_hospitals.HospitalTable，top_hospitals 用
+
+    def attach_gazetteer(self, geo) -> None:
+        """挂上城市中心点表，开启 nearby 层；网格里只放有医生的城市"""
+        if geo is not None:
+            geo.index_places(self._place_keys())
+        self.geo = geo
+
+    def attach_view(self, view) -> None:
+        """挂上预计算的 top-N 视图；与当前数据版本不符时不挂（等重新预计算）"""
+        if view is not None and view.version != self.version:
+            log.info("Top-N view %s is for version %s, index is %s; not used", view.source, view.version, self.version)
+            view = None
+        self.view = view
+
+    def attach_hospital_stats(self, table) -> None:
+        """挂上按 (医院, 地点, 专科) 预聚合的表，开启 top_hospitals；之后的增量由 apply_delta 顺带更新"""
+        self.hospital_stats = table
+
+    def _patch_view(self, changes: tuple, new_specs: bool) -> None:
+        """
+        增量之后换上新视图：(删掉的行, 新增的行) 所在地点上的键作废，其余键换到新版本上继续命中。
+        增量带来了新专科时 department 的解析可能整体变化，视图不再用
+        """
+        if self.view is not None:
+            places = {(_norm(r[1]), _norm(r[2])) for rows in changes for r in rows}
+            self.view = None if new_specs else self.view.patched(places, self.version)
+
+    def _lookup(self, specialities: List[str], city: Optional[str], state: Optional[str], k: int,
+                plan: Optional[dict] = None):
+        """精确命中视图的 (department, city, state) 直接查表，其余（未预计算 / 需要放宽）走 _ranked"""
+        if self.view is not None:
+            hit = self.view.get(specialities, city, state, k, self.version)
+            if hit is not None:
+                if plan is not None:
+                    plan.update(driver="top_n_view", rows=len(hit))
+                return "city_state", hit
+        return self._ranked(specialities, city, state, k, plan)
+
+    def _nearby(self, city_l: str, state_l: str, k: int, count) -> list[tuple[float, tuple[str, str]]]:
+        """
+        用户城市没有结果时按距离由近及远纳入周边城市，累计 count(key) 满 k 位即停
+        （上限 doctor_geo.MAX_MILES）。返回 [(英里, (city, state)), ...]，无中心点时为空。
+        """
+        if self.geo is None or not (city_l and state_l):
+            return []
+        at = self.geo.locate(city_l, state_l)
+        if at is None:
+            return []
+        out, n = [], 0
+        for dist, key in self.geo.nearest(*at):
+            c = count(key)
+            if c:
+                out.append((dist, key))
+                n += c
+                if n >= k:
+                    break
+        return out
+
+    def query(
+        self,
+        specialities: List[str],
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        limit: int = 5,
+    ) -> List[dict]:
+        """
+        按 speciality + city/state 过滤，按 average_score 降序返回前 N。
+        无结果时依次放宽到 nearby（按距离）/ city / state / 全国，每行带 match_tier 标明实际命中的层级；
+        nearby 层的行另带 distance_miles。
+        """
+        if not len(self):
+            return []
+        tier, ranked = self._lookup(specialities, city, state, max(1, int(limit or 5)))
+        return [{**row, "match_tier": tier} for _, row in ranked]
+
+    def explain(
+        self,
+        specialities: List[str],
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        limit: int = 5,
+    ) -> dict:
+        """
+        同 query，外加执行计划：{"match_tier", "doctors", "plan"}。
+        plan 列出选中的驱动分区（driver）、逐行检查的残余条件、估计与实际的命中行数 / 扫描行数，
+        以及各候选方案的估计代价（后端不同，字段略有差别）。
+        """
+        plan: dict = {}
+        if not len(self):
+            return {"match_tier": "nationwide", "doctors": [], "plan": plan}
+        tier, ranked = self._lookup(specialities, city, state, max(1, int(limit or 5)), plan)
+        return {"match_tier": tier, "doctors": [{**row, "match_tier": tier} for _, row in ranked],
+                "plan": {"tier": tier, **plan}}
+
+    def top_hospitals(
+        self,
+        specialities: List[str],
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        limit: int = 5,
+    ) -> List[dict]:
+        """
+        按 speciality + city/state 给医院排名（同一医院在不同城市算不同的院区），见 HospitalTable：
+        每行带匹配的医生数、有评分的医生数、均分与平滑分（smoothed_score，排序依据）及命中的专科。
+        放宽层级与 query 相同，每行带 match_tier；nearby 层另带 distance_miles。
+        """
+        if self.hospital_stats is None:
+            raise ValueError("hospital aggregates are not loaded")
+        want = {_norm(s) for s in (specialities or [])}
+        specs = None
+        if want:
+            resolver = self._spec_resolver
+            specs = {resolver.norms[c] for w in want for c in resolver.resolve(w)}
+        city_l, state_l, k = _norm(city), _norm(state), max(1, int(limit or 5))
+        tier, rows = self.hospital_stats.top(specs, city_l, state_l, k,
+                                             lambda count: self._nearby(city_l, state_l, k, count))
+        return [{**row, "match_tier": tier} for row in rows]
+
+    def query_batch(self, queries: List[dict], limit: int = 5) -> dict:
+        """
+        一次评估多条查询（每条：specialities / city / state / 可选 limit），
+        返回每条的结果，以及合并去重后的前 N：先按层级（本地优先）、再按名次。
+        完全相同的查询只算一次。
+        """
+        k = max(1, int(limit or 5))
+        results: list[dict] = []
+        pool: dict = {}
+        seen: dict[tuple, tuple] = {}
+        for q in queries or []:
+            q = q or {}
+            specs = q.get("specialities") or []
+            if isinstance(specs, str):
+                specs = [specs]
+            qk = max(1, int(q.get("limit") or k))
+            key = (tuple(sorted({_norm(x) for x in specs})), _norm(q.get("city")), _norm(q.get("state")), qk)
+            if key not in seen:
+                seen[key] = (self._lookup(specs, q.get("city"), q.get("state"), qk)
+                             if len(self) else ("nationwide", []))
+            tier, ranked = seen[key]
+            results.append({
+                "specialities": list(specs),
+                "city": q.get("city"),
+                "state": q.get("state"),
+                "match_tier": tier,
+                "doctors": [{**row, "match_tier": tier} for _, row in ranked],
+            })
+            for rank, row in ranked:
+                best = pool.get(rank)
+                if best is None or TIERS.index(tier) < TIERS.index(best[0]):
+                    pool[rank] = (tier, row)
+        merged = sorted(pool.items(), key=lambda kv: (TIERS.index(kv[1][0]), kv[0]))[:k]
+        return {
+            "results": results,
+            "merged": [{**row, "match_tier": tier} for _, (tier, row) in merged],
+        }
+
+    def page(
+        self,
+        specialty,
+        location: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+        filter_state: Optional[str] = None,
+        min_score: Optional[float] = None,
+        credential: Optional[str] = None,
+        hospital: Optional[str] = None,
+        explain: bool = False,
+    ) -> dict:
+        """
+        分页浏览某专科 + 地点的全部医生（不做放宽），顺序与 query 相同。
+        location 可以是 "City, ST"、州缩写或城市名；filter_state 额外限定州。
+        过滤：min_score（评分下限）、credential（MD / DO 等，取自姓名后缀）、hospital（医院名子串）。
+        next_cursor 记下本页最后一行的排序键与名次，下一页从那里接着取，
+        每页只花 O(页大小)；total 只在第一页统计，之后随 cursor 带着走。
+        explain=True 时结果另带 plan（同 explain()）。
+        """
+        specs = [specialty] if isinstance(specialty, str) else list(specialty or [])
+        city, state = self._split_location(location)
+        fs = _norm(filter_state)
+        if fs:
+            if state and state != fs:
+                return {"total": 0, "count": 0, "doctors": [], "next_cursor": None, **({"plan": {}} if explain else {})}
+            state = fs
+        flt = {
+            "min_score": None if min_score is None else float(min_score),
+            "credential": (credential or "").strip().upper().replace(".", "") or None,
+            "hospital": _norm(hospital) or None,
+        }
+        k = max(1, min(int(limit or 50), 500))
+        fp = hashlib.sha1(json.dumps(
+            [sorted(_norm(x) for x in specs), city, state, flt], sort_keys=True).encode()).hexdigest()[:12]
+
+        after = None
+        if cursor:
+            try:
+                after = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            except Exception:
+                raise ValueError("invalid cursor")
+            if after.get("q") != fp:
+                raise ValueError("cursor does not belong to this query")
+            offset = 0
+
+        if not len(self):
+            return {"total": 0, "count": 0, "doctors": [], "next_cursor": None, **({"plan": {}} if explain else {})}
+        plan = {} if explain else None
+        rows, total = self._page(specs, city, state, flt, after, k + 1, max(0, int(offset or 0)), after is None, plan)
+        if after is not None:
+            total = after.get("t")
+        more = len(rows) > k
+        rows = rows[:k]
+        next_cursor = None
+        if more and rows:
+            rank, key, _ = rows[-1]
+            token = {"q": fp, "v": self.version, "r": rank, "k": list(key), "t": total}
+            next_cursor = base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+        out = {
+            "total": total,
+            "count": len(rows),
+            "doctors": [row for _, _, row in rows],
+            "next_cursor": next_cursor,
+        }
+        if plan is not None:
+            out["plan"] = plan
+        return out
+
+    def _split_location(self, location: Optional[str]) -> tuple[str, str]:
+        """ "Durham, NC" -> (durham, nc)；单个词是已知州则当州，否则当城市"""
+        parts = [_norm(x) for x in (location or "").split(",") if _norm(x)]
+        if not parts:
+            return "", ""
+        if len(parts) >= 2:
+            return parts[0], parts[1].split()[0]
+        return ("", parts[0]) if self._is_state(parts[0]) else (parts[0], "")
+
+# -------- index --------
+class DoctorIndex(_DoctorQueries):
+    """
+    常驻内存的医生表：CSV 只在启动时解析一次，之后所有查询都在内存里完成。
+
+    启动时优先 mmap 预编译的二进制快照（见 write_snapshot），免去 CSV 解析与建索引。
+
+    列式存储：average_score 为 float32 数组，city / state / speciality /
+    hospital_name 为字典编码的整数列，分区与 posting list 也都是紧凑的
+    array('I')，每行只剩几十字节（主要是 name 字符串本身）。
+
+    专科走倒排索引：不同的 speciality 字符串只有几百个，先用 trigram 把
+    department 解析成专科编号（每个 department 只解析一次），再取这些专科
+    的 posting list 作为候选行，不再对每一行做子串比较。
+
+    state / (city, state) / speciality 各自一份按排序键预排好的分区，
+    top-k = 对少数几个分区做堆归并，凑满 k 行提前结束，不再全量过滤 + 排序。
+
+    放宽（city+state → city → state → 全国）一次判定：位置 × 专科的复合分区
+    只存非空的，所以每个层级有没有结果只看分区是否存在，直接选出最高的非空
+    层级再归并，落到哪一层耗时都一样。
+
+    选哪份分区来驱动扫描由 _plan 按基数估计决定：各取值的行数就是分区长度，
+    复合分区要归并的列表太多、或医院过滤比位置 × 专科更有选择性时，
+    改由单份位置 / 专科 / 医院 posting list 驱动，其余条件逐行惰性检查。
+    """
+
+    def __init__(self, rows: Iterable[DoctorRecord], source: str = "", load_ms: float = 0.0):
+        self.source = source
+        self.source_mtime = os.path.getmtime(source) if source and os.path.exists(source) else 0.0
+        self.load_ms = load_ms
+        self.loaded_at = time.time()
+        self._load_columns(rows)
+        self._build_partitions()
+        self._build_spec_grams()
+        self._reset_overlay()
+
+    def _load_columns(self, rows: Iterable[DoctorRecord]) -> None:
+        self.cities = _Categories()
+        self.states = _Categories()
+        self.specs = _Categories()
+        self.hospitals = _Categories()
+
+        names: list[str] = []
+        keys: list[tuple] = []
+        score, spec, hosp, city, state = array("f"), array("I"), array("I"), array("I"), array("I")
+        for r in rows:
+            names.append(r.name)
+            score.append(r.average_score)
+            spec.append(self.specs.code(r.speciality))
+            hosp.append(self.hospitals.code(r.hospital_name))
+            city.append(self.cities.code(r.city))
+            state.append(self.states.code(r.state))
+            # 排序键直接用记录里的影子键；评分取 float32 存储后的值，与列一致
+            keys.append((-score[-1], r.hospital_n, r.name_n))
+
+        # 加载时按全局排序键（评分降序，其次医院名、医生名）排一次：行号即名次，
+        # 之后所有 posting list 都按行号递增存放，天然有序，top-k 只需多路归并取前 k 个
+        order = sorted(range(len(names)), key=keys.__getitem__)
+        del keys
+        self._names = _StrColumn.build(names[i] for i in order)
+        del names
+        self._score = array("f", (score[i] for i in order))
+        self._spec = array("I", (spec[i] for i in order))
+        self._hosp = array("I", (hosp[i] for i in order))
+        self._city = array("I", (city[i] for i in order))
+        self._state = array("I", (state[i] for i in order))
+
+    def _build_partitions(self) -> None:
+        # 位置分区：state、(city, state)；city -> 出现过的 (city, state)
+        # 专科分区：speciality；复合分区：(city, state, 专科) 与 (state, 专科)
+        # 医院分区：hospital_name（医院过滤的驱动列表，也供增量按 name + hospital 找行）
+        # 键都是归一化后的编号
+        self._by_state: dict[int, array] = {}
+        self._by_city: dict[tuple[int, int], array] = {}
+        self._spec_rows: list[array] = [array("I") for _ in self.specs.norms]
+        self._by_city_spec: dict[tuple, array] = {}
+        self._by_state_spec: dict[tuple, array] = {}
+        self._by_hosp: dict[int, array] = {}
+        city_n, state_n, spec_n = self.cities.norm_of, self.states.norm_of, self.specs.norm_of
+        hosp_n = self.hospitals.norm_of
+        for i in range(len(self._names)):
+            c, st, sp = city_n[self._city[i]], state_n[self._state[i]], spec_n[self._spec[i]]
+            self._by_hosp.setdefault(hosp_n[self._hosp[i]], array("I")).append(i)
+            self._by_state.setdefault(st, array("I")).append(i)
+            self._by_city.setdefault((c, st), array("I")).append(i)
+            self._spec_rows[sp].append(i)
+            self._by_city_spec.setdefault((c, st, sp), array("I")).append(i)
+            self._by_state_spec.setdefault((st, sp), array("I")).append(i)
+        self._index_city_keys()
+
+    def _index_city_keys(self) -> None:
+        self._city_keys: dict[int, list[tuple[int, int]]] = {}
+        for key in self._by_city:
+            self._city_keys.setdefault(key[0], []).append(key)
+
+    def _build_spec_grams(self) -> None:
+        self._spec_resolver = _SpecialityResolver(self.specs.norms)
+        self._hospitals_resolved: dict[str, set[int]] = {}
+
+    def _reset_overlay(self) -> None:
+        """
+        增量层：基础列与分区（行号 = 名次）保持不可变，
+        删除 / 被更新的行记进墓碑 _dead，新行追加到列尾（行号 >= _base），
+        名次取它在基础行之间的插入位置（小数），并按名次插进 _ov 里对应的小分区。
+        """
+        self._base = self._n = len(self._names)  # _n：本索引可见的列行数（列尾之后是后续副本追加的行）
+        self._dead: set[int] = set()
+        self._extra_rank: dict[int, float] = {}
+        self._ov: dict[tuple, list[int]] = {}
+        self._ov_slots: dict[int, list[tuple]] = {}  # 插入位置 -> 落在这里的新行 [(排序键, 行号)]
+        self._creds: Optional[dict[str, float]] = None  # 学位 -> 选择率，首次用到时抽样（_cred_share）
+        self._delta_seq = 0
+
+    @classmethod
+    def from_csv(cls, path: str) -> "DoctorIndex":
+        t0 = time.perf_counter()
+        index = cls(_read_rows(path), source=path)
+        index.load_ms = (time.perf_counter() - t0) * 1000
+        if not len(index):
+            log.warning("CSV read 0 rows from: %s", path)
+        log.info("Doctor index loaded: %d rows from %s in %.1f ms", len(index), path, index.load_ms)
+        return index
+
+    @classmethod
+    def load(cls, csv_path: str) -> "DoctorIndex":
+        """
+        优先 mmap 预编译快照；快照不存在、版本不符或源 CSV 更新时，
+        回退解析 CSV 并顺手重新生成快照。
+        """
+        snap = _snapshot_path(csv_path)
+        if os.path.exists(snap) and not (
+            os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(snap)
+        ):
+            try:
+                index = cls.from_snapshot(snap)
+                # CSV 被替换成 mtime 更早的文件（如 mv 保留了时间戳）时，快照同样作废
+                if not os.path.exists(csv_path) or index.source_mtime == os.path.getmtime(csv_path):
+                    return index
+                log.info("Snapshot %s was built from a different CSV, rebuilding", snap)
+            except (OSError, ValueError) as e:
+                log.warning("Snapshot %s unusable (%s), rebuilding from CSV", snap, e)
+        index = cls.from_csv(csv_path)
+        if len(index):
+            try:
+                index.write_snapshot(snap)
+            except OSError as e:
+                log.warning("Could not write snapshot %s: %s", snap, e)
+        return index
+
+    def write_snapshot(self, path: str) -> None:
+        """把列、字符串字典和分区写成版本化的二进制快照（先写临时文件再原子替换）"""
+        if self._delta_seq:
+            raise ValueError("index has deltas applied; snapshot the base CSV instead")
+        sections = {
+            "score": self._score, "spec": self._spec, "hosp": self._hosp,
+            "city": self._city, "state": self._state,
+            "name_off": self._names._off, "name_blob": array("B", bytes(self._names._blob)),
+        }
+        spec_off, spec_ids = array("I", [0]), array("I")
+        for p in self._spec_rows:
+            spec_ids.extend(p)
+            spec_off.append(len(spec_ids))
+        sections["_spec_rows.off"], sections["_spec_rows.ids"] = spec_off, spec_ids
+        for attr, arity in _PARTITIONS.items():
+            keys, off, ids = array("I"), array("I", [0]), array("I")
+            for key, p in getattr(self, attr).items():
+                keys.extend((key,) if arity == 1 else key)
+                ids.extend(p)
+                off.append(len(ids))
+            sections[attr + ".keys"], sections[attr + ".off"], sections[attr + ".ids"] = keys, off, ids
+
+        layout, pos = {}, 0
+        for name, arr in sections.items():
+            layout[name] = [pos, arr.typecode, len(arr)]
+            pos += -(-len(arr) * arr.itemsize // 8) * 8
+        header = json.dumps({
+            "version": SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "source": self.source,
+            "source_mtime": self.source_mtime,
+            "rows": len(self),
+            "categories": {k: getattr(self, k).values for k in ("cities", "states", "specs", "hospitals")},
+            "sections": layout,
+        }, ensure_ascii=False).encode("utf-8")
+        base = -(-(len(SNAPSHOT_MAGIC) + 4 + len(header)) // 8) * 8
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            for name, arr in sections.items():
+                f.write(b"\0" * (base + layout[name][0] - f.tell()))
+                arr.tofile(f)
+        os.replace(tmp, path)
+        log.info("Doctor snapshot written: %s (%d rows)", path, len(self))
+
+    @classmethod
+    def from_snapshot(cls, path: str) -> "DoctorIndex":
+        """mmap 快照：列和分区直接是文件上的 memoryview，只重建小字典"""
+        t0 = time.perf_counter()
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("not a doctor snapshot")
+        hlen = int.from_bytes(mm[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 4], "little")
+        start = len(SNAPSHOT_MAGIC) + 4
+        header = json.loads(mm[start:start + hlen].decode("utf-8"))
+        if header.get("version") != SNAPSHOT_VERSION or header.get("byteorder") != sys.byteorder:
+            raise ValueError("snapshot version/byteorder mismatch")
+        base = -(-(start + hlen) // 8) * 8
+        view = memoryview(mm)
+
+        def section(name):
+            off, typecode, count = header["sections"][name]
+            size = array(typecode).itemsize
+            return view[base + off: base + off + count * size].cast(typecode)
+
+        self = cls.__new__(cls)
+        self._mmap = mm
+        self.source = header.get("source", "")
+        self.source_mtime = header.get("source_mtime", 0.0)
+        self.loaded_at = time.time()
+        for attr, values in header["categories"].items():
+            cat = _Categories()
+            for v in values:
+                cat.code(v)
+            setattr(self, attr, cat)
+        self._names = _StrColumn(section("name_blob"), section("name_off"))
+        self._score = section("score")
+        self._spec, self._hosp = section("spec"), section("hosp")
+        self._city, self._state = section("city"), section("state")
+
+        off, ids = section("_spec_rows.off"), section("_spec_rows.ids")
+        self._spec_rows = [ids[off[j]:off[j + 1]] for j in range(len(off) - 1)]
+        for attr, arity in _PARTITIONS.items():
+            keys, off, ids = section(attr + ".keys"), section(attr + ".off"), section(attr + ".ids")
+            part = {}
+            for j in range(len(off) - 1):
+                key = keys[j] if arity == 1 else tuple(keys[j * arity:(j + 1) * arity])
+                part[key] = ids[off[j]:off[j + 1]]
+            setattr(self, attr, part)
+        self._index_city_keys()
+        self._build_spec_grams()
+        self._reset_overlay()
+        self.load_ms = (time.perf_counter() - t0) * 1000
+        log.info("Doctor index mapped: %d rows from %s in %.1f ms", len(self), path, self.load_ms)
+        return self
+
+    def __len__(self) -> int:
+        return self._n - len(self._dead)
+
+    @property
+    def version(self) -> str:
+        """数据版本：同一份 CSV 建出来的名次完全相同，cursor 可以直接按名次续读；每应用一次增量 +1"""
+        base = f"{self.source_mtime:.3f}:{len(self)}"
+        return f"{base}+{self._delta_seq}" if self._delta_seq else base
+
+    def _rank(self, i: int) -> float:
+        """全局名次：基础行就是行号，增量行是插入位置处的小数"""
+        return i if i < self._base else self._extra_rank[i]
+
+    def _sort_key(self, i: int) -> tuple:
+        return (-self._score[i], self.hospitals.norms[self.hospitals.norm_of[self._hosp[i]]], _norm(self._names[i]))
+
+    def _is_state(self, state_l: str) -> bool:
+        return self.states.norm_id(state_l) is not None
+
+    def _public(self, i: int) -> dict:
+        """仅输出关心字段（从列里还原一行）"""
+        return {
+            "name": self._names[i],
+            "hospital_name": self.hospitals.values[self._hosp[i]],
+            "speciality": self.specs.values[self._spec[i]],
+            # float32 -> 去掉尾数噪声
+            "average_score": round(float(self._score[i]), 6),
+            "city": self.cities.values[self._city[i]],
+            "state": self.states.values[self._state[i]],
+        }
+
+    def _resolve(self, w: str) -> frozenset[int]:
+        """
+        department（已 _norm）-> 匹配的专科编号。
+        词首对齐的子串 / 等值匹配 ∪ TF-IDF 余弦最相近的专科，见 _SpecialityResolver。
+        """
+        return self._spec_resolver.resolve(w)
+
+    def _spec_codes(self, want_specs: set[str]) -> Optional[set[int]]:
+        """wanted 为空时返回 None（不限专科）；否则返回命中的专科编号"""
+        if not want_specs:
+            return None
+        codes: set[int] = set()
+        for w in want_specs:
+            codes |= self._resolve(w)
+        return codes
+
+    def _merged(self, parts: list) -> Iterable[int]:
+        """
+        多路归并若干个有序分区（惰性）。
+        同一行可能出现在多个分区里（相邻出现），顺手去重。
+        """
+        merged = heapq.merge(*parts, key=self._rank) if self._extra_rank else heapq.merge(*parts)
+        dead = self._dead
+        last = -1
+        for i in merged:
+            if i != last:
+                last = i
+                if i not in dead:
+                    yield i
+
+    def _scan(self, parts: list, keep: Optional[Callable] = None, plan: Optional[dict] = None) -> Iterable[int]:
+        """归并驱动分区，残余条件逐行检查；plan 不为 None 时把从驱动分区拉出的行数计进 actual_scanned"""
+        it = self._merged(parts)
+        if plan is not None:
+            it = self._counted(it, plan)
+        return it if keep is None else filter(keep, it)
+
+    @staticmethod
+    def _counted(it: Iterable[int], plan: dict) -> Iterable[int]:
+        plan["actual_scanned"] = 0
+        for i in it:
+            plan["actual_scanned"] += 1
+            yield i
+
+    def _top(self, parts: list, k: int, keep: Optional[Callable] = None, plan: Optional[dict] = None) -> list[int]:
+        """归并后凑满 k 个即停"""
+        return list(itertools.islice(self._scan(parts, keep, plan), k))
+
+    def _any(self, parts: list) -> bool:
+        """分区里是否还有活着的行（有墓碑时不能只看长度）"""
+        return any(parts) if not self._dead else next(iter(self._merged(parts)), None) is not None
+
+    def _count(self, parts: list) -> int:
+        return sum(map(len, parts)) if not self._dead else sum(1 for _ in self._merged(parts))
+
+    def _with_overlay(self, parts: list, keys) -> list:
+        if self._ov:
+            parts += [p for key in keys if (p := self._ov.get(key))]
+        return parts
+
+    def _city_parts(self, keys, codes: Optional[set[int]]) -> list:
+        if codes is None:
+            return self._with_overlay([p for key in keys if (p := self._by_city[key])],
+                                      [("city", *key) for key in keys])
+        return self._with_overlay([p for key in keys for c in codes
+                                   if (p := self._by_city_spec.get((key[0], key[1], c)))],
+                                  [("city_spec", *key, c) for key in keys for c in codes])
+
+    def _state_parts(self, st: Optional[int], codes: Optional[set[int]]) -> list:
+        if codes is None:
+            p = self._by_state.get(st)
+            return self._with_overlay([p] if p else [], [("state", st)])
+        return self._with_overlay([p for c in codes if (p := self._by_state_spec.get((st, c)))],
+                                  [("state_spec", st, c) for c in codes])
+
+    def _spec_parts(self, codes: Optional[set[int]]) -> list:
+        if codes is None:
+            return self._with_overlay([range(self._base)] if self._base else [], [("all",)])
+        return self._with_overlay([self._spec_rows[c] for c in codes], [("spec", c) for c in codes])
+
+    def _hospital_codes(self, hospital_l: str) -> set[int]:
+        """医院名子串 -> 原始医院编号（医院字典只有几千项，按需扫一遍并缓存）"""
+        hit = self._hospitals_resolved.get(hospital_l)
+        if hit is None:
+            norms, norm_of = self.hospitals.norms, self.hospitals.norm_of
+            hit = self._hospitals_resolved[hospital_l] = {
+                c for c in range(len(self.hospitals)) if hospital_l in norms[norm_of[c]]}
+        return hit
+
+    def _page(self, specs, city_l: str, state_l: str, flt: dict, after: Optional[dict],
+              k: int, offset: int, want_total: bool, plan: Optional[dict] = None):
+        """page() 的内存实现：_plan 选出的驱动分区上的多路归并，从 cursor 处续读"""
+        codes = self._spec_codes({_norm(s) for s in specs})
+        c = self.cities.norm_id(city_l) if city_l else None
+        st = self.states.norm_id(state_l) if state_l else None
+        if (city_l and c is None) or (state_l and st is None):
+            return [], 0
+        keys = None
+        if city_l:
+            keys = [key for key in ([(c, st)] if state_l else self._city_keys.get(c, [])) if key in self._by_city]
+            exact, st = self._city_parts(keys, codes), None
+        elif state_l:
+            exact = self._state_parts(st, codes)
+        else:
+            exact = self._spec_parts(codes)
+        # 要统计 total 时反正要扫完全部命中行；否则只需凑够 offset + k 行
+        parts, keep = self._plan(exact, keys, st, codes, None if want_total else offset + k, flt, plan)
+
+        # 续读：同一数据版本直接按名次定位，否则（索引已重建）按排序键定位；
+        # incl 为分片协调方用的：排序键与上一页末行相同的行还没发出，从该键（含）开始
+        if after is not None:
+            if after.get("v") == self.version:
+                rank = self._rank if self._extra_rank else None
+                starts = [bisect.bisect_right(p, after["r"], key=rank) for p in parts]
+            else:
+                key = tuple(after["k"])
+                find = bisect.bisect_left if after.get("incl") else bisect.bisect_right
+                starts = [find(p, key, key=self._sort_key) for p in parts]
+            parts = [memoryview(p)[n:] if isinstance(p, (array, memoryview)) else p[n:]
+                     for p, n in zip(parts, starts)]
+
+        min_score = _f32(flt["min_score"])
+        out: list = []
+        for i in self._scan(parts, plan=plan):
+            if min_score is not None and self._score[i] < min_score:
+                break  # 分区按评分降序，后面不会再有达标的
+            if keep is not None and not keep(i):
+                continue
+            if offset:
+                offset -= 1
+                continue
+            out.append((self._rank(i), self._sort_key(i), self._public(i)))
+            if len(out) >= k:
+                break
+
+        total = None
+        if want_total:
+            if keep is None and not self._dead:
+                # 无残余条件：各分区里评分达标的是一段前缀，二分即可
+                total = self._size(parts, min_score)
+            else:
+                total = self._matching(parts, keep, min_score)
+        if plan is not None:
+            plan["actual_rows"] = total if total is not None else self._matching(parts, keep, min_score)
+        return out, total
+
+    def _size(self, parts: list, min_score: Optional[float] = None) -> int:
+        """分区总行数（不看墓碑）；给了 min_score（已按 _f32 取整）时只算评分达标的前缀"""
+        if min_score is None:
+            return sum(map(len, parts))
+        return sum(bisect.bisect_right(p, -min_score, key=lambda i: -self._score[i]) for p in parts)
+
+    def _matching(self, parts: list, keep: Optional[Callable], min_score: Optional[float] = None) -> int:
+        n = 0
+        for i in self._scan(parts, keep):
+            if min_score is not None and self._score[i] < min_score:
+                continue
+            n += 1
+        return n
+
+    def _cascade(self, city_l: str, state_l: str, codes: Optional[set[int]]) -> tuple:
+        """
+        一次走完放宽层级：city+state → city → state → nationwide，
+        返回 (最高的非空层级, 城市键 或 None, 州编号 或 None, 该层的复合分区)。
+        每层的分区都只含命中行，判空就是看列表是否为空，不用扫描。
+        """
+        c = self.cities.norm_id(city_l) if city_l else None
+        st = self.states.norm_id(state_l) if state_l else None
+        if c is not None and st is not None and (c, st) in self._by_city:
+            parts = self._city_parts([(c, st)], codes)
+            if self._any(parts):
+                return "city_state", [(c, st)], None, parts
+        if c is not None:
+            keys = list(self._city_keys.get(c, ()))
+            parts = self._city_parts(keys, codes)
+            if self._any(parts):
+                return "city", keys, None, parts
+        if st is not None:
+            parts = self._state_parts(st, codes)
+            if self._any(parts):
+                return "state", None, st, parts
+        return "nationwide", None, None, self._spec_parts(codes)
+
+    # -------- planner --------
+    def _cred_share(self, cred: str) -> float:
+        """某个学位占全部行的比例：第一次用到时对姓名列等距抽样 CRED_SAMPLE 行，应用增量后重算"""
+        creds = self._creds
+        if creds is None:
+            step = max(1, self._n // CRED_SAMPLE)
+            sample = range(0, self._n, step)
+            creds = {}
+            for i in sample:
+                for c in _credentials(self._names[i]):
+                    creds[c] = creds.get(c, 0) + 1
+            creds = {c: n / max(len(sample), 1) for c, n in creds.items()}
+            self._creds = creds
+        return creds.get(cred, 0.0)
+
+    def _hosp_parts(self, hosp: set[int]) -> list:
+        """命中医院（原始编号）的 posting list，含增量层"""
+        hs = {self.hospitals.norm_of[c] for c in hosp}
+        return self._with_overlay([p for h in hs if (p := self._by_hosp.get(h))], [("hosp", h) for h in hs])
+
+    @staticmethod
+    def _driver(keys, st, codes) -> str:
+        if keys is not None:
+            return "city" if codes is None else "city_spec"
+        if st is not None:
+            return "state" if codes is None else "state_spec"
+        return "all" if codes is None else "spec"
+
+    def _plan(self, exact: list, keys: Optional[list], st: Optional[int], codes: Optional[set[int]],
+              need: Optional[int], flt: Optional[dict] = None, plan: Optional[dict] = None):
+        """
+        选驱动扫描的 posting list，返回 (驱动分区, 残余条件 或 None)。
+        keys（城市键）/ st（州编号）/ codes（专科编号）描述这一层的位置与专科，exact 是它们的复合分区；
+        flt 为 page 的过滤（min_score / credential / hospital）。候选：
+          复合分区（位置 × 专科，精确）；只按位置、逐行查专科；只按专科、逐行查位置；
+          有医院过滤时按医院、逐行查位置 / 专科。
+        基数即各分区长度（加载时建好），医院 / 学位按行数估选择率，各条件视为相互独立：
+        命中 = 复合分区行数 × 医院选择率 × 学位选择率；凑满 need 行约要从驱动分区拉出
+        扫描量 × need / 命中 行（need 为 None 表示全部命中行）。代价按 _COST_* 折算，
+        取最低的；平手时用复合分区。只有在真的要比较时才把候选分区取出来。
+        """
+        flt = flt or {}
+        min_score, cred = _f32(flt.get("min_score")), flt.get("credential")
+        hosp = self._hospital_codes(flt["hospital"]) if flt.get("hospital") else None
+        if plan is None and hosp is None and cred is None and (len(exact) <= 1 or (keys is None and st is None)):
+            return exact, None  # 单份精确分区，或不限位置（只有专科分区可用）：没有可选的
+
+        ov = self._ov
+        if keys is not None:
+            loc_lists = len(keys)
+            loc_rows = sum(len(self._by_city[key]) + len(ov.get(("city", *key), ())) for key in keys)
+        elif st is not None:
+            loc_lists, loc_rows = 1, len(self._by_state.get(st, ())) + len(ov.get(("state", st), ()))
+        exact_rows = self._size(exact, min_score)
+        # 候选：(名称, 列表数, 行数 或 None（要取分区才知道）, 取分区, 残余条件)；第一个是复合分区
+        cands = [(self._driver(keys, st, codes), len(exact), exact_rows, lambda: exact, [])]
+        if codes is not None and (keys is not None or st is not None):
+            cands.append((self._driver(keys, st, None), loc_lists, loc_rows,
+                          lambda: self._city_parts(keys, None) if keys is not None else self._state_parts(st, None),
+                          ["speciality"]))
+            if len(exact) > len(codes):
+                # 专科分区的行数 / 列表数都不少于复合分区时它不可能更便宜，只有跨多个城市键时才值得一比
+                cands.append(("spec", len(codes),
+                              sum(len(self._spec_rows[c]) + len(ov.get(("spec", c), ())) for c in codes),
+                              lambda: self._spec_parts(codes), ["place"]))
+        if hosp is not None:
+            hosp_parts = self._hosp_parts(hosp)
+            cands.append(("hospital", len(hosp_parts), None, lambda: hosp_parts,
+                          [c for c, on in (("speciality", codes is not None),
+                                           ("place", keys is not None or st is not None)) if on]))
+
+        n = max(len(self), 1)
+        match = float(exact_rows)
+        if hosp is not None:
+            match *= self._size(hosp_parts) / n
+        base_match = match  # 学位以外的条件都满足的行
+        if cred is not None:
+            match *= self._cred_share(cred)
+        best, considered = None, []
+        for j, (name, lists, rows, get, residual) in enumerate(cands):
+            parts = None
+            if rows is None or (j and min_score is not None):
+                parts = get()
+                rows = self._size(parts, min_score)
+            if name != "hospital" and hosp is not None:
+                residual = residual + ["hospital"]
+            scanned = float(rows)
+            if need is not None and match > need:
+                scanned *= need / match
+            per_row = _COST_SCAN if lists <= 1 else _COST_MERGE + _COST_MERGE_LOG * math.log2(lists)
+            cost = lists + scanned * (per_row + _COST_CHECK * len(residual))
+            if cred is not None:
+                # 学位检查放在最后，只落在通过了其它条件的行上
+                cost += scanned * min(1.0, base_match / max(rows, 1)) * _COST_CREDENTIAL
+            if plan is not None:
+                considered.append({"driver": name, "lists": lists, "est_scanned": round(scanned),
+                                   "cost": round(cost, 1)})
+            if best is None or cost < best[0]:
+                best = (cost, name, parts, get, residual, scanned)
+        _, name, parts, get, residual, scanned = best
+        if parts is None:
+            parts = get()
+
+        spec_n, city_n, state_n = self.specs.norm_of, self.cities.norm_of, self.states.norm_of
+        checks = []
+        if "speciality" in residual:
+            checks.append(lambda i: spec_n[self._spec[i]] in codes)
+        if "place" in residual:
+            if keys is not None:
+                places = set(keys)
+                checks.append(lambda i: (city_n[self._city[i]], state_n[self._state[i]]) in places)
+            else:
+                checks.append(lambda i: state_n[self._state[i]] == st)
+        if "hospital" in residual:
+            checks.append(lambda i: self._hosp[i] in hosp)
+        if cred is not None:
+            residual = residual + ["credential"]
+            checks.append(lambda i: cred in _credentials(self._names[i]))
+        keep = None
+        for f in reversed(checks):
+            keep = f if keep is None else (lambda i, f=f, g=keep: f(i) and g(i))
+        if plan is not None:
+            plan.update(driver=name, lists=len(parts), residual=residual, est_rows=round(match),
+                        est_scanned=round(scanned), candidates=considered)
+        return parts, keep
+
+    def footprint(self) -> dict:
+        """
+        内存占用估算（字节）：heap = 进程堆上的列 / 分区 / 字典，
+        mapped = 直接引用 mmap 快照的部分（由页缓存承担，可在进程间共享）
+        """
+        heap = mapped = 0
+
+        def add(obj):
+            nonlocal heap, mapped
+            heap += sys.getsizeof(obj)
+            if isinstance(obj, memoryview):
+                mapped += obj.nbytes
+
+        for col in (self._score, self._spec, self._hosp, self._city, self._state,
+                    self._names, self._names._blob, self._names._off, self._spec_rows):
+            add(col)
+        for p in self._spec_rows:
+            add(p)
+        for attr in _PARTITIONS:
+            part = getattr(self, attr)
+            add(part)
+            for key, p in part.items():
+                add(key)
+                add(p)
+        for cat in (self.cities, self.states, self.specs, self.hospitals):
+            for obj in (cat.values, cat.norms, cat.norm_of, cat._codes, cat._norm_ids):
+                add(obj)
+            for v in itertools.chain(cat.values, cat.norms):
+                add(v)
+        rows = max(len(self), 1)
+        return {"heap_bytes": heap, "mapped_bytes": mapped, "bytes_per_row": round((heap + mapped) / rows, 1)}
+
+    def status(self) -> dict:
+        return {
+            "backend": "memory",
+            "source": self.source,
+            "rows": len(self),
+            "load_ms": round(self.load_ms, 1),
+            "loaded_at": self.loaded_at,
+            "spec_cache": self._spec_resolver.resolve.cache_info()._asdict(),
+            "delta_seq": self._delta_seq,
+            "tombstones": len(self._dead),
+            "overlay_rows": self._n - self._base,
+            **self.footprint(),
+        }
+
+    def _place_keys(self) -> set[tuple[str, str]]:
+        return {(self.cities.norms[c], self.states.norms[st]) for c, st in self._by_city}
+
+    def _hospital_groups(self) -> Iterable[tuple]:
+        """
+        (医院, city, state, 专科, 医生数, 有评分人数, 评分和)，按列编号一遍扫描聚合（见 HospitalTable）；
+        同一家医院的不同写法各成一组，显示名由 HospitalTable 按医生数计票决定
+        """
+        acc: dict[tuple, list] = {}
+        dead = self._dead
+        for i, key in enumerate(itertools.islice(zip(self._hosp, self._city, self._state, self._spec), self._n)):
+            if i in dead:
+                continue
+            a = acc.get(key)
+            if a is None:
+                a = acc[key] = [0, 0, 0.0]
+            a[0] += 1
+            score = self._score[i]
+            if score > 0:
+                a[1] += 1
+                a[2] += score
+        hosp, city, state, spec = self.hospitals.values, self.cities.values, self.states.values, self.specs.values
+        return [(hosp[h], city[c], state[st], spec[sp], *a) for (h, c, st, sp), a in acc.items()]
+
+    def _hospital_rows(self, rows: Iterable[int]) -> list[tuple]:
+        """(医院, city, state, 专科, average_score)，HospitalTable.updated 的输入"""
+        return [(self.hospitals.values[self._hosp[i]], self.cities.values[self._city[i]],
+                 self.states.values[self._state[i]], self.specs.values[self._spec[i]], self._score[i]) for i in rows]
+
+    # -------- incremental delta --------
+    def apply_delta(self, source: Union[str, Iterable[tuple[str, DoctorRecord]]],
+                    states: Optional[set[str]] = None) -> dict:
+        """
+        原地应用增量（with_delta 后接管副本的状态）：只能用在没有别的线程在读的索引上——
+        刚建好、尚未发布的索引，或逐条处理请求的分片进程。正在服务的索引用 with_delta 换新对象。
+        失败时本索引不变。
+        """
+        new, stats = self.with_delta(source, states)
+        self.__dict__.update(new.__dict__)
+        return stats
+
+    def with_delta(self, source: Union[str, Iterable[tuple[str, DoctorRecord]]],
+                   states: Optional[set[str]] = None) -> tuple["DoctorIndex", dict]:
+        """
+        增量更新，返回 (新索引, 统计)，本索引不动：进行中的查询继续读旧对象，调用方一次赋值换上新对象，
+        读者看不到半批。source 为增量 CSV 路径（见 _read_delta）或 (upsert|delete, 记录) 序列。
+        键为 name + hospital_name；某个键在一批里第一次出现时先删掉它现有的全部行，
+        所以增量文件要列全该键的所有行（如同一医生的多个专科），重复应用同一文件结果不变。
+        基础列不重排：新行追加到列尾并插进增量层，名次与用改后的 CSV 全量重建一致。
+        新索引与本索引共用基础列和分区（不可变）；增量会改的容器在 _fork 里各拷一份，
+        新行追加在共用列的尾部（行号 >= 本索引的 _n，本索引看不到）。
+        同一个索引只能派生一次（热加载线程串行应用，旧索引随后被换下）。
+        states（分片用）：只收这些州（_norm 后）的新行，其它州的 upsert 只删旧行；
+        此时 stats["found"] 列出命中了行的 delete 序号，供汇总各分片的 missing；
+        stats["hospital_changes"] 为 (删掉的行, 新增的行)，供协调进程更新医院聚合表。
+        """
+        t0 = time.perf_counter()
+        ops = _read_delta(source) if isinstance(source, str) else source
+        if len(self._names) != self._n:
+            raise RuntimeError("index already has a newer delta applied; apply to the latest index")
+        new = self._fork()
+        try:
+            stats = new._apply(ops, states)
+        except BaseException:
+            # 共用列上追加了一半的行截掉，本索引保持原样
+            self._truncate_columns()
+            raise
+        stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        log.info("Doctor delta %d applied: %s", new._delta_seq, {k: v for k, v in stats.items()
+                                                                 if k not in ("found", "hospital_changes")})
+        return new, stats
+
+    def _fork(self) -> "DoctorIndex":
+        """增量用的副本：不可变的基础列 / 分区共用，增量会改的容器（分类字典、城市键、专科分区表、增量层）各拷一份"""
+        new = copy.copy(self)
+        for attr in ("cities", "states", "specs", "hospitals"):
+            setattr(new, attr, getattr(self, attr).copy())
+        new._by_city, new._city_keys, new._spec_rows = dict(self._by_city), dict(self._city_keys), list(self._spec_rows)
+        new._dead, new._extra_rank = set(self._dead), dict(self._extra_rank)
+        new._ov = {key: list(p) for key, p in self._ov.items()}
+        new._ov_slots = {p: list(slot) for p, slot in self._ov_slots.items()}
+        new._thaw()
+        return new
+
+    def _truncate_columns(self) -> None:
+        for attr in ("_score", "_spec", "_hosp", "_city", "_state"):
+            col = getattr(self, attr)
+            if isinstance(col, array):
+                del col[self._n:]
+        self._names.truncate(self._n)
+
+    def _apply(self, ops: Iterable[tuple[str, DoctorRecord]], states: Optional[set[str]]) -> dict:
+        """在 _fork 出的副本上逐条应用（此时还没有读者）"""
+        n_specs, n_places = len(self.specs.norms), len(self._by_city)
+        stats, touched, found = {"upserted": 0, "deleted": 0, "missing": 0}, set(), []
+        removed, added = [], []
+        for n, (kind, r) in enumerate(ops):
+            key = (r.name_n, r.hospital_n)
+            if kind == "delete" or key not in touched:
+                hits = self._find(r.name_n, r.hospital_n, self._dead, self._ov)
+                self._dead.update(hits)
+                removed += hits
+                if kind == "delete":
+                    stats["deleted"] += len(hits)
+                    stats["missing"] += not hits
+                    if hits:
+                        found.append(n)
+            touched.add(key)
+            if kind == "upsert" and (states is None or r.state_n in states):
+                added.append(self._n)
+                self._add(r, self._extra_rank, self._ov)
+                stats["upserted"] += 1
+        if states is not None:
+            stats["found"] = found
+
+        if len(self.specs.norms) != n_specs:
+            self._build_spec_grams()
+        self._hospitals_resolved, self._creds = {}, None
+        changes = (self._hospital_rows(removed), self._hospital_rows(added))
+        if self.hospital_stats is not None:
+            self.hospital_stats = self.hospital_stats.updated(*changes)
+        self._delta_seq += 1
+        self._patch_view(changes, len(self.specs.norms) != n_specs)
+        if self.geo is not None and len(self._by_city) != n_places:
+            self.geo.index_places(self._place_keys())
+        if states is not None:
+            stats["hospital_changes"] = changes
+        return stats
+
+    def _thaw(self) -> None:
+        """mmap 快照上的列是只读 memoryview，第一次追加前拷成 array（O(N)，只做一次）"""
+        for attr in ("_score", "_spec", "_hosp", "_city", "_state"):
+            col = getattr(self, attr)
+            if isinstance(col, memoryview):
+                setattr(self, attr, array(col.format, col.tobytes()))
+
+    def _find(self, name_n: str, hospital_n: str, dead: set[int], ov: dict[tuple, list[int]]) -> list[int]:
+        """该医生在该医院现有的行：医院分区 + 本批（ov 为正在改的增量层副本）里的新行"""
+        h = self.hospitals.norm_id(hospital_n)
+        if h is None:
+            return []
+        rows = itertools.chain(self._by_hosp.get(h, ()), ov.get(("hosp", h), ()))
+        return [i for i in rows if i not in dead and _norm(self._names[i]) == name_n]
+
+    def _add(self, r: DoctorRecord, extra_rank: dict[int, float], ov: dict[tuple, list[int]]) -> None:
+        """
+        追加一行：名次取它在基础行之间的插入位置 p，落在同一位置的新行
+        按排序键均分 (p-1, p) 区间；再按名次插进它所属的各个增量分区
+        """
+        i = self._n
+        self._names.append(r.name)
+        self._score.append(r.average_score)
+        self._spec.append(self.specs.code(r.speciality))
+        self._hosp.append(self.hospitals.code(r.hospital_name))
+        self._city.append(self.cities.code(r.city))
+        self._state.append(self.states.code(r.state))
+        self._n += 1
+        c, st = self.cities.norm_of[self._city[i]], self.states.norm_of[self._state[i]]
+        sp, h = self.specs.norm_of[self._spec[i]], self.hospitals.norm_of[self._hosp[i]]
+        while len(self._spec_rows) <= sp:
+            self._spec_rows.append(array("I"))
+        if (c, st) not in self._by_city:
+            self._by_city[(c, st)] = array("I")
+            # 换新列表而不是原地 append：_fork 只浅拷了 _city_keys，列表与旧索引共用
+            self._city_keys[c] = self._city_keys.get(c, []) + [(c, st)]
+
+        key = self._sort_key(i)
+        p = bisect.bisect_left(range(self._base), key, key=self._sort_key)
+        slot = self._ov_slots.setdefault(p, [])
+        bisect.insort(slot, (key, i))
+        for j, (_, row) in enumerate(slot):
+            extra_rank[row] = p - 1 + (j + 1) / (len(slot) + 1)
+        for part in (("all",), ("spec", sp), ("state", st), ("city", c, st),
+                     ("state_spec", st, sp), ("city_spec", c, st, sp), ("hosp", h)):
+            bisect.insort(ov.setdefault(part, []), i, key=extra_rank.__getitem__)
+
+    def _ranked(self, specialities: List[str], city: Optional[str], state: Optional[str], k: int,
+                plan: Optional[dict] = None):
+        codes = self._spec_codes({_norm(s) for s in (specialities or [])})
+        city_l, state_l = _norm(city), _norm(state)
+        tier, keys, st, exact = self._cascade(city_l, state_l, codes)
+        if tier != "city_state" and self.geo is not None:
+            def ids(key):
+                return self.cities.norm_id(key[0]), self.states.norm_id(key[1])
+
+            def count(key):
+                return self._count(self._city_parts([ids(key)], codes)) if ids(key) in self._by_city else 0
+
+            near = self._nearby(city_l, state_l, k, count)
+            if near:
+                dist = {ids(key): d for d, key in near}
+                city_n, state_n = self.cities.norm_of, self.states.norm_of
+                keys = list(dist)
+                parts, keep = self._plan(self._city_parts(keys, codes), keys, None, codes, k, plan=plan)
+                rows = self._top(parts, k, keep, plan)
+                if plan is not None:
+                    plan["actual_rows"] = self._matching(parts, keep)
+                return "nearby", [
+                    (self._rank(i), {**self._public(i),
+                         "distance_miles": round(dist[(city_n[self._city[i]], state_n[self._state[i]])], 1)})
+                    for i in rows
+                ]
+        parts, keep = self._plan(exact, keys, st, codes, k, plan=plan)
+        rows = self._top(parts, k, keep, plan)
+        if plan is not None:
+            plan["actual_rows"] = self._matching(parts, keep)
+        return tier, [(self._rank(i), self._public(i)) for i in rows]
+
+if __name__ == "__main__":
+    # 编译步骤：python doctor_index.py [CSV] [-o SNAPSHOT]
+    import argparse
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ap = argparse.ArgumentParser(description="Compile the doctor CSV into a binary snapshot.")
+    ap.add_argument("csv", nargs="?", default=os.getenv("DOCTOR_DB_CSV", "medical_information.csv"))
+    ap.add_argument("-o", "--out", help="snapshot path (default: $DOCTOR_DB_SNAPSHOT or <csv>.snap)")
+    args = ap.parse_args()
+    DoctorIndex.from_csv(args.csv).write_snapshot(args.out or _snapshot_path(args.csv))
@@ -0,0 +1,503 @@
+# doctor_shards.py — state-sharded, multi-process doctor index for national-scale CSVs (DOCTOR_DB_BACKEND=sharded)
+import os, csv, copy, json, time, heapq, logging, threading, collections, multiprocessing
+from typing import Iterable, List, Optional, Union
+
+from doctor_index import (DoctorIndex, DoctorRecord, _DoctorQueries, _SpecialityResolver,
+                          _norm, _read_delta, _read_rows, _snapshot_path)
+
+log = logging.getLogger(__name__)
+
+# 分片数（= 工作进程数），默认每个 CPU 核一个
+SHARDS = int(os.getenv("DOCTOR_DB_SHARDS", "0") or 0) or os.cpu_count() or 1
+
+def _shard_path(csv_path: str, i: int, n: int) -> str:
+    return f"{_snapshot_path(csv_path)}.shard{i}of{n}"
+
+def _plan_path(csv_path: str) -> str:
+    return _snapshot_path(csv_path) + ".shards.json"
+
+def plan_shards(csv_path: str, n: int) -> list[list[str]]:
+    """
+    按州切分：先数每个州的行数，再按行数从大到小依次放进当前最轻的分片（LPT），
+    同一个州只落在一个分片里。结果缓存在 <snapshot>.shards.json，CSV 变了才重算。
+    """
+    path = _plan_path(csv_path)
+    mtime = os.path.getmtime(csv_path) if os.path.exists(csv_path) else 0.0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+        if plan.get("source_mtime") == mtime and plan.get("shards") == n:
+            return plan["states"]
+    except (OSError, ValueError):
+        pass
+
+    counts: collections.Counter = collections.Counter()
+    if os.path.exists(csv_path):
+        with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+            for r in csv.DictReader(f):
+                counts[_norm(r.get("state"))] += 1
+    heap = [(0, i) for i in range(n)]
+    states: list[list[str]] = [[] for _ in range(n)]
+    for st, c in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])):
+        load, i = heapq.heappop(heap)
+        states[i].append(st)
+        heapq.heappush(heap, (load + c, i))
+    states = [sorted(s) for s in states if s] or [[]]
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"source_mtime": mtime, "shards": n, "states": states, "rows": dict(counts)}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        log.warning("Could not write shard plan %s: %s", path, e)
+    return states
+
+# -------- shard (worker side) --------
+class _ShardIndex(DoctorIndex):
+    """
+    一个分片 = 只含若干个州的 DoctorIndex，快照 mmap 进来，列由页缓存承担。
+    专科由协调进程统一解析后以归一化名传进来，这里只做精确匹配，
+    保证各分片用的是同一套（全局词表上的）解析结果。
+    """
+
+    def _resolve(self, w: str) -> frozenset[int]:
+        nid = self.specs.norm_id(w)
+        return frozenset() if nid is None else frozenset((nid,))
+
+    @classmethod
+    def load_shard(cls, csv_path: str, states: set[str], snap: str) -> "_ShardIndex":
+        """分片快照与 CSV 同源就直接 mmap，否则只解析本分片的州并写快照"""
+        if os.path.exists(snap):
+            try:
+                index = cls.from_snapshot(snap)
+                if not os.path.exists(csv_path) or index.source_mtime == os.path.getmtime(csv_path):
+                    return index
+            except (OSError, ValueError) as e:
+                log.warning("Shard snapshot %s unusable (%s), rebuilding", snap, e)
+        t0 = time.perf_counter()
+        index = cls((r for r in _read_rows(csv_path) if r.state_n in states), source=csv_path)
+        index.load_ms = (time.perf_counter() - t0) * 1000
+        if len(index):
+            index.write_snapshot(snap)
+        return index
+
+    def _tier_parts(self, tier: str, codes, city_l: str, state_l: str, k: int, plan: Optional[dict] = None):
+        """某一层的 (驱动分区, 残余条件)，由 _plan 在本分片的基数上选"""
+        c = self.cities.norm_id(city_l) if city_l else None
+        st = self.states.norm_id(state_l) if state_l else None
+        if tier == "city_state":
+            keys = [(c, st)] if (c, st) in self._by_city else []
+        elif tier == "city":
+            keys = list(self._city_keys.get(c, ())) if c is not None else []
+        elif tier == "state":
+            if st is None:
+                return [], None
+            return self._plan(self._state_parts(st, codes), None, st, codes, k, plan=plan)
+        else:
+            return self._plan(self._spec_parts(codes), None, None, codes, k, plan=plan)
+        return self._plan(self._city_parts(keys, codes), keys, None, codes, k, plan=plan)
+
+    def _rows(self, parts: list, k: int, keep=None) -> list[tuple]:
+        return [(self._sort_key(i), self._rank(i), self._public(i)) for i in self._top(parts, k, keep)]
+
+    def _place_parts(self, places, codes) -> list:
+        ids = [(self.cities.norm_id(c), self.states.norm_id(st)) for c, st in places]
+        return self._city_parts([key for key in ids if key in self._by_city], codes)
+
+    # 以下 shard_* 方法由协调进程经管道调用；specs 为归一化专科名列表，None 表示不限专科
+    def shard_summary(self) -> dict:
+        return {"rows": len(self), "specs": list(self.specs.norms), "places": sorted(self._place_keys()),
+                "load_ms": round(self.load_ms, 1), "pid": os.getpid(), **self.footprint()}
+
+    def shard_top(self, tier: str, specs: Optional[list], city_l: str, state_l: str, k: int) -> list[tuple]:
+        """某一个放宽层级（不再往下放宽）的前 k 行：[(排序键, 名次, 行), ...]"""
+        codes = None if specs is None else self._spec_codes(set(specs))
+        parts, keep = self._tier_parts(tier, codes, city_l, state_l, k)
+        return self._rows(parts, k, keep)
+
+    def shard_explain(self, tier: str, specs: Optional[list], city_l: str, state_l: str, k: int) -> dict:
+        """shard_top 在本分片上的执行计划（_plan 的选择、估计 / 实际行数）"""
+        codes = None if specs is None else self._spec_codes(set(specs))
+        plan: dict = {}
+        parts, keep = self._tier_parts(tier, codes, city_l, state_l, k, plan)
+        self._top(parts, k, keep, plan)
+        plan["actual_rows"] = self._matching(parts, keep)
+        return plan
+
+    def shard_counts(self, places: list, specs: Optional[list]) -> list[int]:
+        codes = None if specs is None else self._spec_codes(set(specs))
+        return [self._count(self._place_parts([p], codes)) for p in places]
+
+    def shard_near(self, places: list, specs: Optional[list], k: int) -> list[tuple]:
+        codes = None if specs is None else self._spec_codes(set(specs))
+        return self._rows(self._place_parts(places, codes), k)
+
+    def shard_page(self, specs: list, city_l: str, state_l: str, flt: dict, after: Optional[dict], k: int,
+                   explain: bool = False):
+        """(行, total, 本分片版本)；explain 时另带本分片的执行计划。after 的格式同 DoctorIndex._page"""
+        plan = {} if explain else None
+        rows, total = self._page(specs, city_l, state_l, flt, after, k, 0, after is None, plan)
+        return (rows, total, self.version) if plan is None else (rows, total, self.version, plan)
+
+    def shard_delta(self, ops: list, states: list) -> dict:
+        return self.apply_delta(ops, set(states))
+
+    def shard_hospital_groups(self) -> list[tuple]:
+        return self._hospital_groups()
+
+def _shard_main(conn, csv_path: str, states: list, snap: str) -> None:
+    """工作进程：加载分片后循环处理 (方法名, 参数)，回 ("ok", 结果) 或 ("err", 描述)"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        index = _ShardIndex.load_shard(csv_path, set(states), snap)
+        conn.send(("ok", index.shard_summary()))
+    except Exception as e:
+        conn.send(("err", f"{type(e).__name__}: {e}"))
+        return
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        method, args = msg
+        try:
+            conn.send(("ok", getattr(index, "shard_" + method)(*args)))
+        except Exception as e:
+            log.exception("Shard call %s failed", method)
+            conn.send(("err", f"{type(e).__name__}: {e}"))
+
+# -------- coordinator --------
+class ShardedDoctorIndex(_DoctorQueries):
+    """
+    与 DoctorIndex 接口一致，数据按州切到 N 个工作进程里（每个进程 mmap 自己的分片快照）。
+    专科在这里用全局词表解析一次；每个放宽层级只发给涉及的分片
+    （city_state / state 一个分片，city 为含该城市的分片，全国为全部分片），
+    各分片并行取前 k 行，这里按排序键归并。名次为 (排序键, 分片, 分片内名次)。
+    """
+
+    def __init__(self, csv_path: str, shards: int = SHARDS):
+        t0 = time.perf_counter()
+        self.source = csv_path
+        self.source_mtime = os.path.getmtime(csv_path) if os.path.exists(csv_path) else 0.0
+        self.loaded_at = time.time()
+        self._delta_seq = 0
+        plan = plan_shards(csv_path, max(1, int(shards)))
+        ctx = multiprocessing.get_context("spawn")
+        self._conns, self._procs = [], []
+        for i, states in enumerate(plan):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_shard_main, name=f"doctor-shard-{i}", daemon=True,
+                               args=(child, csv_path, states, _shard_path(csv_path, i, len(plan))))
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        self._locks = [threading.Lock() for _ in plan]
+        # 进行中的调用数与是否已要求关闭；with_delta 的副本共用同一组工作进程，也共用这份计数
+        self._users, self._users_lock = {"calls": 0, "closing": False}, threading.Lock()
+        self._states = [set(s) for s in plan]
+        summaries = self._recv_all(range(len(plan)))
+        self._refresh(summaries)
+        self.load_ms = (time.perf_counter() - t0) * 1000
+
+    @classmethod
+    def load(cls, csv_path: str) -> "ShardedDoctorIndex":
+        index = cls(csv_path)
+        log.info("Doctor shards ready: %d rows in %d processes (%.1f ms)", len(index), len(index._procs), index.load_ms)
+        return index
+
+    def _recv_all(self, shards: Iterable[int]) -> list:
+        out = [self._conns[i].recv() for i in shards]
+        for kind, val in out:
+            if kind != "ok":
+                raise RuntimeError(f"doctor shard failed: {val}")
+        return [val for _, val in out]
+
+    def _fan(self, shards: list[int], call) -> list:
+        """
+        fan-out：call(i) -> (方法名, *参数)，先全部发出再逐个收，各分片并行执行。
+        每个分片一把锁，按编号顺序加锁，多个线程同时 fan-out 也不会交叉收错或死锁。
+        """
+        shards = sorted(set(shards))
+        for i in shards:
+            self._locks[i].acquire()
+        try:
+            for i in shards:
+                method, *args = call(i)
+                self._conns[i].send((method, tuple(args)))
+            return self._recv_all(shards)
+        finally:
+            for i in shards:
+                self._locks[i].release()
+
+    def _call(self, shards: Iterable[int], method: str, *args) -> list:
+        """把同一个调用发给若干分片，结果按分片编号顺序返回"""
+        return self._fan(list(shards), lambda i: (method, *args))
+
+    def _refresh(self, summaries: list[dict]) -> None:
+        """汇总各分片的行数、专科词表和 (city, state)，重建全局解析器与路由表"""
+        self._summaries = summaries
+        self._rows = sum(s["rows"] for s in summaries)
+        self._state_shard: dict[str, int] = {st: i for i, states in enumerate(self._states) for st in states}
+        self._city_shards: dict[str, set[int]] = {}
+        self._places: dict[tuple[str, str], int] = {}
+        for i, s in enumerate(summaries):
+            for c, st in s["places"]:
+                self._places[(c, st)] = i
+                self._city_shards.setdefault(c, set()).add(i)
+        norms = sorted({n for s in summaries for n in s["specs"]})
+        if norms != getattr(self, "_spec_norms", None):
+            self._spec_norms = norms
+            self._spec_resolver = _SpecialityResolver(norms)
+
+    def acquire(self) -> None:
+        """
+        登记一个进行中的调用（服务端在取索引引用的同一把锁下登记），结束时 release。
+        一次查询可能按放宽层级 fan-out 好几轮，登记覆盖整个调用，close() 不会落在两轮之间
+        """
+        with self._users_lock:
+            if self._users["closing"]:
+                raise RuntimeError("doctor shards are closed")
+            self._users["calls"] += 1
+
+    def release(self) -> None:
+        with self._users_lock:
+            self._users["calls"] -= 1
+            last = self._users["closing"] and not self._users["calls"]
+        if last:
+            # 最后一个调用已经拿到结果，停进程（最多等 5 秒）放到后台，不拖慢这次调用
+            threading.Thread(target=self._shutdown, name="doctor-shards-close", daemon=True).start()
+
+    def close(self) -> None:
+        """停掉工作进程；还有登记过的调用时推迟到最后一个 release 之后"""
+        with self._users_lock:
+            if self._users["closing"]:
+                return
+            self._users["closing"] = True
+            busy = self._users["calls"]
+        if not busy:
+            self._shutdown()
+
+    def _shutdown(self) -> None:
+        # 每个分片先拿锁：没登记的直接调用（脚本、预建）正在 fan-out 时也等它收完
+        for i, conn in enumerate(self._conns):
+            with self._locks[i]:
+                try:
+                    conn.send(None)
+                except (OSError, ValueError):
+                    pass
+                conn.close()
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+
+    def __len__(self) -> int:
+        return self._rows
+
+    @property
+    def version(self) -> str:
+        base = f"{self.source_mtime:.3f}:{self._rows}"
+        return f"{base}+{self._delta_seq}" if self._delta_seq else base
+
+    def _is_state(self, state_l: str) -> bool:
+        return state_l in self._state_shard
+
+    def _place_keys(self) -> set[tuple[str, str]]:
+        return set(self._places)
+
+    def _hospital_groups(self) -> Iterable[tuple]:
+        """各分片并行聚合自己的行；州不跨分片，同一家医院院区只会出现在一个分片里"""
+        return [g for out in self._call(range(len(self._conns)), "hospital_groups") for g in out]
+
+    def _spec_norms_for(self, specialities) -> Optional[list]:
+        """department 列表 -> 全局专科名列表；不限专科为 None，一个都没解析到为 []"""
+        want = {_norm(s) for s in (specialities or [])}
+        if not want:
+            return None
+        codes: set[int] = set()
+        for w in want:
+            codes |= self._spec_resolver.resolve(w)
+        return sorted(self._spec_norms[c] for c in codes)
+
+    def _targets(self, tier: str, city_l: str, state_l: str) -> list[int]:
+        if tier == "city_state":
+            i = self._places.get((city_l, state_l))
+            return [] if i is None else [i]
+        if tier == "city":
+            return sorted(self._city_shards.get(city_l, ()))
+        if tier == "state":
+            i = self._state_shard.get(state_l)
+            return [] if i is None else [i]
+        return list(range(len(self._conns)))
+
+    @staticmethod
+    def _merge(results: list[tuple[int, list]], k: int) -> list[tuple]:
+        """各分片已按排序键有序，归并取前 k；名次 = (排序键..., 分片, 分片内名次)"""
+        tagged = [[((*key, i, rank), row) for key, rank, row in rows] for i, rows in results]
+        return list(heapq.merge(*tagged, key=lambda t: t[0]))[:k]
+
+    def _ranked(self, specialities: List[str], city: Optional[str], state: Optional[str], k: int,
+                plan: Optional[dict] = None):
+        """
+        放宽层级同 DoctorIndex：city+state → nearby → city → state → 全国。
+        每个分片在自己的基数上各自规划；plan 不为 None 时汇总命中层各分片的计划。
+        """
+        specs = self._spec_norms_for(specialities)
+        if specs is not None and not specs:
+            return "nationwide", []
+        city_l, state_l = _norm(city), _norm(state)
+        tiers = []
+        if city_l and state_l:
+            tiers.append("city_state")
+        if self.geo is not None and city_l and state_l:
+            tiers.append("nearby")
+        if city_l:
+            tiers.append("city")
+        if state_l:
+            tiers.append("state")
+        tiers.append("nationwide")
+
+        for tier in tiers:
+            if tier == "nearby":
+                shards = []
+                rows = self._select_nearby(city_l, state_l, specs, k)
+            else:
+                shards = sorted(self._targets(tier, city_l, state_l))
+                rows = self._merge(list(zip(shards, self._call(shards, "top", tier, specs, city_l, state_l, k))), k)
+            if rows:
+                if plan is not None:
+                    plans = self._call(shards, "explain", tier, specs, city_l, state_l, k) if shards else []
+                    self._gather_plans(plan, shards, plans, len(rows))
+                return tier, rows
+        if plan is not None:
+            self._gather_plans(plan, [], [], 0)
+        return "nationwide", []
+
+    @staticmethod
+    def _gather_plans(plan: dict, shards: list[int], plans: list[dict], rows: int) -> None:
+        """协调进程的计划：各分片的计划原样列出，估计 / 实际命中行数求和（nearby 层不逐片规划）"""
+        plan.update(driver="shards", shards=[{"shard": i, **p} for i, p in zip(shards, plans)], rows=rows)
+        if plans:
+            plan["est_rows"] = sum(p.get("est_rows", 0) for p in plans)
+            plan["actual_rows"] = sum(p.get("actual_rows", 0) for p in plans)
+
+    def _select_nearby(self, city_l: str, state_l: str, specs: Optional[list], k: int) -> list[tuple]:
+        def count(key):
+            i = self._places.get(key)
+            return 0 if i is None else self._call([i], "counts", [key], specs)[0][0]
+
+        near = self._nearby(city_l, state_l, k, count)
+        if not near:
+            return []
+        dist = {key: d for d, key in near}
+        by_shard: dict[int, list] = {}
+        for key in dist:
+            by_shard.setdefault(self._places[key], []).append(key)
+        shards = sorted(by_shard)
+        results = self._fan(shards, lambda i: ("near", by_shard[i], specs, k))
+        return [(rank, {**row, "distance_miles": round(dist[(_norm(row["city"]), _norm(row["state"]))], 1)})
+                for rank, row in self._merge(list(zip(shards, results)), k)]
+
+    def _page(self, specs, city_l: str, state_l: str, flt: dict, after: Optional[dict],
+              k: int, offset: int, want_total: bool, plan: Optional[dict] = None):
+        """
+        各分片从 cursor 处各取 offset + k 行，归并后再跳过 offset。归并按 (排序键, 分片号, 分片内名次)，
+        cursor 的名次记为 [分片号, 该分片版本, 分片内名次]：末行所在分片按名次续读（版本变了退回按排序键），
+        编号更小的分片里与末行排序键相同的行已全部发出，从该键之后读；编号更大的从该键（含）读
+        """
+        norms = self._spec_norms_for(specs)
+        if norms is not None and not norms:
+            return [], 0
+        if state_l:
+            shards = [] if state_l not in self._state_shard else [self._state_shard[state_l]]
+        elif city_l:
+            shards = sorted(self._city_shards.get(city_l, ()))
+        else:
+            shards = list(range(len(self._conns)))
+        if not shards:
+            return [], 0
+        def resume(i):
+            if after is None:
+                return None
+            last, v, rank = after["r"]
+            key = list(after["k"])
+            return {"k": key} if i < last else {"k": key, "incl": True} if i > last else {"k": key, "v": v, "r": rank}
+
+        out = self._fan(shards, lambda i: ("page", norms or [], city_l, state_l, flt, resume(i), offset + k,
+                                           plan is not None))
+        tagged = [[((*key, i, rank), (i, o[2], rank), key, row) for rank, key, row in o[0]] for i, o in zip(shards, out)]
+        rows = [t[1:] for t in heapq.merge(*tagged, key=lambda t: t[0])][offset:offset + k]
+        total = sum(o[1] for o in out) if want_total else None
+        if plan is not None:
+            self._gather_plans(plan, shards, [o[3] for o in out], len(rows))
+        return rows, total
+
+    def apply_delta(self, source: Union[str, Iterable[tuple[str, DoctorRecord]]]) -> dict:
+        """原地应用增量（同 DoctorIndex.apply_delta）：只用在尚未发布的索引上，正在服务的索引用 with_delta 换新对象"""
+        new, stats = self.with_delta(source)
+        self.__dict__.update(new.__dict__)
+        return stats
+
+    def with_delta(self, source: Union[str, Iterable[tuple[str, DoctorRecord]]]) -> tuple["ShardedDoctorIndex", dict]:
+        """
+        增量语义同 DoctorIndex.with_delta，返回 (新协调对象, 统计)。整批发给所有分片（医生可能换了州，旧行要在原分片删掉），
+        每个分片只收自己州的新行；没见过的州分给当前行数最少的分片。
+        州的归属、路由表、专科解析器、医院聚合和视图都在副本上换好（与本对象共用工作进程），
+        本对象不动，调用方一次赋值换上；分片里的行由各工作进程逐条处理请求时原地更新。
+        """
+        t0 = time.perf_counter()
+        ops = list(_read_delta(source) if isinstance(source, str) else source)
+        new = copy.copy(self)
+        new._states = [set(s) for s in self._states]
+        new._state_shard = dict(self._state_shard)
+        rows = [s["rows"] for s in self._summaries]
+        for kind, r in ops:
+            if kind == "upsert" and r.state_n not in new._state_shard:
+                i = min(range(len(rows)), key=rows.__getitem__)
+                new._states[i].add(r.state_n)
+                new._state_shard[r.state_n] = i
+        shards = list(range(len(self._conns)))
+        out = self._fan(shards, lambda i: ("delta", ops, sorted(new._states[i])))
+        found = {n for s in out for n in s.pop("found", ())}
+        changes = [s.pop("hospital_changes", ([], [])) for s in out]
+        changes = ([r for c in changes for r in c[0]], [r for c in changes for r in c[1]])
+        if self.hospital_stats is not None:
+            new.hospital_stats = self.hospital_stats.updated(*changes)
+        stats = {"upserted": sum(s["upserted"] for s in out), "deleted": sum(s["deleted"] for s in out),
+                 "missing": sum(1 for kind, _ in ops if kind == "delete") - len(found)}
+        new._refresh(self._call(shards, "summary"))
+        new._delta_seq += 1
+        new._patch_view(changes, len(new._spec_norms) != len(self._spec_norms))
+        if self.geo is not None:
+            self.geo.index_places(new._place_keys())
+        stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        log.info("Doctor delta %d applied to %d shards: %s", new._delta_seq, len(shards), stats)
+        return new, stats
+
+    def status(self) -> dict:
+        return {
+            "backend": "sharded",
+            "source": self.source,
+            "rows": len(self),
+            "load_ms": round(self.load_ms, 1),
+            "loaded_at": self.loaded_at,
+            "spec_cache": self._spec_resolver.resolve.cache_info()._asdict(),
+            "delta_seq": self._delta_seq,
+            "shards": [{"states": len(self._states[i]), "rows": s["rows"], "pid": s["pid"],
+                        "bytes_per_row": s["bytes_per_row"]} for i, s in enumerate(self._summaries)],
+        }
+
+if __name__ == "__main__":
+    # 预建分片快照：python doctor_shards.py [CSV] [-n SHARDS]（各分片在自己的进程里并行解析）
+    import argparse
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ap = argparse.ArgumentParser(description="Pre-build the per-state shard snapshots for DOCTOR_DB_BACKEND=sharded.")
+    ap.add_argument("csv", nargs="?", default=os.getenv("DOCTOR_DB_CSV", "medical_information.csv"))
+    ap.add_argument("-n", "--shards", type=int, default=SHARDS)
+    args = ap.parse_args()
+    index = ShardedDoctorIndex(args.csv, args.shards)
+    log.info("Doctor shards built: %d rows in %d shards (%.1f ms)", len(index), len(index._procs), index.load_ms)
+    index.close()
@@ -0,0 +1,126 @@
+# doctor_view.py — materialized top-N view per (speciality, city, state), built offline next to the doctor CSV
+import os, json, time, logging, threading
+from typing import List, Optional
+
+from doctor_index import DoctorIndex, _norm
+
+log = logging.getLogger(__name__)
+
+# 每个键存前 N 位；limit 不超过 N（或该键的医生不足 N 位）时直接命中
+VIEW_TOP_N = 10
+_FIELDS = ("name", "hospital_name", "speciality", "average_score", "city", "state")
+
+def _view_path(csv_path: str) -> str:
+    return os.getenv("DOCTOR_DB_VIEW") or csv_path + ".topn.json"
+
+class TopNView:
+    """
+    (department, city, state) -> 该组合 city_state 层的前 N 行（与 find_top_doctors 的结果逐行相同）。
+    department 是 CSV 里出现过的专科名（_norm 后），键来自 CSV 里实际出现的组合。
+    只在 version 这个数据版本上生效。应用增量时索引用 patched 换一份新视图：增量改到的地点上的键去掉，
+    其余键换到新版本上继续命中；CSV 重建后版本号变化，等重新预计算。base 为建表时（CSV 本身）的版本。
+    """
+
+    def __init__(self, keys: dict, n: int, version: str, source: str = "", base: Optional[str] = None):
+        self._keys = keys
+        self.n = n
+        self.version = version
+        self.base = base or version
+        self.source = source
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._hits = self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @classmethod
+    def load(cls, csv_path: str) -> Optional["TopNView"]:
+        """CSV 旁边（或 DOCTOR_DB_VIEW 指定）有预计算文件就加载，没有或读不了返回 None"""
+        path = _view_path(csv_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # 行在加载时就还原成 dict，命中时只剩一次字典查找和切片
+            keys = {tuple(k.split("\t")): [(r[0], dict(zip(_FIELDS, r[1:]))) for r in rows]
+                    for k, rows in data["keys"].items()}
+            view = cls(keys, int(data["n"]), data["version"], source=path)
+        except (OSError, KeyError, ValueError) as e:
+            log.warning("Top-N view %s unusable (%s); serving from the live index", path, e)
+            return None
+        log.info("Top-N view loaded: %d keys (top %d) from %s", len(view), view.n, path)
+        return view
+
+    def get(self, specialities: List[str], city: Optional[str], state: Optional[str], k: int,
+            version: str) -> Optional[list[tuple]]:
+        """命中返回 [(名次, 行), ...]（city_state 层），否则 None；同时计数命中率"""
+        rows = None
+        want = {_norm(s) for s in (specialities or [])}
+        if version == self.version and len(want) == 1:
+            rows = self._keys.get((want.pop(), _norm(city), _norm(state)))
+            # 只存了前 N 行：要的比 N 多、而该键恰好存满 N 行时可能还有更多，交给实时索引
+            if rows is not None and k > self.n and len(rows) >= self.n:
+                rows = None
+        with self._lock:
+            if rows is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        if rows is None:
+            return None
+        return rows[:k]
+
+    def patched(self, places: set, version: str) -> "TopNView":
+        """
+        去掉 (city, state) 在 places 里的键、版本换成 version 的新视图；本视图不变，正在用它的查询照常读完。
+        其余键只依赖各自地点上的行，增量没碰到就与实时索引逐行相同（名次也不变）
+        """
+        keys = {key: rows for key, rows in self._keys.items() if key[1:] not in places}
+        view = TopNView(keys, self.n, version, self.source, self.base)
+        view.dropped = self.dropped + len(self._keys) - len(keys)
+        view._hits, view._misses = self._hits, self._misses
+        return view
+
+    def stats(self) -> dict:
+        total = self._hits + self._misses
+        return {"keys": len(self), "top_n": self.n, "version": self.version, "dropped_by_delta": self.dropped,
+                "hits": self._hits, "misses": self._misses, "hit_ratio": round(self._hits / total, 4) if total else None}
+
+def build_view(index: DoctorIndex, out_path: str, n: int = VIEW_TOP_N, max_keys: int = 0) -> int:
+    """
+    对索引里出现过的每个 (专科, city, state) 组合，以专科名作 department 跑一次实时查询，
+    把 city_state 层的前 n 行写进视图；max_keys > 0 时只保留医生最多的那些组合。
+    """
+    specs, cities, states = index.specs.norms, index.cities.norms, index.states.norms
+    combos = sorted(index._by_city_spec.items(), key=lambda kv: -len(kv[1]))
+    if max_keys > 0:
+        combos = combos[:max_keys]
+    keys = {}
+    for (c, st, sp), _ in combos:
+        key = (specs[sp], cities[c], states[st])
+        tier, ranked = index._ranked([key[0]], key[1], key[2], n)
+        if tier == "city_state" and ranked:
+            keys["\t".join(key)] = [[rank, *(row[f] for f in _FIELDS)] for rank, row in ranked]
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": index.version, "n": n, "source": index.source, "built_at": time.time(),
+                   "keys": keys}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, out_path)
+    return len(keys)
+
+if __name__ == "__main__":
+    # 预计算：python doctor_view.py [CSV] [-n 10] [--max-keys K] [-o OUT]
+    import argparse
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ap = argparse.ArgumentParser(description="Precompute the top-N doctors per (speciality, city, state).")
+    ap.add_argument("csv", nargs="?", default=os.getenv("DOCTOR_DB_CSV", "medical_information.csv"))
+    ap.add_argument("-n", type=int, default=VIEW_TOP_N, help="rows kept per key (default 10)")
+    ap.add_argument("--max-keys", type=int, default=0, help="keep only the K most populated keys (default: all)")
+    ap.add_argument("-o", "--out", help="output path (default: $DOCTOR_DB_VIEW or <csv>.topn.json)")
+    args = ap.parse_args()
+    out = args.out or _view_path(args.csv)
+    t0 = time.perf_counter()
+    count = build_view(DoctorIndex.load(args.csv), out, args.n, args.max_keys)
+    log.info("Top-N view written: %s (%d keys, %.1f ms)", out, count, (time.perf_counter() - t0) * 1000)
@@ -1,6 +1,8 @@
 # location_server.py
 
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from mcp.server.fastmcp import FastMCP
 import aiohttp
@@ -20,6 +22,18 @@ logger = logging.getLogger(__name__)
 # 1. Create the MCP server instance
 mcp = FastMCP("Location Assistant")
 
+# 同步的 requests 调用放到有界线程池里，不占用事件循环（并发的工具调用互不阻塞）
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="location")
+IP_LOOKUP_TIMEOUT = 10
+
+def _ip_lookup(client_ip: Optional[str]) -> dict:
+    # client_ip 为空时 ipapi.co 返回请求方自身 IP 的位置
+    url = f"https://ipapi.co/{client_ip}/json/" if client_ip else "https://ipapi.co/json/"
+    return requests.get(url, timeout=IP_LOOKUP_TIMEOUT).json()
+
+async def _geolocate_ip(client_ip: Optional[str]) -> dict:
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, _ip_lookup, client_ip)
+
 # 2. Define tool functions using the @mcp.tool() decorator
 # @mcp.tool()
 # async def get_coordinates(address: str) -> dict:
@@ -60,9 +74,7 @@ async def find_nearby_hospitals(address: Optional[str] = None, client_ip: Option
     # 网站ipapi.co有时会限流，查看日志
     if address is None:
         logger.info("Address not provided. Falling back to IP-based location.")
-        url = f"https://ipapi.co/{client_ip}/json/"
-        ip_response = requests.get(url)
-        ip_data = ip_response.json()
+        ip_data = await _geolocate_ip(client_ip)
         logger.info(ip_data)
         lat = ip_data.get("latitude")
         lon = ip_data.get("longitude")
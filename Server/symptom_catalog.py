@@ -0,0 +1,123 @@
+# symptom_catalog.py — cached Infermedica symptom catalog for diagnosis_server.get_symptoms
+import os, json, time, bisect, logging
+from typing import Optional
+
+from department_cache import _disease_key
+
+log = logging.getLogger(__name__)
+
+# 目录很少变：一天重新验证一次；拉取失败后隔多久再试（期间继续用旧目录）
+SYMPTOM_CATALOG_TTL = float(os.getenv("SYMPTOM_CATALOG_TTL", "86400"))
+SYMPTOM_CATALOG_RETRY = float(os.getenv("SYMPTOM_CATALOG_RETRY", "60"))
+
+class SymptomCatalog:
+    """
+    症状目录 [{"id", "name"}, ...]：内存一份 + JSON 文件一份，新起的 stdio 服务进程读文件即热。
+    过了 ttl 才回源重新验证，带上次的 ETag / Last-Modified 做条件请求，304 只续期、不重传整个目录；
+    回源失败继续用旧目录，retry 秒后再试。
+    按 id 查走字典；按名字前缀查在排好序的 _disease_key(name) 上二分。
+    replace / renew / fail 只改内存，在事件循环里直接调；load / save 读写磁盘，调用方放到线程池里跑。
+    source 为目录来源（API 地址），文件里记的来源不同就不用；path 为空时只有内存一份。
+    """
+
+    def __init__(self, path: str = "", source: str = "", ttl: float = SYMPTOM_CATALOG_TTL,
+                 retry: float = SYMPTOM_CATALOG_RETRY):
+        self.path, self.source, self.ttl, self.retry = path, source, ttl, retry
+        self.items: list[dict] = []
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.fetched_at = 0.0
+        self._retry_at = 0.0
+        self._by_id: dict[str, dict] = {}
+        self._keys: list[str] = []
+        self._sorted: list[dict] = []
+        self._stats = {"hits": 0, "fetches": 0, "not_modified": 0, "errors": 0, "disk_loads": 0, "disk_errors": 0}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def fresh(self) -> bool:
+        """目录可直接用（未过期，或刚失败过、还没到重试时间）；记一次命中"""
+        now = time.time()
+        if self.items and (now - self.fetched_at < self.ttl or now < self._retry_at):
+            self._stats["hits"] += 1
+            return True
+        return False
+
+    def replace(self, items: list[dict], etag: Optional[str] = None, last_modified: Optional[str] = None,
+                fetched_at: Optional[float] = None) -> None:
+        """换上一份新目录并重建索引；整组属性一次换掉，正在读旧列表的调用不受影响"""
+        items = [{"id": s["id"], "name": s["name"]} for s in items]
+        order = sorted(items, key=lambda s: (_disease_key(s["name"]), s["id"]))
+        self.items, self._sorted = items, order
+        self._keys = [_disease_key(s["name"]) for s in order]
+        self._by_id = {s["id"]: s for s in items}
+        self.etag, self.last_modified = etag, last_modified
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self._retry_at = 0.0
+        if fetched_at is None:
+            self._stats["fetches"] += 1
+
+    def renew(self, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """304：目录没变，只续期（服务端给了新的校验值就换上）"""
+        self.etag, self.last_modified = etag or self.etag, last_modified or self.last_modified
+        self.fetched_at, self._retry_at = time.time(), 0.0
+        self._stats["not_modified"] += 1
+
+    def fail(self) -> None:
+        """回源失败：保留旧目录，retry 秒内不再回源"""
+        self._retry_at = time.time() + self.retry
+        self._stats["errors"] += 1
+
+    def get(self, symptom_id: str) -> Optional[dict]:
+        return self._by_id.get((symptom_id or "").strip())
+
+    def prefix(self, prefix: str, limit: int = 20) -> list[dict]:
+        """名字以 prefix 开头的症状（不分大小写、折叠空格），按名字排序取前 limit 个"""
+        p = _disease_key(prefix)
+        keys, out = self._keys, []
+        i = bisect.bisect_left(keys, p)
+        while i < len(keys) and len(out) < limit and keys[i].startswith(p):
+            out.append(self._sorted[i])
+            i += 1
+        return out
+
+    def load(self) -> bool:
+        """读磁盘上的目录（阻塞）；文件不存在、坏了或来源不同都当作没有"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            if doc.get("source") != self.source:
+                return False
+            self.replace(doc["items"], doc.get("etag"), doc.get("last_modified"), float(doc["fetched_at"]))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning("Symptom catalog %s unreadable (%s); ignored", self.path, e)
+            self._stats["disk_errors"] += 1
+            return False
+        self._stats["disk_loads"] += 1
+        log.info("Symptom catalog: %d symptoms from %s", len(self.items), self.path)
+        return True
+
+    def save(self) -> None:
+        """写磁盘（阻塞，先写临时文件再换名）；失败只记日志"""
+        if not self.path or not self.items:
+            return
+        doc = {"source": self.source, "etag": self.etag, "last_modified": self.last_modified,
+               "fetched_at": self.fetched_at, "items": self.items}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(doc, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("Could not write symptom catalog %s: %s", self.path, e)
+            self._stats["disk_errors"] += 1
+
+    def stats(self) -> dict:
+        age = time.time() - self.fetched_at if self.fetched_at else None
+        return {"path": self.path or None, "symptoms": len(self), "ttl_s": self.ttl,
+                "age_s": round(age, 1) if age is not None else None,
+                "validator": "etag" if self.etag else "last_modified" if self.last_modified else None,
+                **self._stats}
@@ -0,0 +1,214 @@
+# bench_doctors.py — find_top_doctors 基准：加载耗时、单次查询 p50/p99、峰值 RSS
+# 用法：python benchmarks/bench_doctors.py --sizes 30k,1m,10m --backends memory,sqlite -o bench.json
+# 每个 (规模, 后端) 在独立子进程里跑，峰值 RSS 互不影响；结果为 JSON，可直接 diff
+import os, sys, csv, glob, json, time, random, platform, argparse, resource, subprocess, threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, "..", "Medical Recommendation System")
+sys.path.insert(0, APP)
+sys.path.insert(0, HERE)
+
+from gen_doctors import generate, parse_size
+
+def _pct(sorted_ms: list, p: float) -> float:
+    return round(sorted_ms[min(len(sorted_ms) - 1, int(p / 100 * len(sorted_ms)))], 4)
+
+def _sample_rows(path: str, k: int, seed: int) -> list:
+    """蓄水池抽样 k 行，用来拼出真实存在的 (专科, 城市, 州) 组合"""
+    rnd, out = random.Random(seed), []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for n, r in enumerate(csv.DictReader(f)):
+            if n < k:
+                out.append(r)
+            elif (j := rnd.randrange(n + 1)) < k:
+                out[j] = r
+    return out
+
+def query_mixes(path: str, n: int, seed: int = 7) -> dict:
+    """
+    typical：按某行的专科 + 该行的 city/state，基本命中 city_state 层；
+    fallback：专科与地点错配、城市不存在、只有州或地点全空，迫使放宽到 city / state / 全国
+    """
+    rows = _sample_rows(path, max(n, 100), seed)
+    rnd = random.Random(seed)
+    typical, fallback = [], []
+    for _ in range(n):
+        a, b = rnd.choice(rows), rnd.choice(rows)
+        typical.append(([a["speciality"]], a["city"], a["state"]))
+        fallback.append(rnd.choice([
+            ([a["speciality"]], b["city"], b["state"]),
+            ([a["speciality"], b["speciality"]], "Nowhereville", a["state"]),
+            ([a["speciality"]], a["city"], "ZZ"),
+            ([a["speciality"]], None, b["state"]),
+            ([a["speciality"]], None, None),
+        ]))
+    return {"typical": typical, "fallback": fallback}
+
+def page_queries(path: str, n: int, seed: int = 7) -> list:
+    """find_doctors 带过滤的分页：按州 / 全国 + 医院名子串或学位，规划器在这里才有得选"""
+    rows = _sample_rows(path, max(n, 100), seed + 1)
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        a = rnd.choice(rows)
+        hosp = a["hospital_name"].split()[0] if a["hospital_name"].strip() else None
+        out.append(rnd.choice([
+            (a["speciality"], a["state"], {"hospital": hosp}),
+            (a["speciality"], None, {"hospital": a["hospital_name"]}),
+            (a["speciality"], a["state"], {"credential": "DO"}),
+            (a["speciality"], f"{a['city']}, {a['state']}", {"min_score": 4.0}),
+        ]))
+    return out
+
+def _run_pages(index, queries: list) -> dict:
+    """分页延迟，外加规划器选中各驱动分区的次数（另跑一遍 explain 统计，不计入延迟）"""
+    lat, drivers = [], {}
+    for specialty, location, flt in queries:
+        t0 = time.perf_counter()
+        index.page(specialty, location, 20, **flt)
+        lat.append((time.perf_counter() - t0) * 1000)
+        driver = index.page(specialty, location, 20, explain=True, **flt)["plan"].get("driver", "none")
+        drivers[driver] = drivers.get(driver, 0) + 1
+    lat.sort()
+    return {"queries": len(lat), "mean_ms": round(sum(lat) / len(lat), 4),
+            "p50_ms": _pct(lat, 50), "p99_ms": _pct(lat, 99), "drivers": drivers}
+
+def _run_mix(index, queries: list, limit: int) -> dict:
+    lat, tiers = [], {}
+    for specs, city, state in queries:
+        t0 = time.perf_counter()
+        out = index.query(specs, city, state, limit)
+        lat.append((time.perf_counter() - t0) * 1000)
+        tier = out[0]["match_tier"] if out else "empty"
+        tiers[tier] = tiers.get(tier, 0) + 1
+    lat.sort()
+    return {"queries": len(lat), "mean_ms": round(sum(lat) / len(lat), 4),
+            "p50_ms": _pct(lat, 50), "p99_ms": _pct(lat, 99), "max_ms": round(lat[-1], 4), "tiers": tiers}
+
+def _throughput(index, queries: list, limit: int, threads: int) -> dict:
+    """threads 个线程同时跑 queries（各取一份），看总吞吐；sharded 后端的分片进程可以并行吃满多核"""
+    chunks = [queries[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=lambda qs: [index.query(*q, limit) for q in qs], args=(c,)) for c in chunks]
+    t0 = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - t0
+    return {"threads": threads, "queries": len(queries), "qps": round(len(queries) / wall, 1)}
+
+def _rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位是 KB，macOS 上是字节
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def worker(path: str, backend: str, n: int, limit: int, threads: int, shards: int) -> dict:
+    """子进程：冷加载（解析 CSV / 建库）、热加载（快照 / 已有库），再跑两组查询和多线程吞吐"""
+    from doctor_index import DoctorIndex, _snapshot_path
+    from doctor_sqlite import SqliteDoctorIndex, _sqlite_path
+    from doctor_shards import ShardedDoctorIndex, _plan_path
+
+    mixes = query_mixes(path, n)
+    res = {"backend": backend}
+    if backend == "sharded":
+        for old in glob.glob(glob.escape(_snapshot_path(path)) + ".shard*") + [_plan_path(path)]:
+            if os.path.exists(old):
+                os.remove(old)
+        t0 = time.perf_counter()
+        ShardedDoctorIndex(path, shards).close()
+        res["cold_load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        t0 = time.perf_counter()
+        index = ShardedDoctorIndex(path, shards)
+        res["warm_load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        res["shards"] = len(index.status()["shards"])
+    elif backend == "sqlite":
+        db = _sqlite_path(path)
+        if os.path.exists(db):
+            os.remove(db)
+        t0 = time.perf_counter()
+        SqliteDoctorIndex.load(path)
+        res["cold_load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        t0 = time.perf_counter()
+        index = SqliteDoctorIndex.load(path)
+        res["warm_load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    else:
+        t0 = time.perf_counter()
+        index = DoctorIndex.from_csv(path)
+        res["cold_load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        snap = _snapshot_path(path)
+        index.write_snapshot(snap)
+        del index
+        t0 = time.perf_counter()
+        index = DoctorIndex.from_snapshot(snap)
+        res["warm_load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        res["bytes_per_row"] = index.footprint()["bytes_per_row"]
+    res["rows"] = len(index)
+    # 先各跑一遍预热（专科解析缓存、页缓存），再计时
+    for qs in mixes.values():
+        _run_mix(index, qs[:50], limit)
+    res["mixes"] = {name: _run_mix(index, qs, limit) for name, qs in mixes.items()}
+    res["pages"] = _run_pages(index, page_queries(path, max(1, n // 5)))
+    # 吞吐看全国放宽为主的 fallback 组（每条都要扫所有分片）
+    res["throughput"] = _throughput(index, mixes["fallback"], limit, threads)
+    # 峰值 RSS 只算本进程；sharded 后端的分片数据在工作进程里（mmap，页缓存共享）
+    res["peak_rss_mb"] = _rss_mb()
+    if hasattr(index, "close"):
+        index.close()
+    return res
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark find_top_doctors on synthetic doctor CSVs.")
+    ap.add_argument("--sizes", default="30k,1m,10m", help="comma-separated row counts (default: 30k,1m,10m)")
+    ap.add_argument("--backends", default="memory,sqlite", help="memory, sqlite and/or sharded")
+    ap.add_argument("--queries", type=int, default=2000, help="queries per mix")
+    ap.add_argument("--limit", type=int, default=5)
+    ap.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="threads for the throughput run")
+    ap.add_argument("--shards", type=int, default=os.cpu_count() or 1, help="worker processes for the sharded backend")
+    ap.add_argument("--data-dir", default=os.path.join(HERE, "data"))
+    ap.add_argument("-o", "--out", help="write JSON here as well as stdout")
+    ap.add_argument("--worker", nargs=2, metavar=("CSV", "BACKEND"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker[0], args.worker[1], args.queries, args.limit, args.threads, args.shards)))
+        return 0
+
+    report = {
+        "meta": {"git": _git_rev(), "python": platform.python_version(), "platform": platform.platform(),
+                 "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "queries_per_mix": args.queries, "limit": args.limit,
+                 "cpus": os.cpu_count(), "threads": args.threads, "shards": args.shards},
+        "runs": [],
+    }
+    for size in [s for s in args.sizes.split(",") if s]:
+        path = os.path.join(args.data_dir, f"doctors_{size.lower()}.csv")
+        if not os.path.exists(path):
+            print(f"generating {path}", file=sys.stderr)
+            generate(parse_size(size), path)
+        for backend in [b for b in args.backends.split(",") if b]:
+            print(f"running {size} / {backend}", file=sys.stderr)
+            proc = subprocess.run(
+                [sys.executable, __file__, "--worker", path, backend, "--queries", str(args.queries),
+                 "--limit", str(args.limit), "--threads", str(args.threads), "--shards", str(args.shards)],
+                capture_output=True, text=True)
+            if proc.returncode:
+                print(proc.stderr, file=sys.stderr)
+                report["runs"].append({"size": size, "backend": backend, "error": proc.stderr.strip()[-500:]})
+                continue
+            report["runs"].append({"size": size, **json.loads(proc.stdout.splitlines()[-1])})
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 1 if any("error" in r for r in report["runs"]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
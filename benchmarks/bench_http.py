@@ -0,0 +1,176 @@
+# bench_http.py — diagnosis_server 的 HTTP 调用：每次新建会话 vs 进程内共用的连接池会话
+# 用法：python benchmarks/bench_http.py [--calls 200] [--concurrency 8] [--delay-ms 0] [--llm-delay-ms 300]
+#       [--rounds 10] [--cert C --key K] [-o out.json]
+# 本机起一个替身 HTTP 服务（Infermedica 的 /parse、/diagnosis 与 OpenAI 的 /chat/completions 返回固定 JSON），
+# 分别用旧写法（每次调用 async with aiohttp.ClientSession()）和 diagnosis_server._request / get_department_by_evidence
+# 打同样的请求，报告单次延迟 p50/p99 与服务端看到的新建连接数。给了 --cert/--key 时走 TLS，握手开销也算进来。
+# 本机回环没有网络往返，真实环境（跨公网、TLS）下每次握手省下的是一到数个 RTT，差距只会更大。
+# 另有一节 departments：替身的 /chat/completions 按 --llm-delay-ms 模拟模型耗时，比较 Top-3 疾病
+# 逐个 get_department_by_evidence（冷缓存）、一次 get_departments_for_conditions（冷缓存）与重复一次（缓存命中）
+import os, sys, json, time, ssl, socket, asyncio, argparse
+
+from aiohttp import ClientSession, web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, "..", "Medical Recommendation System")
+sys.path.insert(0, APP)
+
+_PARSE = {"mentions": [{"id": "s_21", "name": "Headache", "choice_id": "present"}]}
+_DIAGNOSIS = {"conditions": [{"id": "c_49", "name": "Migraine", "probability": 0.61}]}
+_CHAT = {"choices": [{"message": {"role": "assistant", "content": "Neurology"}}]}
+
+def _app(delay: float, conns: set, llm: dict) -> web.Application:
+    """
+    替身服务；conns 收下见过的连接（传输对象本身，留着引用以免 id 被复用），即服务端建立的连接数。
+    llm["delay"] 为 /chat/completions 额外的耗时；请求要 JSON 输出（批量映射）时按请求里的疾病列表作答
+    """
+    async def reply(request: web.Request, body: dict) -> web.Response:
+        conns.add(request.transport)
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(body)
+
+    async def chat(request: web.Request) -> web.Response:
+        req = await request.json()
+        if llm["delay"]:
+            await asyncio.sleep(llm["delay"])
+        if "response_format" not in req:
+            return await reply(request, _CHAT)
+        names = json.loads(req["messages"][-1]["content"].split("? ", 1)[1])
+        content = json.dumps({"departments": {n: "Neurology" for n in names}})
+        return await reply(request, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+    app = web.Application()
+    app.router.add_post("/v3/parse", lambda r: reply(r, _PARSE))
+    app.router.add_post("/v3/diagnosis", lambda r: reply(r, _DIAGNOSIS))
+    app.router.add_post("/v1/chat/completions", chat)
+    return app
+
+def _pct(ms: list, p: float) -> float:
+    return round(ms[min(len(ms) - 1, int(p / 100 * len(ms)))], 3)
+
+async def _timed(calls: int, concurrency: int, call) -> dict:
+    """calls 次 call()，最多 concurrency 个同时在飞；返回单次延迟分布与总耗时"""
+    lat: list[float] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            t0 = time.perf_counter()
+            await call(i)
+            lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    wall = time.perf_counter() - t0
+    lat.sort()
+    return {"calls": calls, "concurrency": concurrency, "mean_ms": round(sum(lat) / len(lat), 3),
+            "p50_ms": _pct(lat, 50), "p99_ms": _pct(lat, 99), "calls_per_s": round(calls / wall, 1)}
+
+async def _departments(ds, rounds: int) -> dict:
+    """每轮 3 个没见过的疾病：逐个映射 vs 一次批量映射（都是冷缓存），再重复批量一次（全部命中）"""
+    out = {}
+    for name, fn in (("sequential_single", None), ("batched", "cold"), ("batched_cached", "warm")):
+        lat = []
+        for r in range(rounds):
+            names = [f"Condition {name} {r}-{i}" for i in range(3)]
+            if fn == "warm":
+                await ds.get_departments_for_conditions(names)
+            t0 = time.perf_counter()
+            if fn is None:
+                for n in names:
+                    await ds.get_department_by_evidence(n)
+            else:
+                await ds.get_departments_for_conditions(names)
+            lat.append((time.perf_counter() - t0) * 1000)
+        lat.sort()
+        out[name] = {"rounds": rounds, "mean_ms": round(sum(lat) / len(lat), 3), "p50_ms": _pct(lat, 50)}
+    return out
+
+async def _main(args) -> dict:
+    conns: set = set()
+    llm = {"delay": 0.0}
+    runner = web.AppRunner(_app(args.delay_ms / 1000, conns, llm), access_log=None)
+    await runner.setup()
+    tls = None
+    if args.cert:
+        tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        tls.load_cert_chain(args.cert, args.key)
+    # 用主机名而不是 127.0.0.1：旧写法每次都要解析一遍，连接池会话走 DNS 缓存
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    await web.TCPSite(runner, "localhost", port, ssl_context=tls).start()
+    base = f"{'https' if tls else 'http'}://localhost:{port}"
+
+    # 替身地址要在 import 之前设好（模块级常量）；自签证书只在本基准里信任
+    # 科室缓存只留内存（不写磁盘文件），每轮用新疾病名保证冷缓存
+    os.environ.update(INFERMEDICA_BASE_URL=base + "/v3", OPENAI_BASE_URL=base + "/v1", OPENAI_API_KEY="bench",
+                      DEPARTMENT_CACHE_DB="")
+    import diagnosis_server as ds
+
+    client_tls = None
+    if tls:
+        client_tls = ssl.create_default_context(cafile=args.cert)
+    payloads = [("/parse", {"text": "headache", "age": {"value": 30}, "sex": "male"}),
+                ("/diagnosis", {"sex": "male", "age": {"value": 30}, "evidence": [{"id": "s_21", "choice_id": "present"}]})]
+
+    async def per_call(i: int):
+        # 改动前的写法：每次调用一个新会话（新连接池、新连接、无 DNS 缓存）
+        endpoint, payload = payloads[i % 2]
+        async with ClientSession() as session:
+            async with session.post(f"{ds.BASE_URL}{endpoint}", json=payload, ssl=client_tls) as resp:
+                await resp.json()
+
+    async def pooled(i: int):
+        endpoint, payload = payloads[i % 2]
+        async with ds._http().post(f"{ds.BASE_URL}{endpoint}", json=payload, ssl=client_tls) as resp:
+            await resp.json()
+
+    async def pooled_tools(i: int):
+        # 真实的工具函数（TLS 自签时无法注入信任，只在明文下跑）；科室直接问模型，绕过缓存
+        if i % 3 == 0:
+            out = await ds.parse_text_to_evidence("headache")
+        elif i % 3 == 1:
+            out = await ds.run_diagnosis([{"id": "s_21", "choice_id": "present"}])
+        else:
+            out = await ds._ask_department("Migraine")
+        assert out and out != "Unknown", "stand-in call failed"
+
+    report = {"base_url": base, "delay_ms": args.delay_ms, "runs": []}
+    runs = [("per_call_session", per_call), ("pooled_session", pooled)]
+    if not tls:
+        runs.append(("pooled_tools", pooled_tools))
+    for concurrency in sorted({1, args.concurrency}):
+        for name, call in runs:
+            await call(0)  # 预热（import、首个连接），不计入
+            conns.clear()
+            res = await _timed(args.calls, concurrency, call)
+            report["runs"].append({"client": name, **res, "server_connections": len(conns)})
+    if not tls and args.rounds:
+        llm["delay"] = args.llm_delay_ms / 1000
+        report["departments"] = {"llm_delay_ms": args.llm_delay_ms, **await _departments(ds, args.rounds)}
+    await ds.close_http()
+    await runner.cleanup()
+    return report
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Per-call vs pooled aiohttp sessions against a local stand-in API.")
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--delay-ms", type=float, default=0.0, help="server-side think time per request")
+    ap.add_argument("--llm-delay-ms", type=float, default=300.0, help="stand-in model latency for the departments run")
+    ap.add_argument("--rounds", type=int, default=10, help="Top-3 department mappings per variant (0 skips)")
+    ap.add_argument("--cert", help="PEM certificate for a TLS stand-in (self-signed is fine)")
+    ap.add_argument("--key", help="PEM private key for --cert")
+    ap.add_argument("-o", "--out", help="write JSON here as well as stdout")
+    args = ap.parse_args()
+    text = json.dumps(asyncio.run(_main(args)), indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,499 @@
+# check_backends.py — 医生查询各后端（memory / sqlite / sharded）的行为回归检查
+# 用法：python benchmarks/check_backends.py [检查名 ...]；有任何一项不符时退出码为 1
+# 每项检查在临时目录里写一份小 CSV（快照 / 库文件 / 分片计划都落在那里），跑完即删
+import os, sys, csv, copy, json, time, shutil, tempfile, threading
+from contextlib import contextmanager
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, "..", "Medical Recommendation System")
+sys.path.insert(0, APP)
+
+FIELDS = ["name", "speciality", "average_score", "hospital_name", "city", "state"]
+CHECKS = {}
+
+def _check(fn):
+    CHECKS[fn.__name__.lstrip("_")] = fn
+    return fn
+
+def _write_csv(path: str, rows: list, fields: list = FIELDS) -> str:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        w.writerows(rows)
+    return path
+
+@contextmanager
+def _backend(name: str, csv_path: str):
+    """按名字建一个后端（sharded 用 2 个分片进程），用完关掉"""
+    from doctor_index import DoctorIndex
+    from doctor_sqlite import SqliteDoctorIndex
+    from doctor_shards import ShardedDoctorIndex
+
+    if name == "sqlite":
+        index = SqliteDoctorIndex.load(csv_path)
+    elif name == "sharded":
+        index = ShardedDoctorIndex(csv_path, 2)
+    else:
+        index = DoctorIndex.from_csv(csv_path)
+    try:
+        yield index
+    finally:
+        if hasattr(index, "close"):
+            index.close()
+
+BACKENDS = ("memory", "sqlite", "sharded")
+
+# -------- checks --------
+# 罗利—达勒姆一带：Morrisville 没有医生，但在普查地名里，应按距离找到 Raleigh / Durham，
+# 而不是退到全州、给出三百英里外的 Asheville
+_PLACES = [("Raleigh city", "NC", 35.8302, -78.6414), ("Durham city", "NC", 35.9811, -78.9029),
+           ("Morrisville town", "NC", 35.8368, -78.8348), ("Asheville city", "NC", 35.5707, -82.5537)]
+
+@_check
+def _nearby_city_without_doctors(tmp: str) -> dict:
+    from doctor_geo import CityGazetteer, build_gazetteer
+
+    census = os.path.join(tmp, "places.txt")
+    with open(census, "w", encoding="utf-8", newline="") as f:
+        f.write("USPS\tNAME\tINTPTLAT\tINTPTLONG\n")
+        f.writelines(f"{st}\t{name}\t{lat}\t{lon}\n" for name, st, lat, lon in _PLACES)
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), [
+        ("Dr. A", "Cardiology", 4.0, "Rex Hospital", "Raleigh", "NC"),
+        ("Dr. B", "Cardiology", 4.2, "Duke Hospital", "Durham", "NC"),
+        ("Dr. C", "Cardiology", 5.0, "Mission Hospital", "Asheville", "NC"),
+        ("Dr. D", "Cardiology", 4.9, "Mission Hospital", "Asheville", "NC"),
+    ])
+    out = os.path.join(tmp, "city_centroids.csv")
+    written, missing = build_gazetteer([census], doctors, out)
+    res = {"places_written": written, "doctor_cities_missing": missing, "backends": {}}
+    ok = missing == 0
+    for name in BACKENDS:
+        with _backend(name, doctors) as index:
+            index.attach_gazetteer(CityGazetteer.from_csv(out))
+            rows = index.query(["Cardiology"], "Morrisville", "NC", 2)
+        tiers = sorted({r["match_tier"] for r in rows})
+        cities = sorted(r["city"] for r in rows)
+        res["backends"][name] = {"tiers": tiers, "cities": cities}
+        ok = ok and tiers == ["nearby"] and cities == ["Durham", "Raleigh"]
+    res["ok"] = ok
+    return res
+
+# 内存后端的增量在副本上应用：旧索引被几个线程不停地查（含遍历分区字典的 footprint）时，
+# 连续派生若干批（每批都带新城市 / 新专科，会往字典里加键），旧索引不能报错、答案也不能变
+_DELTA_ROUNDS = 30
+
+@_check
+def _delta_copy_on_write(tmp: str) -> dict:
+    from doctor_index import DoctorIndex
+
+    rows = [(f"Dr. P{i}, MD", ("Cardiology", "Neurology", "Dermatology")[i % 3], 3 + (i % 5) / 2,
+             f"Hospital {i % 7}", ("Boston", "Cambridge", "Worcester")[i % 3], "MA") for i in range(300)]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    old = DoctorIndex.from_csv(doctors)
+
+    def answers(index):
+        return (len(index), index.version, index.query(["Cardiology"], "Boston", "MA", 5),
+                index.page("Neurology", "MA", 20)["doctors"], sorted(index._place_keys()))
+
+    before, errors, stop = answers(old), [], threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                index.footprint()
+                old.footprint()
+                if answers(old) != before:
+                    errors.append("old index changed under a delta")
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    index = old
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    try:
+        for n in range(_DELTA_ROUNDS):
+            delta = _write_csv(os.path.join(tmp, f"d{n}.csv"), [
+                (f"Dr. New{n}-{j}, MD", f"Speciality {n}", 4.5, "Hospital 1", f"Town {n}-{j}", "MA", "upsert")
+                for j in range(20)] + [(f"Dr. P{n}, MD", "", 0, f"Hospital {n % 7}", "", "", "delete")],
+                FIELDS + ["op"])
+            index, _ = index.with_delta(delta)
+            time.sleep(0.002)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    after = answers(old)
+    # 新索引：多了每批 20 行，删掉每批 1 行
+    want = len(before[4]) + _DELTA_ROUNDS * 20
+    ok = not errors and after == before and len(index) == 300 + _DELTA_ROUNDS * 19 and \
+        len(index._place_keys()) == want and index.version != old.version
+    return {"rounds": _DELTA_ROUNDS, "old_rows": len(old), "new_rows": len(index),
+            "errors": sorted(set(errors))[:5], "ok": ok}
+
+# sqlite / sharded 的 with_delta 同样在副本上换好进程内状态（行数、版本、专科解析器、州路由、医院聚合、视图），
+# 正在服务的对象一个字段都不改；增量带新州（sharded 要重新分配）和新专科
+@_check
+def _delta_publishes_copy(tmp: str) -> dict:
+    from doctor_index import DoctorIndex
+    from doctor_hospitals import HospitalTable
+    from doctor_view import TopNView, _view_path, build_view
+
+    rows = [(f"Dr. C{i}, MD", ("Cardiology", "Neurology")[i % 2], 3 + (i % 5) / 2,
+             f"Hospital {i % 4}", ("Boston", "Austin", "Dallas")[i % 3], ("MA", "TX", "TX")[i % 3]) for i in range(60)]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    delta = _write_csv(os.path.join(tmp, "delta.csv"), [
+        ("Dr. C0, MD", "", 0, "Hospital 0", "", "", "delete"),
+        ("Dr. New, MD", "Sleep Medicine", 4.5, "Hospital 9", "Portland", "OR", "upsert"),
+        ("Dr. Moved, MD", "Cardiology", 5, "Hospital 1", "Boston", "MA", "upsert"),
+    ], FIELDS + ["op"])
+    build_view(DoctorIndex.load(doctors), _view_path(doctors))
+    res = {"backends": {}}
+    ok = True
+    for name in BACKENDS[1:]:
+        with _backend(name, doctors) as index:
+            index.attach_hospital_stats(HospitalTable.build(index))
+            index.attach_view(TopNView.load(doctors))
+            fields = ("_rows", "_delta_seq", "_spec_resolver", "hospital_stats", "view", "_states", "_state_shard",
+                      "_summaries", "_places")
+            before = {f: getattr(index, f) for f in fields if hasattr(index, f)}
+            snap = {f: copy.deepcopy(v) for f, v in before.items() if f in ("_states", "_state_shard", "_places")}
+            version = index.version
+            new, _ = index.with_delta(delta)
+            same = all(getattr(index, f) is v for f, v in before.items()) and \
+                all(getattr(index, f) == v for f, v in snap.items()) and index.version == version
+            fresh = new.version.endswith("+1") and len(new) == 61 and \
+                new.top_hospitals(["Sleep Medicine"], "Portland", "OR", 1)[0]["specialists"] == 1 and \
+                new.query(["Sleep Medicine"], "Portland", "OR", 1)[0]["name"] == "Dr. New, MD"
+            res["backends"][name] = {"old_untouched": same, "new_consistent": fresh, "version": new.version}
+            ok = ok and same and fresh
+    res["ok"] = ok
+    return res
+
+# SQLite 库由各进程共用：增量在建库时写进去一次，之后“另一个进程”（同一库上的第二个对象）
+# 启动时再应用同一份文件不应写库、不应把版本再加一；增量文件变了由一个进程写，另一个只同步
+@_check
+def _sqlite_delta_once(tmp: str) -> dict:
+    from doctor_index import DoctorIndex, _delta_path
+    from doctor_sqlite import SqliteDoctorIndex, _sqlite_path
+    from doctor_hospitals import HospitalTable
+
+    rows = [(f"Dr. S{i}, MD", ("Cardiology", "Neurology")[i % 2], 3 + (i % 5) / 2,
+             f"Hospital {i % 4}", ("Boston", "Worcester")[i % 2], "MA") for i in range(60)]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    delta = _delta_path(doctors)
+
+    def write_delta(n):
+        _write_csv(delta, [(f"Dr. D{n}-{j}, MD", "Cardiology", 5.0, "Hospital 9", "Boston", "MA", "upsert")
+                           for j in range(n)] + [(f"Dr. S{n}, MD", "", 0, f"Hospital {n % 4}", "", "", "delete")],
+                   FIELDS + ["op"])
+
+    def state(index):
+        return (index.version, len(index), index.query(["Cardiology"], "Boston", "MA", 5),
+                index.top_hospitals(["Cardiology"], "Boston", "MA", 3))
+
+    def opened():
+        index = SqliteDoctorIndex.load(doctors)
+        index.attach_hospital_stats(HospitalTable.build(index))
+        return index
+
+    write_delta(3)
+    a = opened()
+    db = _sqlite_path(doctors)
+    stamp = os.stat(db).st_mtime_ns
+    a_stats = a.apply_delta(delta)
+    b = opened()
+    b_stats = b.apply_delta(delta)
+    no_write = os.stat(db).st_mtime_ns == stamp
+    res = {"startup": {"a": a_stats.get("already_applied", False), "b": b_stats.get("already_applied", False),
+                       "db_unchanged": no_write, "version": b.version}}
+    ok = no_write and a_stats.get("already_applied") and b_stats.get("already_applied") and state(a) == state(b)
+    # 参照：内存后端上 CSV + 同一份增量
+    mem = DoctorIndex.from_csv(doctors)
+    mem.attach_hospital_stats(HospitalTable.build(mem))
+    mem, _ = mem.with_delta(delta)
+    ok = ok and state(a)[1:3] == state(mem)[1:3] and a.version.endswith("+1")
+
+    write_delta(5)
+    a_stats, b_stats = a.apply_delta(delta), b.apply_delta(delta)
+    ok = ok and not a_stats.get("already_applied") and b_stats.get("already_applied") and state(a) == state(b)
+    c = opened()
+    res["changed"] = {"a_upserted": a_stats["upserted"], "b": b_stats.get("already_applied", False),
+                      "versions": sorted({a.version, b.version, c.version})}
+    ok = ok and state(c) == state(a) and a.version.endswith("+2")
+    res["ok"] = bool(ok)
+    return res
+
+# 分页逐页走完（每页 1 / 2 / 7 行），各后端拿到的行与顺序都要和内存后端一致。数据里故意造排序键相同的行：
+# 同一医生在同一医院有几个神经科专科、同分；同名医生在同名医院、分在不同州（不同分片）
+_PAGE_SIZES = (1, 2, 7)
+
+@_check
+def _page_walk_matches_memory(tmp: str) -> dict:
+    from doctor_index import DoctorIndex
+
+    specs = ("Neurology", "Pediatric Neurology", "Neurology Clinical Neurophysiology")
+    states = ("MA", "GA", "TX", "OH")
+    rows = []
+    for i in range(90):
+        st = states[i % 4]
+        for sp in specs[:1 + i % 3]:
+            rows.append((f"Dr. N{i % 12}, MD", sp, (3, 4, 4.5)[i % 3], f"Hospital {i % 5}",
+                         ("Augusta", "Columbus")[i % 2], st))
+    rows += [("Dr. Other, DO", "Cardiology", 4.0, "Hospital 1", "Augusta", st) for st in states]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+
+    def walk(index, loc, size):
+        got, cursor, total = [], None, None
+        while True:
+            r = index.page("Neurology", loc, limit=size, cursor=cursor)
+            total = r["total"] if total is None else total
+            got += [(d["name"], d["speciality"], d["hospital_name"], d["city"], d["state"]) for d in r["doctors"]]
+            cursor = r["next_cursor"]
+            if not cursor:
+                return total, got
+
+    locs = (None, "GA", "Augusta, GA", "Columbus")
+    want = {(loc, n): walk(DoctorIndex.from_csv(doctors), loc, n) for loc in locs for n in _PAGE_SIZES}
+    res, ok = {"walks": len(want), "backends": {}}, True
+    for name in BACKENDS:
+        bad = []
+        with _backend(name, doctors) as index:
+            for (loc, n), (total, expect) in want.items():
+                t, got = walk(index, loc, n)
+                if t != total or got != expect or len(expect) != total:
+                    bad.append({"location": loc, "page_size": n, "total": t, "rows": len(got), "want": len(expect)})
+        res["backends"][name] = bad[:3]
+        ok = ok and not bad
+    res["ok"] = ok
+    return res
+
+# 应用增量后 top-N 视图仍要命中：增量只改 Boston，Worcester 的键应继续查表命中，Boston 的键回落到实时索引；
+# 两者的答案都要和没挂视图、直接在 CSV + 增量上查的一样。SQLite 另开一个对象（新进程启动时增量已在库里）也要命中
+@_check
+def _view_hit_after_delta(tmp: str) -> dict:
+    from doctor_index import DoctorIndex, _delta_path
+    from doctor_view import TopNView, _view_path, build_view
+
+    rows = [(f"Dr. V{i}, MD", ("Cardiology", "Neurology")[i % 2], 3 + (i % 5) / 2,
+             f"Hospital {i % 4}", ("Boston", "Worcester")[i % 3 == 0], "MA") for i in range(80)]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    build_view(DoctorIndex.load(doctors), _view_path(doctors))
+    delta = _write_csv(_delta_path(doctors), [
+        ("Dr. New, MD", "Cardiology", 5.0, "Hospital 9", "Boston", "MA", "upsert"),
+        ("Dr. V2, MD", "", 0, "Hospital 2", "", "", "delete"),
+    ], FIELDS + ["op"])
+    plain, _ = DoctorIndex.from_csv(doctors).with_delta(delta)
+    asks = {"untouched": (["Cardiology"], "Worcester", "MA", 5), "touched": (["Cardiology"], "Boston", "MA", 5)}
+    want = {name: plain.query(*q) for name, q in asks.items()}
+
+    def probe(index):
+        """每个问题是否查表命中、答案是否与参照一致"""
+        out = {}
+        for name, q in asks.items():
+            hits = index.view.stats()["hits"] if index.view else 0
+            got = index.query(*q)
+            out[name] = {"hit": bool(index.view) and index.view.stats()["hits"] > hits, "same": got == want[name]}
+        return out
+
+    res, ok = {"backends": {}}, True
+    for name in BACKENDS:
+        with _backend(name, doctors) as index:
+            index.attach_view(TopNView.load(doctors))
+            if hasattr(index, "with_delta"):
+                index, _ = index.with_delta(delta)
+            else:
+                index.apply_delta(delta)
+            got = res["backends"][name] = {"version": index.version, **probe(index)}
+            if name == "sqlite":
+                from doctor_sqlite import SqliteDoctorIndex
+                other = SqliteDoctorIndex.load(doctors)
+                other.attach_view(TopNView.load(doctors))
+                got["second_process"] = probe(other)
+                ok = ok and got["second_process"] == {"untouched": {"hit": True, "same": True},
+                                                      "touched": {"hit": False, "same": True}}
+        ok = ok and got["untouched"] == {"hit": True, "same": True} and got["touched"] == {"hit": False, "same": True}
+    res["ok"] = ok
+    return res
+
+# find_top_hospitals 的显示名与后端无关：同一家医院有大小写不同的写法时，各后端（内存按名次、SQLite 按 GROUP BY、
+# 分片按分片）先见到的写法不同，都应取医生最多的写法；增量改变多数写法后，增量更新的表与重建的表也要一致
+@_check
+def _hospital_names_match(tmp: str) -> dict:
+    from doctor_index import _delta_path
+    from doctor_hospitals import HospitalTable
+
+    rows = []
+    for i in range(24):
+        # 全大写的写法分数最高（内存后端先见到它），混排的写法人数多
+        name, score = ("MAYO CLINIC", 5.0) if i % 3 == 0 else ("Mayo Clinic", 4.0)
+        rows.append((f"Dr. M{i}, MD", ("Cardiology", "cardiology", "Neurology")[i % 3], score, name,
+                     ("Rochester", "ROCHESTER")[i % 4 == 0], "MN"))
+        rows.append((f"Dr. J{i}, MD", "Cardiology", 3 + i % 3, "Johns Hopkins", "Baltimore", ("MD", "md")[i % 5 == 0]))
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    asks = [(["Cardiology"], "Rochester", "MN", 3), (["Cardiology"], None, None, 5), ([], None, None, 5),
+            (["Neurology"], None, "MN", 5)]
+
+    def answers(index):
+        return [index.top_hospitals(*q) for q in asks]
+
+    res, seen = {"backends": {}}, {}
+    for name in BACKENDS:
+        with _backend(name, doctors) as index:
+            index.attach_hospital_stats(HospitalTable.build(index))
+            seen[name] = answers(index)
+            res["backends"][name] = sorted({h["hospital_name"] for r in seen[name] for h in r})
+    ok = all(seen[name] == seen["memory"] for name in BACKENDS)
+    ok = ok and res["backends"]["memory"] == ["Johns Hopkins", "Mayo Clinic"]
+
+    # 增量：把混排写法的医生都删掉后，全大写成了多数
+    delta = _write_csv(os.path.join(tmp, "delta.csv"), [(f"Dr. M{i}, MD", "", 0, "Mayo Clinic", "", "", "delete")
+                                                        for i in range(24) if i % 3], FIELDS + ["op"])
+    with _backend("memory", doctors) as index:
+        index.attach_hospital_stats(HospitalTable.build(index))
+        index, _ = index.with_delta(delta)
+        incremental = answers(index)
+        rebuilt = HospitalTable.build(index)
+        index.attach_hospital_stats(rebuilt)
+        full = answers(index)
+    res["after_delta"] = sorted({h["hospital_name"] for r in incremental for h in r})
+    ok = ok and incremental == full and "MAYO CLINIC" in res["after_delta"]
+    res["ok"] = ok
+    return res
+
+# 医院名过滤按 _norm 后的子串比：原值里有多个空格、大小写不同的医院，各后端都要找到
+# （SQLite 的 trigram 预筛若对原值 MATCH 会先把它们筛掉）；增量删掉 / 新增这些行后也一样
+_HOSPITALS = ["Saint  Mary's   Hospital", "SAINT MARY'S HOSPITAL", "St. Mary Clinic", "Mercy  General"]
+
+@_check
+def _hospital_filter_normalized(tmp: str) -> dict:
+    rows = [(f"Dr. H{i}, MD", "Cardiology", 3 + i % 4 / 2, _HOSPITALS[i % 4], "Boston", "MA") for i in range(40)]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    delta = _write_csv(os.path.join(tmp, "delta.csv"), [
+        ("Dr. H0, MD", "", 0, _HOSPITALS[0], "", "", "delete"),
+        ("Dr. Late, MD", "Cardiology", 4.5, "Saint Mary's  Hospital", "Boston", "MA", "upsert"),
+    ], FIELDS + ["op"])
+    asks = ["saint mary's hospital", "Saint  Mary", "mercy general", "mary"]
+
+    def answers(index):
+        return {h: [(d["name"], d["hospital_name"]) for d in index.page("Cardiology", "Boston, MA", 100, hospital=h)["doctors"]]
+                for h in asks}
+
+    res, seen = {"backends": {}}, {}
+    for name in BACKENDS:
+        with _backend(name, doctors) as index:
+            before = answers(index)
+            if hasattr(index, "with_delta"):
+                index, _ = index.with_delta(delta)
+            else:
+                index.apply_delta(delta)
+            seen[name] = (before, answers(index))
+        res["backends"][name] = {h: len(r) for h, r in seen[name][0].items()}
+    ok = all(seen[name] == seen["memory"] for name in BACKENDS)
+    ok = ok and res["backends"]["memory"] == {"saint mary's hospital": 20, "Saint  Mary": 20, "mercy general": 10, "mary": 30}
+    res["ok"] = ok
+    return res
+
+# min_score 恰好等于某个评分时要把它算进去：内存后端的评分列是 float32（4.7 存成 4.6999998），
+# 阈值若按 float64 比会在临界点上少一行；评分取 0.1 步长（不是 0.5 的倍数，float32 表示不精确）
+@_check
+def _min_score_threshold(tmp: str) -> dict:
+    scores = [4.7, 4.1, 4.9, 3.3, 4.7, 2.9, 4.1, 3.7]
+    rows = [(f"Dr. S{i}, MD", "Cardiology", sc, f"Hospital {i % 3}", "Boston", "MA") for i, sc in enumerate(scores * 3)]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    cuts = [4.7, 4.1, 3.3, 2.9, 4.9, 4.75]
+    res, seen = {"backends": {}}, {}
+    for name in BACKENDS:
+        with _backend(name, doctors) as index:
+            got = {}
+            for cut in cuts:
+                page = index.page("Cardiology", "Boston, MA", 5, min_score=cut)
+                walked = [d["name"] for d in page["doctors"]]
+                while page.get("next_cursor"):
+                    page = index.page("Cardiology", "Boston, MA", 5, min_score=cut, cursor=page["next_cursor"])
+                    walked += [d["name"] for d in page["doctors"]]
+                got[cut] = (page["total"], walked)
+            seen[name] = got
+        res["backends"][name] = {str(cut): t for cut, (t, _) in got.items()}
+    want = {str(cut): 3 * sum(sc >= cut for sc in scores) for cut in cuts}
+    res["expected"] = want
+    res["ok"] = all(seen[name] == seen["memory"] and res["backends"][name] == want for name in BACKENDS)
+    return res
+
+# 热加载时旧索引在换下后关闭（sharded 会停掉工作进程），而进行中的工具调用还拿着它：
+# 几个线程不停地调真实的 MCP 工具（含多轮放宽、分页），同时反复 _reload，任何调用都不能报错；
+# 全部结束后换下的工作进程（sharded 分片、memory 副本）都已退出
+_RELOADS = 5
+
+@_check
+def _reload_under_load(tmp: str) -> dict:
+    import asyncio
+    import find_doctor_server as server
+
+    rows = [(f"Dr. L{i}, MD", ("Cardiology", "Neurology", "Dermatology")[i % 3], 3 + (i % 5) / 2,
+             f"Hospital {i % 5}", ("Boston", "Austin", "Columbus")[i % 3], ("MA", "TX", "OH")[i % 3]) for i in range(300)]
+    doctors = _write_csv(os.path.join(tmp, "doctors.csv"), rows)
+    server.CSV_FILE_PATH, server.DELTA_FILE_PATH = doctors, os.path.join(tmp, "none.delta.csv")
+    res, ok = {"backends": {}}, True
+    for name in BACKENDS:
+        server.DB_BACKEND, server._INDEX, server._POOL = name, None, None
+        server._READY.clear()
+        server._get_index()
+        retired, errors, calls, stop = [], [], [0], threading.Event()
+        reloads = server._RELOAD["reloads"]
+
+        def load():
+            while not stop.is_set():
+                try:
+                    asyncio.run(server.find_top_doctors(["Cardiology"], "Nowhere", "ZZ", 5))
+                    asyncio.run(server.find_top_hospitals(["Neurology"], "Austin", "TX", 3))
+                    asyncio.run(server.find_top_doctors_batch([{"specialities": ["Dermatology"], "city": "Boston"}], 5))
+                    page = asyncio.run(server.find_doctors("Cardiology", None, 20))
+                    if "error" in page:
+                        errors.append(page["error"])
+                    calls[0] += 4
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for t in threads:
+            t.start()
+        try:
+            for n in range(_RELOADS):
+                time.sleep(0.05)
+                retired += [server._INDEX, server._POOL]
+                _write_csv(doctors, rows + [(f"Dr. Extra{n}, MD", "Cardiology", 4.5, "Hospital 9", "Boston", "MA")])
+                server._reload()
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            current = server._INDEX
+            for obj in (current, server._POOL):
+                if obj is not None and hasattr(obj, "close"):
+                    obj.close()
+        time.sleep(0.5)
+        alive = sum(p.is_alive() for old in retired for p in getattr(old, "_procs", ()))
+        res["backends"][name] = {"calls": calls[0], "reloads": server._RELOAD["reloads"] - reloads, "rows": len(current),
+                                 "errors": sorted(set(errors))[:5], "old_workers_alive": alive}
+        ok = ok and not errors and not alive and len(current) == 301
+    server._INDEX = server._POOL = None
+    res["ok"] = ok
+    return res
+
+def main(names: list) -> int:
+    results = []
+    for name in names or list(CHECKS):
+        tmp = tempfile.mkdtemp(prefix="check_backends_")
+        try:
+            results.append({"check": name, **CHECKS[name](tmp)})
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    ok = all(r["ok"] for r in results)
+    print(json.dumps({"results": results, "ok": ok}, indent=2))
+    if not ok:
+        print("failed: " + ", ".join(r["check"] for r in results if not r["ok"]), file=sys.stderr)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+# check_concurrency.py — MCP 工具里的阻塞工作不能卡住事件循环；重叠调用的实际加速比如实报告
+# 用法：python benchmarks/check_concurrency.py [CSV] [后端 ...]（默认 memory sqlite sharded）；有任何一项不符时退出码为 1
+# 做法：医生工具在真实索引上跑重查询（全国分页 + 医院名 / 资质过滤、全国医院排行、大批量查询），
+# 每个工具先经 MCP 工具函数（即线程池）串行调 CALLS 次，再同时发 CALLS 个，speedup = 串行墙钟 / 重叠墙钟。
+# 索引按服务端的方式建（_build_index）：memory 后端的查询发给 DOCTOR_DB_PROCS 个副本进程（doctor_pool），
+# SQLite 查询、sharded 后端等分片回包时释放 GIL，三个后端的工具线程都不占着 GIL 干活。
+# 医生工具检查：重叠调用的结果与串行一致，每个后端上事件循环都不被阻塞（调度延迟小于单次调用）；
+# 副本数与 CPU 核数都不少于 CALLS 时，memory 后端（默认后端）还要求重叠调用真的并行完成（speedup 接近 CALLS）。
+# 单核机器上任何 CPU 密集的后端 speedup 都 ≈ 1，这一项只在多核上判。
+# find_nearby_hospitals 也走真实工具，ipapi 与 Overpass 两次请求换成各等 DELAY 秒的替身；
+# 网络等待不占 GIL，这一项要求真的并行（speedup 接近 CALLS）
+import os, sys, json, time, types, asyncio, logging
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, "..", "Medical Recommendation System")
+sys.path.insert(0, APP)
+
+CALLS = 4
+DELAY = 0.2
+# 调度延迟上限：一次调用的耗时（直接在协程里阻塞地调用时，事件循环至少要停这么久），
+# 但不低于 GIL 切换周期的几倍（持 GIL 的线程让出前事件循环本来就要等）
+LAG_FLOOR = 0.025
+# 要求并行完成的调用至少要这么重：更轻的调用主要是收发与调度开销，重叠了也省不出时间
+PARALLEL_MIN = 0.02
+os.environ.setdefault("DOCTOR_DB_WORKERS", str(CALLS))
+os.environ.setdefault("DOCTOR_DB_WATCH_SECONDS", "0")
+
+SPECS = ["Medicine", "Surgery", "Pediatrics", "Cardiology"]
+BACKENDS = ("memory", "sqlite", "sharded")
+
+async def _measure(name: str, call, compare: bool = True, responsive: bool = True, parallel: bool = False) -> dict:
+    """
+    call(j) 返回第 j 个调用的协程。先串行跑 CALLS 个，再同时发 CALLS 个，
+    记录两次的墙钟、重叠期间事件循环的最大调度延迟，以及两次结果是否一致。
+    responsive：要求调度延迟小于单次调用的耗时；parallel：单次调用不短于 PARALLEL_MIN 时要求 speedup 接近 CALLS
+    """
+    t0 = time.perf_counter()
+    serial = [await call(j) for j in range(CALLS)]
+    serial_s = time.perf_counter() - t0
+
+    lag, done = 0.0, False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            t = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag = max(lag, time.perf_counter() - t - 0.005)
+
+    tick = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0)
+    t0 = time.perf_counter()
+    overlapped = await asyncio.gather(*(call(j) for j in range(CALLS)))
+    wall = time.perf_counter() - t0
+    done = True
+    await tick
+
+    per_call = serial_s / CALLS
+    speedup = serial_s / wall if wall else None
+    res = {"tool": name, "calls": CALLS, "per_call_ms": round(per_call * 1000, 1),
+           "serial_ms": round(serial_s * 1000, 1), "overlapped_ms": round(wall * 1000, 1),
+           "speedup": round(speedup, 2) if speedup else None, "max_loop_lag_ms": round(lag * 1000, 1)}
+    ok = True
+    if responsive:
+        ok = lag < max(per_call, LAG_FLOOR)
+    if compare:
+        res["same_results"] = list(overlapped) == serial
+        ok = ok and res["same_results"]
+    if parallel and per_call >= PARALLEL_MIN:
+        res["parallel_checked"] = True
+        ok = ok and speedup >= CALLS * 0.6
+    res["ok"] = bool(ok)
+    return res
+
+async def _doctor_checks(path: str, backends: list) -> list[dict]:
+    os.environ["DOCTOR_DB_CSV"] = path
+    import find_doctor_server as server
+
+    server.CSV_FILE_PATH = path
+
+    batch = [{"specialities": [s], "city": c, "state": st} for s in SPECS
+             for c, st in (("Boston", "MA"), ("Houston", "TX"), ("Rochester", "MN"), ("Nowhere", "ZZ"))]
+    tools = [
+        ("find_doctors", lambda j: server.find_doctors(SPECS[0], None, 200, hospital="aeio"[j], credential="MD")),
+        ("find_top_hospitals", lambda j: server.find_top_hospitals([SPECS[j]], None, None, 50)),
+        ("find_top_doctors", lambda j: server.find_top_doctors([SPECS[j]], None, None, 200)),
+        ("find_top_doctors_batch", lambda j: server.find_top_doctors_batch(batch[j:] + batch[:j], 20)),
+    ]
+    out = []
+    for backend in backends:
+        server.DB_BACKEND, server._INDEX, server._POOL = backend, None, None
+        server._READY.clear()
+        server._get_index()
+        index, pool = server._INDEX, server._POOL
+        procs = len(pool) if pool is not None else 0
+        parallel = backend == "memory" and min(procs, os.cpu_count() or 1) >= CALLS
+        try:
+            for name, call in tools:
+                out.append({"backend": backend, "procs": procs, **await _measure(name, call, parallel=parallel)})
+            out.append({"backend": backend, "procs": procs, **await _measure(
+                "doctor_db_status", lambda j: server.doctor_db_status(), compare=False)})
+        finally:
+            server._INDEX = server._POOL = None
+            for res in (index, pool):
+                if res is not None and hasattr(res, "close"):
+                    res.close()
+    return out
+
+async def _location_checks() -> list[dict]:
+    import location_server
+
+    class _Json:
+        status = 200
+
+        def __init__(self, doc):
+            self.doc = doc
+
+        async def __aenter__(self):
+            await asyncio.sleep(DELAY)
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def json(self):
+            return self.doc
+
+    class _Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def post(self, url, data=None, headers=None):
+            return _Json({"elements": [{"tags": {"name": "Mass General"}, "lat": 42.3631, "lon": -71.0686},
+                                       {"tags": {"name": "Tufts Medical"}, "lat": 42.3496, "lon": -71.0636}]})
+
+    class _Resp:
+        @staticmethod
+        def json():
+            return {"latitude": 42.36, "longitude": -71.06}
+
+    def slow_get(url, **kwargs):
+        time.sleep(DELAY)
+        return _Resp()
+
+    location_server.requests = types.SimpleNamespace(get=slow_get)
+    location_server.aiohttp = types.SimpleNamespace(ClientSession=_Session)
+    res = await _measure("find_nearby_hospitals",
+                         lambda j: location_server.find_nearby_hospitals(client_ip=f"8.8.8.{j}"), parallel=True)
+    return [{"backend": "network", "network_delay_ms": 2 * DELAY * 1000, **res}]
+
+async def _main(path: str, backends: list) -> list[dict]:
+    return await _doctor_checks(path, backends) + await _location_checks()
+
+def main(path: str, backends: list) -> int:
+    logging.disable(logging.INFO)
+    results = asyncio.run(_main(path, backends))
+    ok = all(r["ok"] for r in results)
+    # 各后端医生工具的总加速比：串行墙钟之和 / 重叠墙钟之和
+    speedup = {}
+    for r in results:
+        s, w = speedup.get(r["backend"], (0.0, 0.0))
+        speedup[r["backend"]] = (s + r["serial_ms"], w + r["overlapped_ms"])
+    speedup = {b: round(s / w, 2) for b, (s, w) in speedup.items() if w}
+    print(json.dumps({"csv": path, "cpus": os.cpu_count(), "workers": CALLS, "speedup": speedup,
+                      "results": results, "ok": ok}, indent=2))
+    if not ok:
+        print("failed: " + ", ".join(f"{r['backend']}/{r['tool']}" for r in results if not r["ok"]), file=sys.stderr)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    path = args.pop(0) if args and args[0] not in BACKENDS else os.path.join(HERE, "..", "medical information.csv")
+    sys.exit(main(path, args or list(BACKENDS)))
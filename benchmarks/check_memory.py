@@ -0,0 +1,63 @@
+# check_memory.py — 医生表每行内存占用的测量与回归守卫
+# 用法：python benchmarks/check_memory.py [CSV]；超出预算时退出码为 1
+import os, sys, csv, json, gc, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, "..", "Medical Recommendation System")
+sys.path.insert(0, APP)
+
+from doctor_index import DoctorIndex, _read_rows
+
+# 预算（字节 / 行），以 31k 行的 medical information.csv 为基准，留约 25% 余量
+BUDGET = {
+    "record_bytes_per_row": 480,   # 全量物化 DoctorRecord（驻留分类字段）
+    "index_bytes_per_row": 470,    # 常驻 DoctorIndex（列存 + 分区 + 字典）
+}
+
+def _measure(build):
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, used
+
+def _dict_rows(path):
+    """对照组：旧版逐行 dict + 独立字符串"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return [{
+            "name": (r.get("name") or "").strip(),
+            "speciality": (r.get("speciality") or "").strip(),
+            "average_score": float(r.get("average_score") or 0),
+            "hospital_name": (r.get("hospital_name") or "").strip(),
+            "city": (r.get("city") or "").strip(),
+            "state": (r.get("state") or "").strip(),
+        } for r in csv.DictReader(f)]
+
+def main(path: str) -> int:
+    baseline, b = _measure(lambda: _dict_rows(path))
+    rows = len(baseline)
+    del baseline
+    records, r = _measure(lambda: list(_read_rows(path)))
+    del records
+    index, i = _measure(lambda: DoctorIndex.from_csv(path))
+    report = {
+        "csv": path,
+        "rows": rows,
+        "dict_bytes_per_row": round(b / rows, 1),
+        "record_bytes_per_row": round(r / rows, 1),
+        "index_bytes_per_row": round(i / rows, 1),
+        "index_footprint": index.footprint(),
+        "budget": BUDGET,
+    }
+    over = [k for k, limit in BUDGET.items() if report[k] > limit]
+    report["ok"] = not over
+    print(json.dumps(report, indent=2))
+    if over:
+        print("memory budget exceeded: " + ", ".join(over), file=sys.stderr)
+    return 1 if over else 0
+
+if __name__ == "__main__":
+    default = os.path.join(HERE, "..", "medical information.csv")
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else default))
@@ -0,0 +1,100 @@
+# gen_doctors.py — 合成医生 CSV（列与 medical information.csv 相同），用于基准测试
+# 用法：python benchmarks/gen_doctors.py 1m -o benchmarks/data/doctors_1m.csv
+import os, csv, random, argparse, collections
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEED_CSV = os.path.join(HERE, "..", "medical information.csv")
+
+FIELDS = ["name", "speciality", "average_score", "hospital_name", "city", "state"]
+
+# 没有真实 CSV 时的兜底词表（权重按 Zipf 分布）
+_FALLBACK_SPECS = ["Family Medicine", "Emergency Medicine", "Internal Medicine", "Pediatrics", "Cardiology",
+                   "Orthopedic Surgery", "Obstetrics & Gynecology", "Neurology", "Dermatology", "Psychiatry",
+                   "Gastroenterology", "Ophthalmology", "Urology", "Nephrology", "Pulmonary Disease"]
+_FALLBACK_PLACES = [("New York", "NY"), ("Los Angeles", "CA"), ("Chicago", "IL"), ("Houston", "TX"),
+                    ("Phoenix", "AZ"), ("Philadelphia", "PA"), ("San Antonio", "TX"), ("San Diego", "CA"),
+                    ("Dallas", "TX"), ("Boston", "MA"), ("Seattle", "WA"), ("Denver", "CO")]
+_FIRST = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+          "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Wei", "Priya",
+          "Carlos", "Aisha", "Hiroshi", "Olga", "Mohammed", "Emily", "Daniel", "Grace", "Samuel", "Nina"]
+_LAST = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+         "Hernandez", "Lopez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee",
+         "Zhang", "Patel", "Nguyen", "Kim", "Cohen", "Schmidt", "Rossi", "Ivanova", "Okafor", "Tanaka"]
+_SUFFIX = ["Medical Center", "Hospital", "Clinic", "Health", "Regional Medical Center", "Orthopaedic Clinic"]
+# 评分档权重取自真实数据（半分档，约 30% 满分、28% 无评分）；生成时有评分的档再在 ±0.2 内
+# 按 0.1 步长抖开（夹在 1..5），让评分不全是 0.5 的倍数（float32 下不能精确表示）
+_SCORES = [5, 0, 4.5, 4, 3.5, 3, 2.5, 1, 2, 1.5]
+_SCORE_W = [9182, 8700, 3489, 3461, 2482, 1768, 785, 785, 356, 86]
+_SCORE_JITTER = (-0.2, -0.1, 0.0, 0.1, 0.2)
+_CREDS = ["MD", "DO", "MB", "MB BS"]
+_CRED_W = [28412, 2616, 36, 8]
+
+def parse_size(s: str) -> int:
+    """"30k" / "1m" / "10M" / "2500" -> 行数"""
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+def _score(rnd: random.Random, base: float) -> str:
+    """半分档 -> 0.1 步长的评分串；0（无评分）保持原样"""
+    if not base:
+        return "0"
+    return f"{min(5.0, max(1.0, round(base + rnd.choice(_SCORE_JITTER), 1))):g}"
+
+def _vocab(seed_csv: str):
+    """从真实 CSV 取专科、(city, state) 和医院的频次，保留原有偏斜；没有则用兜底词表"""
+    specs, places, hospitals = collections.Counter(), collections.Counter(), collections.defaultdict(set)
+    if os.path.exists(seed_csv):
+        with open(seed_csv, "r", encoding="utf-8-sig", newline="") as f:
+            for r in csv.DictReader(f):
+                specs[r["speciality"]] += 1
+                places[(r["city"], r["state"])] += 1
+                hospitals[(r["city"], r["state"])].add(r["hospital_name"])
+    if not specs:
+        specs.update({s: 1000 // (i + 1) for i, s in enumerate(_FALLBACK_SPECS)})
+        places.update({p: 1000 // (i + 1) for i, p in enumerate(_FALLBACK_PLACES)})
+    return specs, places, {k: sorted(v) for k, v in hospitals.items()}
+
+def generate(rows: int, out_path: str, seed: int = 42, seed_csv: str = SEED_CSV) -> str:
+    """
+    按真实分布抽样生成 rows 行：专科与地点按原始频次加权（长尾保留），
+    行数超过样本时每个城市按比例多出一些合成医院，医院名基数随规模增长。
+    """
+    rnd = random.Random(seed)
+    specs, places, hospitals = _vocab(seed_csv)
+    spec_v, spec_w = list(specs), list(specs.values())
+    place_v, place_w = list(places), list(places.values())
+    sample_rows = sum(place_w)
+    extra = max(0, rows // max(sample_rows, 1) - 1)  # 每个城市额外的合成医院数
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(FIELDS)
+        done = 0
+        while done < rows:
+            n = min(100_000, rows - done)
+            sp = rnd.choices(spec_v, spec_w, k=n)
+            pl = rnd.choices(place_v, place_w, k=n)
+            sc = rnd.choices(_SCORES, _SCORE_W, k=n)
+            cr = rnd.choices(_CREDS, _CRED_W, k=n)
+            for j in range(n):
+                city, state = pl[j]
+                real = hospitals.get(pl[j]) or [f"{city} {_SUFFIX[0]}"]
+                h = rnd.randrange(len(real) + extra)
+                hosp = real[h] if h < len(real) else f"{city} {_SUFFIX[h % len(_SUFFIX)]} {h - len(real) + 1}"
+                name = f"Dr. {rnd.choice(_FIRST)} {rnd.choice(_LAST)} {done + j}, {cr[j]}"
+                w.writerow((name, sp[j], _score(rnd, sc[j]), hosp, city, state))
+            done += n
+    os.replace(tmp, out_path)
+    return out_path
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Generate a synthetic doctor CSV shaped like medical information.csv.")
+    ap.add_argument("size", help="row count, e.g. 30k, 1m, 10m")
+    ap.add_argument("-o", "--out", help="output CSV (default: benchmarks/data/doctors_<size>.csv)")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+    out = args.out or os.path.join(HERE, "data", f"doctors_{args.size.lower()}.csv")
+    print(generate(parse_size(args.size), out, args.seed))